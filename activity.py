@@ -0,0 +1,118 @@
+"""
+سجل النشاط الأخير لكل مستخدم في الذاكرة (/history و /api/history/{user_id})
+
+لكل مستخدم نشط حلقة بآخر ACTIVITY_SIZE حركة (رهان، ربح، تحويل، إضافة، استرداد)
+تُملأ من مسارات الكتابة نفسها بنفس قيود الدفتر، فعرض السجل لا يستعلم القاعدة.
+أول طلب لمستخدم غير محمل يملأ حلقته باستعلام واحد على الفهرس
+(get_user_transactions)، والمستخدمون الخاملون يُخلون بترتيب LRU عند تجاوز
+ACTIVITY_USERS، فيبقى حجم الذاكرة محدوداً.
+
+الحركة لمستخدم غير محمل لا تُسجل هنا: القاعدة تحملها عند أول قراءة.
+"""
+
+import os
+import logging
+import clock
+from collections import OrderedDict, deque
+from datetime import datetime
+from database import get_user_transactions, ledger_account
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_SIZE = int(os.getenv('ACTIVITY_SIZE', '20'))      # آخر الحركات لكل مستخدم
+ACTIVITY_USERS = int(os.getenv('ACTIVITY_USERS', '10000'))  # المستخدمون في الذاكرة
+
+activity_stats = {
+    "hits": 0,
+    "misses": 0,
+    "recorded": 0,
+    "evicted": 0,
+}
+
+
+def _time(value) -> str:
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)[:19] if value else None
+
+
+class ActivityLog:
+    """{user_id: حلقة آخر الحركات} مع إخلاء LRU"""
+
+    def __init__(self, size: int = ACTIVITY_SIZE, users: int = ACTIVITY_USERS):
+        self.size = size
+        self.users = users
+        self.rings = OrderedDict()   # {user_id: deque(الأقدم أولاً)}
+
+    def record(self, user_id: int, amount: int, type: str, description: str = ""):
+        """إضافة حركة لمستخدم محمل (موجبة للمستلم وسالبة للمرسل كما في transactions)"""
+        ring = self.rings.get(user_id)
+        if ring is None:
+            return
+        ring.append({
+            "amount": amount,
+            "type": type,
+            "description": description,
+            # بتوقيت UTC مثل created_at في القاعدة (الصفوف المحملة)، من ساعة المحرك
+            "created_at": _time(clock.utcnow()),
+        })
+        activity_stats["recorded"] += 1
+
+    def record_postings(self, postings: list):
+        """نفس صفوف transactions التي تكتبها post_ledger_many لهذه القيود"""
+        for from_account, to_account, amount, type, description in postings:
+            if amount <= 0 or ledger_account(from_account) == ledger_account(to_account):
+                continue
+            if from_account > 0:
+                self.record(from_account, -amount, type, description)
+            if to_account > 0:
+                self.record(to_account, amount, type, description)
+
+    def load(self, user_id: int, rows: list) -> deque:
+        """حلقة المستخدم من صفوف القاعدة (الأحدث أولاً). إذا حُملت أثناء الاستعلام تبقى كما هي"""
+        ring = self.rings.get(user_id)
+        if ring is None:
+            ring = deque(
+                ({**row, "created_at": _time(row["created_at"])} for row in reversed(rows)),
+                maxlen=self.size
+            )
+            self.rings[user_id] = ring
+        self.rings.move_to_end(user_id)
+        while len(self.rings) > self.users:
+            self.rings.popitem(last=False)
+            activity_stats["evicted"] += 1
+        return ring
+
+    def recent(self, user_id: int):
+        """الحلقة المحملة (None إذا لم تكن في الذاكرة)"""
+        ring = self.rings.get(user_id)
+        if ring is not None:
+            self.rings.move_to_end(user_id)
+        return ring
+
+    def __len__(self):
+        return len(self.rings)
+
+
+activity_log = ActivityLog()
+
+
+def record_postings(postings: list):
+    activity_log.record_postings(postings)
+
+async def get_activity(user_id: int, limit: int = ACTIVITY_SIZE) -> list:
+    """آخر حركات المستخدم، الأحدث أولاً"""
+    ring = activity_log.recent(user_id)
+    if ring is None:
+        activity_stats["misses"] += 1
+        ring = activity_log.load(user_id, await get_user_transactions(user_id, activity_log.size))
+    else:
+        activity_stats["hits"] += 1
+    return list(reversed(ring))[:max(0, limit)]
+
+def get_activity_stats() -> dict:
+    return {
+        **activity_stats,
+        "users": len(activity_log),
+        "entries": sum(len(ring) for ring in activity_log.rings.values()),
+    }
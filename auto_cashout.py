@@ -0,0 +1,54 @@
+"""
+فهرس الصرف التلقائي للجولة
+
+كومة (heap) مرتبة حسب المضاعف المستهدف: في كل نبضة نسحب فقط الرهانات
+التي تجاوز المضاعف هدفها، فتكلفة النبضة O(k log n) لعدد k من الرهانات المنفذة
+بدلاً من المرور على جميع الرهانات.
+"""
+
+import heapq
+import itertools
+
+MIN_AUTO_CASHOUT = 1.01
+
+
+class AutoCashoutBook:
+    """أهداف الصرف التلقائي لجولة واحدة"""
+
+    def __init__(self):
+        self.round_id = None
+        self._heap = []          # [(target, seq, user_id)]
+        self._targets = {}       # {user_id: target} الأهداف السارية
+        self._seq = itertools.count()
+
+    def reset(self, round_id: int):
+        """بدء جولة جديدة"""
+        self.round_id = round_id
+        self._heap.clear()
+        self._targets.clear()
+
+    def add(self, user_id: int, target: float):
+        """تسجيل هدف صرف تلقائي (يستبدل أي هدف سابق للمستخدم)"""
+        self._targets[user_id] = target
+        heapq.heappush(self._heap, (target, next(self._seq), user_id))
+
+    def cancel(self, user_id: int):
+        """إلغاء الهدف (عند الصرف اليدوي). الحذف من الكومة يتم عند السحب"""
+        self._targets.pop(user_id, None)
+
+    def pop_triggered(self, multiplier: float) -> list:
+        """سحب الرهانات التي وصل المضاعف إلى هدفها: [(user_id, target)]"""
+        triggered = []
+        heap = self._heap
+        while heap and heap[0][0] <= multiplier:
+            target, _, user_id = heapq.heappop(heap)
+            # تجاهل الأهداف الملغاة أو المستبدلة
+            if self._targets.get(user_id) == target:
+                del self._targets[user_id]
+                triggered.append((user_id, target))
+        return triggered
+
+    def __len__(self):
+        return len(self._targets)
+
+auto_cashouts = AutoCashoutBook()
@@ -0,0 +1 @@
+"""أدوات قياس الأداء واختبارات الحمل (لا تُستخدم في التشغيل)"""
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+خادم Bot API محلي بديل لـ Telegram لاختبارات الحمل دون اتصال
+
+الخادم:
+    python -m bench.fake_telegram serve --port 8081 --latency-ms 40 --jitter-ms 20
+
+ثم تشغيل التطبيق موجهاً إليه:
+    TELEGRAM_API_URL=http://localhost:8081 BASE_URL=http://localhost:8000 python main.py
+
+توليد تحديثات واقعية وإرسالها إلى /webhook:
+    python -m bench.fake_telegram load --target http://localhost:8000/webhook \\
+        --updates 20000 --concurrency 64 --users 500
+
+إحصائيات الرسائل الصادرة (sendMessage/answerCallbackQuery و 429):
+    curl http://localhost:8081/stats
+"""
+
+import sys
+import time
+import json
+import random
+import asyncio
+import argparse
+from collections import defaultdict, deque
+from aiohttp import web, ClientSession, ClientTimeout
+
+BOT_INFO = {
+    "id": 100000001,
+    "is_bot": True,
+    "first_name": "Aviator Bench Bot",
+    "username": "aviator_bench_bot",
+}
+
+
+# ==================== الخادم ====================
+class RateLimiter:
+    """حدود Telegram التقريبية: رسالة/ثانية لكل محادثة و 30 رسالة/ثانية إجمالاً"""
+
+    def __init__(self, per_chat: float = 1.0, global_per_second: int = 30):
+        self.per_chat = per_chat
+        self.global_per_second = global_per_second
+        self.last_by_chat = {}
+        self.recent = deque()
+
+    def retry_after(self, chat_id) -> int:
+        """0 إذا سُمح بالإرسال وإلا عدد الثواني للانتظار"""
+        now = time.monotonic()
+        while self.recent and now - self.recent[0] >= 1.0:
+            self.recent.popleft()
+        if len(self.recent) >= self.global_per_second:
+            return 1
+        last = self.last_by_chat.get(chat_id)
+        if last is not None and now - last < self.per_chat:
+            return max(1, int(self.per_chat - (now - last) + 0.999))
+        self.last_by_chat[chat_id] = now
+        self.recent.append(now)
+        return 0
+
+
+class FakeTelegram:
+    """حالة الخادم المزيف وإحصائياته"""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, rate_limit: bool = True):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.limiter = RateLimiter() if rate_limit else None
+        self.webhook_url = ""
+        self.allowed_updates = []
+        self.message_id = 0
+        self.started = time.monotonic()
+        self.calls = defaultdict(int)
+        self.throttled = 0
+        self.sent_messages = 0
+
+    async def _params(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        params = dict(request.query)
+        params.update(await request.post())
+        return {k: (v if isinstance(v, str) else str(v)) for k, v in params.items()}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] += 1
+
+        if self.latency_ms or self.jitter_ms:
+            await asyncio.sleep(max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000)
+
+        handler = getattr(self, f"on_{method}", None)
+        if handler is None:
+            return web.json_response({"ok": True, "result": True})
+        return await handler(params)
+
+    # ---- طرق Bot API ----
+    async def on_getMe(self, params):
+        return web.json_response({"ok": True, "result": BOT_INFO})
+
+    async def on_setWebhook(self, params):
+        self.webhook_url = params.get("url", "")
+        allowed = params.get("allowed_updates") or []
+        self.allowed_updates = json.loads(allowed) if isinstance(allowed, str) else allowed
+        return web.json_response({"ok": True, "result": True, "description": "Webhook was set"})
+
+    async def on_deleteWebhook(self, params):
+        self.webhook_url = ""
+        return web.json_response({"ok": True, "result": True, "description": "Webhook was deleted"})
+
+    async def on_getWebhookInfo(self, params):
+        return web.json_response({"ok": True, "result": {
+            "url": self.webhook_url,
+            "has_custom_certificate": False,
+            "pending_update_count": 0,
+            "max_connections": 100,
+            "allowed_updates": self.allowed_updates,
+        }})
+
+    async def on_sendMessage(self, params):
+        chat_id = int(params.get("chat_id", 0))
+        if self.limiter:
+            retry_after = self.limiter.retry_after(chat_id)
+            if retry_after:
+                self.throttled += 1
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                }, status=429)
+        self.message_id += 1
+        self.sent_messages += 1
+        return web.json_response({"ok": True, "result": {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_INFO,
+            "text": params.get("text", ""),
+        }})
+
+    async def on_answerCallbackQuery(self, params):
+        return web.json_response({"ok": True, "result": True})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        uptime = time.monotonic() - self.started
+        return web.json_response({
+            "uptime": round(uptime, 2),
+            "calls": dict(self.calls),
+            "sent_messages": self.sent_messages,
+            "messages_per_second": round(self.sent_messages / uptime, 2) if uptime else 0,
+            "throttled_429": self.throttled,
+            "webhook_url": self.webhook_url,
+        })
+
+def create_app(fake: FakeTelegram) -> web.Application:
+    app = web.Application()
+    app.router.add_route("*", "/bot{token}/{method}", fake.handle)
+    app.router.add_get("/stats", fake.stats)
+    return app
+
+
+# ==================== مولد التحديثات ====================
+class UpdateGenerator:
+    """تحديثات Telegram واقعية: أوامر /start و /balance و /send و callback queries"""
+
+    # أوزان مزيج الحركة
+    MIX = (
+        ("start", 0.2),
+        ("balance", 0.35),
+        ("send", 0.15),
+        ("round", 0.1),
+        ("check_balance", 0.15),
+        ("send_balance_menu", 0.05),
+    )
+
+    def __init__(self, users: int = 100, base_user_id: int = 5_000_000, seed: int = None):
+        self.rng = random.Random(seed)
+        self.user_ids = [base_user_id + i for i in range(users)]
+        self.update_id = 0
+        self.kinds = [k for k, _ in self.MIX]
+        self.weights = [w for _, w in self.MIX]
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ar"}
+
+    def _message(self, user_id, text):
+        entities = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {
+            "message_id": self.update_id,
+            "from": self._user(user_id),
+            "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+            "date": int(time.time()),
+            "text": text,
+            "entities": entities,
+        }
+
+    def next(self) -> dict:
+        self.update_id += 1
+        user_id = self.rng.choice(self.user_ids)
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+
+        if kind in ("check_balance", "send_balance_menu"):
+            return {
+                "update_id": self.update_id,
+                "callback_query": {
+                    "id": str(self.update_id),
+                    "from": self._user(user_id),
+                    "chat_instance": str(user_id),
+                    "data": kind,
+                    "message": self._message(user_id, "/start"),
+                },
+            }
+        if kind == "send":
+            to_user = self.rng.choice(self.user_ids)
+            text = f"/send {to_user} {self.rng.choice((1, 5, 10))}"
+        else:
+            text = f"/{kind}"
+        return {"update_id": self.update_id, "message": self._message(user_id, text)}
+
+
+async def run_load(target: str, updates: int, concurrency: int, users: int, seed: int = None) -> dict:
+    """إرسال التحديثات إلى /webhook وقياس المعدل وزمن الاستجابة"""
+    generator = UpdateGenerator(users, seed=seed)
+    queue = asyncio.Queue()
+    for _ in range(updates):
+        queue.put_nowait(generator.next())
+
+    latencies = []
+    errors = 0
+
+    async def worker(session):
+        nonlocal errors
+        while True:
+            try:
+                update = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            try:
+                async with session.post(target, json=update) as response:
+                    await response.read()
+                    if response.status >= 400:
+                        errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with ClientSession(timeout=ClientTimeout(total=30)) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2) if latencies else 0
+    return {
+        "updates": updates,
+        "errors": errors,
+        "seconds": round(elapsed, 2),
+        "updates_per_second": round(updates / elapsed, 1) if elapsed else 0,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="خادم Telegram Bot API محلي لاختبارات الحمل")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve", help="تشغيل الخادم المزيف")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8081)
+    serve.add_argument("--latency-ms", type=float, default=30)
+    serve.add_argument("--jitter-ms", type=float, default=10)
+    serve.add_argument("--no-rate-limit", action="store_true")
+
+    load = sub.add_parser("load", help="إرسال تحديثات إلى /webhook")
+    load.add_argument("--target", default="http://127.0.0.1:8000/webhook")
+    load.add_argument("--updates", type=int, default=10000)
+    load.add_argument("--concurrency", type=int, default=50)
+    load.add_argument("--users", type=int, default=200)
+    load.add_argument("--seed", type=int, default=None)
+
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        fake = FakeTelegram(args.latency_ms, args.jitter_ms, not args.no_rate_limit)
+        print(f"🧪 خادم Telegram المزيف على http://{args.host}:{args.port}")
+        web.run_app(create_app(fake), host=args.host, port=args.port, print=None)
+    else:
+        result = asyncio.run(run_load(args.target, args.updates, args.concurrency, args.users, args.seed))
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
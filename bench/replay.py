@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+إعادة تشغيل حركة مسجلة (traffic_recorder) لاختبار تراجع الأداء
+
+1) تسجيل الحركة في الإنتاج (مثلاً ذروة السبت):
+    TRAFFIC_RECORD_FILE=traffic.jsonl.gz python main.py
+
+2) نسخة جديدة بقاعدة محلية و Telegram مزيف:
+    python -m bench.fake_telegram serve --port 8081
+    cd $(mktemp -d) && TELEGRAM_API_URL=http://localhost:8081 ADMIN_ID=1 \\
+        BASE_URL=http://localhost:8000 python /path/to/main.py
+
+3) إعادة التشغيل بالسرعة الأصلية أو أسرع أو بأقصى سرعة:
+    python -m bench.replay run --log traffic.jsonl.gz --speed 10 \\
+        --fund 100000 --admin-id 1 --save baseline.json
+    python -m bench.replay run --log traffic.jsonl.gz --speed 10 \\
+        --fund 100000 --admin-id 1 --baseline baseline.json
+
+مع --baseline يُطبع الفرق لكل نقطة نهاية ويكون رمز الخروج 1 إذا تجاوز
+التراجع --tolerance. ملخص السجل دون إرسال: python -m bench.replay show --log ...
+"""
+
+import sys
+import json
+import gzip
+import time
+import asyncio
+import argparse
+from collections import Counter, defaultdict
+from aiohttp import ClientSession, ClientTimeout
+
+
+def read_log(path: str):
+    """قراءة السجل سطراً سطراً (الذاكرة ثابتة مهما كبر الملف)"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def endpoint_of(entry: dict) -> str:
+    """تجميع الطلبات: الأمر أو نوع الزر للـ webhook، والمسار دون المعرفات للـ API"""
+    if entry["p"] == "/webhook":
+        update = entry.get("b") or {}
+        if "callback_query" in update:
+            return "webhook:callback:" + (update["callback_query"].get("data") or "").split(":")[0]
+        if "inline_query" in update:
+            return "webhook:inline"
+        text = (update.get("message") or {}).get("text") or ""
+        return "webhook:" + (text.split()[0] if text else "message")
+    return f'{entry["m"]} ' + "/".join("{id}" if part.isdigit() else part for part in entry["p"].split("/"))
+
+def log_users(path: str) -> set:
+    users = set()
+    for entry in read_log(path):
+        update = entry.get("b") or {}
+        for key in ("message", "callback_query", "inline_query"):
+            sender = (update.get(key) or {}).get("from") if isinstance(update, dict) else None
+            if sender:
+                users.add(sender["id"])
+        if isinstance(update, dict) and isinstance(update.get("user_id"), int):
+            users.add(update["user_id"])
+    return users
+
+def command_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+            "chat": {"id": user_id, "type": "private"},
+            "date": int(time.time()),
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+        },
+    }
+
+
+# ==================== الإحصائيات ====================
+def percentiles(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2) if latencies else 0
+    return {"p50_ms": pct(0.50), "p95_ms": pct(0.95), "p99_ms": pct(0.99)}
+
+def build_report(latencies: dict, errors: Counter, elapsed: float, send_lag: list, speed) -> dict:
+    total = sum(len(values) for values in latencies.values())
+    return {
+        "speed": speed,
+        "requests": total,
+        "errors": sum(errors.values()),
+        "seconds": round(elapsed, 2),
+        "requests_per_second": round(total / elapsed, 1) if elapsed else 0,
+        **percentiles([latency for values in latencies.values() for latency in values]),
+        "max_send_lag_ms": round(max(send_lag, default=0) * 1000, 2),
+        "endpoints": {
+            name: {"count": len(values), "errors": errors[name], **percentiles(values)}
+            for name, values in sorted(latencies.items())
+        },
+    }
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """أسطر المقارنة مع خط الأساس؛ التي تبدأ بـ ❌ تراجع يتجاوز الحد"""
+    def delta(new, old):
+        return (new - old) / old if old else 0.0
+
+    lines = []
+    def check(name, current, base):
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            change = delta(current[key], base[key])
+            mark = "❌" if change > tolerance else "✅"
+            lines.append(f"{mark} {name} {key}: {base[key]} → {current[key]} ({change:+.1%})")
+        if current["errors"] > base["errors"]:
+            lines.append(f"❌ {name} errors: {base['errors']} → {current['errors']}")
+
+    check("الإجمالي", report, baseline)
+    if report.get("speed") == baseline.get("speed"):
+        change = delta(report["requests_per_second"], baseline["requests_per_second"])
+        mark = "❌" if change < -tolerance else "✅"
+        lines.append(f"{mark} الإجمالي requests/s: {baseline['requests_per_second']} → "
+                     f"{report['requests_per_second']} ({change:+.1%})")
+    for name, current in report["endpoints"].items():
+        base = baseline["endpoints"].get(name)
+        if base:
+            check(name, current, base)
+    return lines
+
+
+# ==================== الإرسال ====================
+async def fund_users(session: ClientSession, target: str, users: set, admin_id: int, amount: int):
+    """تسجيل مستخدمي السجل وشحن أرصدتهم عبر أوامر الأدمن قبل القياس"""
+    update_id = 10 ** 9
+    for user_id in users:
+        for sender, text in ((user_id, "/start"), (admin_id, f"/add {user_id} {amount}")):
+            update_id += 1
+            async with session.post(f"{target}/webhook", json=command_update(update_id, sender, text)) as response:
+                await response.read()
+
+async def run_replay(log: str, target: str, speed: float = None, concurrency: int = 256,
+                     fund: int = 0, admin_id: int = None) -> dict:
+    """إرسال السجل بتوقيته النسبي مقسوماً على speed (None = بأقصى سرعة)"""
+    latencies = defaultdict(list)
+    errors = Counter()
+    send_lag = []
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    async def send(session, entry):
+        name = endpoint_of(entry)
+        url = target + entry["p"] + (f"?{entry['q']}" if entry.get("q") else "")
+        started = time.perf_counter()
+        try:
+            kwargs = {"json": entry["b"]} if entry.get("b") is not None else {}
+            async with session.request(entry["m"], url, **kwargs) as response:
+                await response.read()
+                if response.status >= 500:
+                    errors[name] += 1
+        except Exception:
+            errors[name] += 1
+        finally:
+            latencies[name].append(time.perf_counter() - started)
+            semaphore.release()
+
+    async with ClientSession(timeout=ClientTimeout(total=30)) as session:
+        if fund and admin_id:
+            users = log_users(log)
+            print(f"💰 شحن {len(users)} مستخدم بـ {fund}...")
+            await fund_users(session, target, users, admin_id, fund)
+
+        started = time.perf_counter()
+        first_t = None
+        for entry in read_log(log):
+            if first_t is None:
+                first_t = entry["t"]
+            if speed:
+                due = (entry["t"] - first_t) / speed
+                delay = due - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    send_lag.append(-delay)
+            await semaphore.acquire()
+            task = asyncio.ensure_future(send(session, entry))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    return build_report(latencies, errors, elapsed, send_lag, speed or "max")
+
+def summarize_log(log: str) -> dict:
+    mix = Counter()
+    duration = 0.0
+    recorded = defaultdict(list)
+    for entry in read_log(log):
+        name = endpoint_of(entry)
+        mix[name] += 1
+        recorded[name].append(entry.get("ms", 0) / 1000)
+        duration = entry["t"]
+    total = sum(mix.values())
+    return {
+        "requests": total,
+        "seconds": round(duration, 2),
+        "requests_per_second": round(total / duration, 1) if duration else 0,
+        "endpoints": {name: {"count": count, **percentiles(recorded[name])} for name, count in mix.most_common()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="إعادة تشغيل حركة مسجلة وقياس تراجع الأداء")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="إرسال السجل إلى نسخة من التطبيق")
+    run.add_argument("--log", required=True)
+    run.add_argument("--target", default="http://127.0.0.1:8000")
+    run.add_argument("--speed", default="1", help="1 أو 10 أو أي مضاعف، أو max")
+    run.add_argument("--concurrency", type=int, default=256)
+    run.add_argument("--fund", type=int, default=0, help="شحن كل مستخدم في السجل بهذا الرصيد أولاً")
+    run.add_argument("--admin-id", type=int, default=None, help="ADMIN_ID للنسخة المختبرة (للشحن)")
+    run.add_argument("--baseline", default=None, help="تقرير سابق للمقارنة")
+    run.add_argument("--save", default=None, help="حفظ التقرير كخط أساس")
+    run.add_argument("--tolerance", type=float, default=0.10, help="أقصى تراجع مسموح (0.10 = 10%%)")
+
+    show = sub.add_parser("show", help="ملخص السجل دون إرسال")
+    show.add_argument("--log", required=True)
+
+    args = parser.parse_args(argv)
+    if args.command == "show":
+        print(json.dumps(summarize_log(args.log), ensure_ascii=False, indent=2))
+        return 0
+
+    speed = None if args.speed == "max" else float(args.speed)
+    report = asyncio.run(run_replay(
+        args.log, args.target.rstrip("/"), speed, args.concurrency, args.fund, args.admin_id
+    ))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            lines = compare(report, json.load(f), args.tolerance)
+        print("\n".join(lines))
+        if any(line.startswith("❌") for line in lines):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+محاكاة محرك الجولات بساعة افتراضية
+
+يشغل main.py نفسه (start_new_round → start_counting → counting_tick → end_round)
+على مجدول timer_wheel بساعة افتراضية (clock.VirtualClock): لا نوم بين النبضات،
+فتمر آلاف الجولات الكاملة بسرعة المعالج. اللاعبون المحاكون يراهنون عبر مسار
+/api/bet نفسه (place_bet) ويصرفون يدوياً عبر cash_out أو تلقائياً بالهدف أو
+ينتظرون التسوية، على قاعدة بيانات حقيقية: SQLite في مجلد مؤقت، أو DATABASE_URL
+إن كان مضبوطاً. رسائل التسوية تذهب إلى Telegram المزيف (bench/fake_telegram.py).
+
+التقرير: الزمن الفعلي لكل مرحلة (p50/p95/p99/max) ونتائج الرهانات وسلامة الدفتر.
+--budget يفشل (رمز خروج 1) عند تجاوز الميزانية، للتحقق من التراجع في CI:
+
+    python -m bench.round_sim --rounds 2000 --bettors 40
+    python -m bench.round_sim --rounds 500 --rooms 4 \\
+        --budget "end_round:p95=40,counting_tick:p99=5,bet:p99=10" --save round_sim.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+PHASES = ("start_new_round", "start_counting", "counting_tick", "end_round", "bet", "cashout")
+STATS = ("p50_ms", "p95_ms", "p99_ms", "max_ms")
+
+
+def parse_budget(spec: str) -> list:
+    """ميزانية المراحل: 'end_round:p95=40,bet:p99=10' → [(phase, stat, limit_ms)]"""
+    budget = []
+    for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+        name, _, limit = part.partition("=")
+        phase, _, stat = name.partition(":")
+        stat = f"{stat or 'p95'}_ms"
+        if phase not in PHASES or stat not in STATS:
+            raise ValueError(f"ميزانية غير صالحة: {part} (المراحل: {', '.join(PHASES)})")
+        budget.append((phase, stat, float(limit)))
+    return budget
+
+def phase_report(samples: dict) -> dict:
+    from bench.replay import percentiles
+    return {
+        phase: {"count": len(values), **percentiles(values), "max_ms": round(max(values) * 1000, 2)}
+        for phase, values in sorted(samples.items()) if values
+    }
+
+def check_budget(phases: dict, budget: list) -> list:
+    return [
+        f"{phase} {stat}: {phases.get(phase, {}).get(stat, 0)} > {limit}"
+        for phase, stat, limit in budget
+        if phases.get(phase, {}).get(stat, 0) > limit
+    ]
+
+
+class Bettors:
+    """لاعبون محاكون: رهانات موزعة على وقت الرهان، وصرف يدوي أو تلقائي أو انتظار التسوية"""
+
+    def __init__(self, engine, users: list, bettors: int, auto: float, manual: float, seed: int = None):
+        self.engine = engine
+        self.users = users
+        self.bettors = bettors
+        self.auto = auto
+        self.manual = manual
+        self.rng = random.Random(seed)
+        self.seen = {}          # {room_id: آخر جولة وُزعت رهاناتها}
+        self.outcomes = Counter()
+
+    def on_tick(self):
+        """عند بداية جولة جديدة في أي غرفة: جدولة رهاناتها داخل وقت الرهان"""
+        engine = self.engine
+        for room in engine.rooms.values():
+            if room.status != "betting" or self.seen.get(room.room_id) == room.round_id:
+                continue
+            self.seen[room.room_id] = room.round_id
+            count = min(len(self.users), max(0, int(self.rng.gauss(self.bettors, self.bettors ** 0.5))))
+            window = max(engine.scheduler.tick, room.betting_time_left() - 1)
+            for user_id in self.rng.sample(self.users, count):
+                engine.scheduler.schedule(self.rng.uniform(0, window), self.bet, room, user_id)
+
+    async def bet(self, room, user_id: int):
+        engine = self.engine
+        kind = self.rng.choices(("auto", "manual", "hold"), (self.auto, self.manual, 1 - self.auto - self.manual))[0]
+        target = round(self.rng.uniform(1.2, 6), 2) if kind != "hold" else None
+        data = {"user_id": user_id, "room_id": room.room_id, "amount": self.rng.choice(room.bet_options)}
+        if kind == "auto":
+            data["auto_cashout"] = target
+
+        started = time.perf_counter()
+        response = await engine.place_bet(data)
+        engine.record_phase("bet", time.perf_counter() - started)
+        if isinstance(response, tuple):
+            self.outcomes["bet_rejected"] += 1
+            return
+        self.outcomes[f"bet_{kind}"] += 1
+
+        if kind == "manual":
+            # الصرف عند بلوغ المنحنى الهدف؛ بعد الانفجار يُرفض (متأخر)
+            delay = ((room.betting_end - engine.clock.now()).total_seconds()
+                     + engine.crash_after(target, room.counting_duration))
+            engine.scheduler.schedule(delay, self.cash_out, room, user_id, room.round_id)
+
+    async def cash_out(self, room, user_id: int, round_id: int):
+        engine = self.engine
+        if room.round_id != round_id or room.status != "counting":
+            self.outcomes["cashout_late"] += 1
+            return
+        started = time.perf_counter()
+        response = await engine.cash_out({"user_id": user_id, "room_id": room.room_id})
+        engine.record_phase("cashout", time.perf_counter() - started)
+        self.outcomes["cashout_late" if isinstance(response, tuple) else "cashout_manual"] += 1
+
+
+async def fund_users(engine, users: list, amount: int):
+    for user_id in users:
+        await engine.create_user(user_id, f"sim{user_id}")
+    await engine.post_ledger_many([(engine.MINT_ACCOUNT, user_id, amount, "credit", "رصيد المحاكاة") for user_id in users])
+
+async def simulate(args) -> dict:
+    from aiohttp import web
+    from bench.fake_telegram import FakeTelegram, create_app
+    import main as engine
+    from clock import VirtualClock, use_clock
+    from rooms import add_room
+    from ledger import verify
+    from database import USE_POSTGRES
+
+    telegram = web.AppRunner(create_app(FakeTelegram(latency_ms=args.telegram_latency_ms, rate_limit=False)))
+    await telegram.setup()
+    await web.TCPSite(telegram, "127.0.0.1", args.telegram_port).start()
+    try:
+        await engine.init_db()
+        engine.load_rooms()
+        for i in range(args.rooms - len(engine.rooms)):
+            add_room(f"sim{i + 1}", round_duration=engine.ROUND_DURATION, betting_duration=engine.BETTING_DURATION,
+                     private=True)
+        await asyncio.gather(engine.load_leaderboards(), engine.load_round_history(list(engine.rooms)),
+                             engine.result_engine.load())
+        # توليد السلاسل قبل القياس حتى لا يظهر في زمن أول جولة
+        for room_id in engine.rooms:
+            if room_id not in engine.result_engine.chains:
+                await engine.result_engine.rotate(room_id)
+
+        users = list(range(args.base_user_id, args.base_user_id + args.users))
+        await fund_users(engine, users, args.balance)
+
+        virtual = VirtualClock()
+        use_clock(virtual)
+        engine.phase_samples = {}
+        bettors = Bettors(engine, users, args.bettors, args.auto, args.manual, args.seed)
+
+        def done() -> bool:
+            bettors.on_tick()
+            return len(engine.phase_samples.get("end_round", ())) >= args.rounds
+
+        longest = max(room.round_duration for room in engine.rooms.values())
+        horizon = (args.rounds / len(engine.rooms) + 1) * (longest + engine.ROUND_PAUSE) * 2
+
+        for room in engine.rooms.values():
+            engine.schedule_room(room, 0, engine.start_new_round)
+        started_at = virtual.now()
+        wall = time.perf_counter()
+        await engine.scheduler.run_virtual(virtual, horizon, done)
+        wall = time.perf_counter() - wall
+        for room in engine.rooms.values():
+            if room.timer:
+                room.timer.cancel()
+
+        virtual_seconds = (virtual.now() - started_at).total_seconds()
+        rounds = len(engine.phase_samples.get("end_round", ()))
+        pending = await engine.flush_deferred_writes(10)
+        return {
+            "rounds": rounds,
+            "rooms": len(engine.rooms),
+            "database": "postgresql" if USE_POSTGRES else "sqlite",
+            "virtual_seconds": round(virtual_seconds),
+            "wall_seconds": round(wall, 2),
+            "speedup": round(virtual_seconds / wall, 1) if wall else None,
+            "rounds_per_second": round(rounds / wall, 1) if wall else None,
+            "phases": phase_report(engine.phase_samples),
+            "outcomes": dict(sorted(bettors.outcomes.items())),
+            "timer_wheel": engine.scheduler.snapshot(),
+            "deferred_writes_left": pending,
+            "ledger_ok": await verify() == 0,
+        }
+    finally:
+        session = await engine.bot.get_session()
+        await session.close()
+        await telegram.cleanup()
+
+def summary(report: dict) -> list:
+    lines = [
+        f"🎮 {report['rounds']} جولة في {report['rooms']} غرفة ({report['database']}): "
+        f"{report['virtual_seconds']} ث افتراضية في {report['wall_seconds']} ث "
+        f"(x{report['speedup']}، {report['rounds_per_second']} جولة/ث)",
+        f"{'المرحلة':<18}{'العدد':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}",
+    ]
+    for phase, stats in report["phases"].items():
+        lines.append(f"{phase:<18}{stats['count']:>9}{stats['p50_ms']:>9}{stats['p95_ms']:>9}"
+                     f"{stats['p99_ms']:>9}{stats['max_ms']:>9}")
+    lines.append(" | ".join(f"{name}={count}" for name, count in report["outcomes"].items()))
+    lines.append("✅ الدفتر سليم" if report["ledger_ok"] else "❌ الدفتر غير متوازن")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="محاكاة محرك الجولات بساعة افتراضية")
+    parser.add_argument("--rounds", type=int, default=1000, help="عدد الجولات المنتهية (كل الغرف)")
+    parser.add_argument("--rooms", type=int, default=1, help="تضاف غرف خاصة حتى هذا العدد")
+    parser.add_argument("--bettors", type=int, default=30, help="متوسط الرهانات لكل جولة في الغرفة")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--base-user-id", type=int, default=7_000_000)
+    parser.add_argument("--balance", type=int, default=10_000_000)
+    parser.add_argument("--auto", type=float, default=0.4, help="نسبة الصرف التلقائي")
+    parser.add_argument("--manual", type=float, default=0.3, help="نسبة الصرف اليدوي (الباقي ينتظر التسوية)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--telegram-port", type=int, default=8768)
+    parser.add_argument("--telegram-latency-ms", type=float, default=0)
+    parser.add_argument("--workdir", default=None, help="مجلد قاعدة SQLite وسلاسل النتائج (مؤقت افتراضياً)")
+    parser.add_argument("--budget", default=None, help="مثل end_round:p95=40,bet:p99=10 (بالمللي ثانية)")
+    parser.add_argument("--save", default=None)
+    args = parser.parse_args(argv)
+    budget = parse_budget(args.budget)
+
+    # قبل استيراد main: البوت والإعدادات تُقرأ عند الاستيراد، والمسارات النسبية في workdir
+    save = os.path.abspath(args.save) if args.save else None
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix="round-sim-"))
+    os.environ.setdefault("BOT_TOKEN", "123456:SIMULATION")
+    os.environ.setdefault("ADMIN_ID", "1")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{args.telegram_port}"
+
+    report = asyncio.run(simulate(args))
+    report["budget_violations"] = check_budget(report["phases"], budget)
+    print(json.dumps(report, ensure_ascii=False, indent=2, default=str))
+    print("\n".join(summary(report)))
+    for violation in report["budget_violations"]:
+        print(f"❌ تجاوز الميزانية: {violation}")
+    if save:
+        with open(save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    return 1 if report["budget_violations"] or not report["ledger_ok"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
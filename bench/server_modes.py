@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+مقارنة أوضاع تشغيل الخادم (server.py): dev (asyncio + h11) و production (uvloop + httptools)
+
+لكل وضع: نسخة جديدة من التطبيق بقاعدة SQLite مؤقتة و Telegram مزيف، ثم نفس الحمل
+(استطلاعات /api/round و /api/multiplier و /api/history وتحديثات /webhook)، ثم
+SIGTERM وقياس زمن الإيقاف (التصريف).
+
+    python -m bench.server_modes --requests 20000 --concurrency 128
+    python -m bench.server_modes --modes production --save production.json
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import Counter, defaultdict
+from aiohttp import web, ClientSession, ClientTimeout
+from bench.fake_telegram import FakeTelegram, UpdateGenerator, create_app
+from bench.replay import percentiles
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# مزيج الحركة: الاستطلاعات هي الأكثف أثناء الجولة
+MIX = (
+    ("GET /api/round", 0.4),
+    ("GET /api/multiplier", 0.3),
+    ("GET /api/history", 0.1),
+    ("POST /webhook", 0.2),
+)
+
+
+async def start_fake_telegram(port: int) -> web.AppRunner:
+    runner = web.AppRunner(create_app(FakeTelegram(latency_ms=5, jitter_ms=2, rate_limit=False)))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+def start_app(mode: str, port: int, telegram_port: int, workdir: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "SERVER_MODE": mode,
+        "PORT": str(port),
+        "BOT_TOKEN": "123456:BENCH",
+        "ADMIN_ID": "1",
+        "BASE_URL": f"http://127.0.0.1:{port}",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{telegram_port}",
+        "LOG_LEVEL": "WARNING",
+        "DATABASE_URL": "",
+    }
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py")], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+async def wait_ready(session: ClientSession, target: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{target}/api/round") as response:
+                if response.status == 200 and (await response.json()).get("round_id"):
+                    return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"التطبيق لم يبدأ خلال {timeout} ث")
+
+async def run_load(session: ClientSession, target: str, requests: int, concurrency: int, seed: int = 1) -> dict:
+    rng = random.Random(seed)
+    updates = UpdateGenerator(users=200, seed=seed)
+    kinds = rng.choices([k for k, _ in MIX], [w for _, w in MIX], k=requests)
+    latencies = defaultdict(list)
+    errors = Counter()
+    queue = asyncio.Queue()
+    for kind in kinds:
+        queue.put_nowait(kind)
+
+    async def worker():
+        while not queue.empty():
+            kind = queue.get_nowait()
+            method, path = kind.split(" ", 1)
+            kwargs = {"json": updates.next()} if method == "POST" else {}
+            started = time.perf_counter()
+            try:
+                async with session.request(method, target + path, **kwargs) as response:
+                    await response.read()
+                    if response.status >= 500:
+                        errors[kind] += 1
+            except Exception:
+                errors[kind] += 1
+            latencies[kind].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "errors": sum(errors.values()),
+        "seconds": round(elapsed, 2),
+        "requests_per_second": round(requests / elapsed, 1) if elapsed else 0,
+        **percentiles([latency for values in latencies.values() for latency in values]),
+        "endpoints": {kind: {"count": len(values), "errors": errors[kind], **percentiles(values)}
+                      for kind, values in sorted(latencies.items())},
+    }
+
+async def bench_mode(mode: str, requests: int, concurrency: int, port: int, telegram_port: int) -> dict:
+    with tempfile.TemporaryDirectory() as workdir:
+        process = start_app(mode, port, telegram_port, workdir)
+        target = f"http://127.0.0.1:{port}"
+        try:
+            async with ClientSession(timeout=ClientTimeout(total=30)) as session:
+                await wait_ready(session, target)
+                await run_load(session, target, min(1000, requests), concurrency)   # إحماء
+                report = await run_load(session, target, requests, concurrency)
+        finally:
+            started = time.perf_counter()
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=120)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            report_shutdown = round(time.perf_counter() - started, 2)
+    return {"mode": mode, **report, "shutdown_seconds": report_shutdown, "exit_code": process.returncode}
+
+async def run(modes: list, requests: int, concurrency: int, port: int, telegram_port: int) -> list:
+    telegram = await start_fake_telegram(telegram_port)
+    try:
+        return [await bench_mode(mode, requests, concurrency, port, telegram_port) for mode in modes]
+    finally:
+        await telegram.cleanup()
+
+def summary(reports: list) -> list:
+    lines = [f"{'الوضع':<12}{'req/s':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'أخطاء':>8}{'إيقاف':>9}"]
+    for r in reports:
+        lines.append(f"{r['mode']:<12}{r['requests_per_second']:>10}{r['p50_ms']:>9}{r['p95_ms']:>9}"
+                     f"{r['p99_ms']:>9}{r['errors']:>8}{r['shutdown_seconds']:>9}")
+    if len(reports) == 2 and reports[0]["requests_per_second"]:
+        ratio = reports[1]["requests_per_second"] / reports[0]["requests_per_second"]
+        lines.append(f"{reports[1]['mode']} / {reports[0]['mode']}: {ratio:.2f}x")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="مقارنة أوضاع تشغيل الخادم")
+    parser.add_argument("--modes", default="dev,production")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=128)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--telegram-port", type=int, default=8766)
+    parser.add_argument("--save", default=None)
+    args = parser.parse_args(argv)
+
+    reports = asyncio.run(run(args.modes.split(","), args.requests, args.concurrency, args.port, args.telegram_port))
+    print(json.dumps(reports, ensure_ascii=False, indent=2))
+    print("\n".join(summary(reports)))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+قاطع دائرة لقاعدة البيانات
+
+- closed: كل الاستدعاءات تمر، وتُسجل نتيجتها وزمنها في نافذة متحركة
+- open: يُفتح عند تجاوز نسبة الأخطاء أو نسبة الاستدعاءات البطيئة في النافذة،
+  فترفض الاستدعاءات فوراً بدل انتظار مهلة الاتصال
+- half_open: بعد مهلة التبريد يُرسل استعلامات فحص (probe) خفيفة، وعند نجاح
+  عدد متتالٍ منها يُغلق القاطع من جديد، وأي فشل يعيد فتحه
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+from log_pipeline import log_context
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseUnavailable(Exception):
+    """قاعدة البيانات غير متاحة مؤقتاً (القاطع مفتوح)"""
+
+
+class CircuitBreaker:
+    """قاطع دائرة بحسب الأخطاء وزمن الاستجابة"""
+
+    def __init__(self, probe, window: int = 50, min_calls: int = 10,
+                 error_rate: float = 0.5, slow_call_seconds: float = 1.0,
+                 slow_rate: float = 0.5, open_seconds: float = 10.0,
+                 probe_successes: int = 3, on_close=None):
+        self.probe = probe                    # دالة async لفحص قاعدة البيانات
+        self.window = deque(maxlen=window)    # [(نجح؟, الزمن بالثواني)]
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.probe_successes = probe_successes
+        self.on_close = on_close
+
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._probe_task = None
+        self.stats = {
+            "trips": 0,
+            "rejected": 0,
+            "probes": 0,
+            "probe_failures": 0,
+            "last_trip_reason": None,
+            "last_trip_at": None,
+        }
+
+    # ---- الحالة ----
+    def allow(self) -> bool:
+        """هل يُسمح بالاستدعاء الآن؟ (يبدأ الفحص عند انتهاء التبريد)"""
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = "half_open"
+            self._probe_task = asyncio.ensure_future(self._run_probes())
+        self.stats["rejected"] += 1
+        return False
+
+    def record(self, ok: bool, latency: float):
+        """تسجيل نتيجة استدعاء وفتح القاطع عند الحاجة"""
+        if self.state != "closed":
+            return
+        self.window.append((ok, latency))
+        if len(self.window) < self.min_calls:
+            return
+        calls = len(self.window)
+        failures = sum(1 for ok, _ in self.window if not ok)
+        slow = sum(1 for _, latency in self.window if latency >= self.slow_call_seconds)
+        if failures / calls >= self.error_rate:
+            self.trip(f"أخطاء {failures}/{calls}")
+        elif slow / calls >= self.slow_rate:
+            self.trip(f"بطء {slow}/{calls} فوق {self.slow_call_seconds}s")
+
+    def trip(self, reason: str):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.window.clear()
+        self.stats["trips"] += 1
+        self.stats["last_trip_reason"] = reason
+        self.stats["last_trip_at"] = time.time()
+        logger.error("🔌 فتح قاطع قاعدة البيانات: %s", reason, extra=log_context("db"))
+
+    def close(self):
+        self.state = "closed"
+        self.window.clear()
+        logger.info("✅ إغلاق قاطع قاعدة البيانات: عادت الخدمة", extra=log_context("db"))
+        if self.on_close:
+            self.on_close()
+
+    async def _run_probes(self):
+        """استعلامات فحص متتالية قبل إعادة فتح الحركة"""
+        for _ in range(self.probe_successes):
+            self.stats["probes"] += 1
+            started = time.perf_counter()
+            try:
+                await self.probe()
+                slow = time.perf_counter() - started >= self.slow_call_seconds
+            except Exception as e:
+                slow, error = True, e
+            else:
+                error = None
+            if slow:
+                self.stats["probe_failures"] += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                logger.warning("⚠️ فشل فحص قاعدة البيانات: %s", error or 'استجابة بطيئة', extra=log_context("db"))
+                return
+        self.close()
+
+    # ---- المقاييس ----
+    def snapshot(self) -> dict:
+        latencies = sorted(latency for _, latency in self.window)
+        calls = len(self.window)
+        return {
+            "state": self.state,
+            **self.stats,
+            "window_calls": calls,
+            "window_error_rate": round(sum(1 for ok, _ in self.window if not ok) / calls, 3) if calls else 0,
+            "window_p95_ms": round(latencies[int(0.95 * (calls - 1))] * 1000, 2) if calls else 0,
+        }
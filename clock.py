@@ -0,0 +1,63 @@
+"""
+ساعة محرك الجولات
+
+كل أوقات الجولة (بداية الرهان ونهايته، المنحنى، موعد الجولة التالية، server_time
+في البث) تُقرأ من هنا بدل datetime.now() مباشرة، فيمكن استبدالها بساعة افتراضية:
+bench/round_sim.py يشغل آلاف الجولات الكاملة بسرعة المعالج بتقديم الساعة
+ومجدول timer_wheel معاً نبضة بنبضة (TimerWheel.run_virtual).
+
+utcnow() نفس اللحظة بتوقيت UTC (بلا منطقة زمنية) لمقارنتها بأوقات القاعدة:
+CURRENT_TIMESTAMP في SQLite يكتب UTC.
+
+الإنتاج يستخدم ساعة النظام دائماً؛ use_clock للمحاكاة فقط.
+"""
+
+import time
+from datetime import datetime, timedelta, timezone
+
+
+class SystemClock:
+    """ساعة النظام"""
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def time(self) -> float:
+        return time.time()
+
+
+class VirtualClock:
+    """ساعة افتراضية لا تتقدم إلا بـ advance()"""
+
+    def __init__(self, start: datetime = None):
+        self._now = start or datetime.now()
+
+    def now(self) -> datetime:
+        return self._now
+
+    def time(self) -> float:
+        return self._now.timestamp()
+
+    def advance(self, seconds: float):
+        self._now += timedelta(seconds=seconds)
+
+
+_clock = SystemClock()
+
+
+def use_clock(clock):
+    """استبدال ساعة المحرك (يعيد السابقة)"""
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
+
+def now() -> datetime:
+    return _clock.now()
+
+def utcnow() -> datetime:
+    """لحظة الساعة الحالية بتوقيت UTC مثل أعمدة CURRENT_TIMESTAMP"""
+    return datetime.fromtimestamp(_clock.time(), timezone.utc).replace(tzinfo=None)
+
+def time_ms() -> int:
+    """الوقت بالمللي ثانية (server_time للعميل)"""
+    return int(_clock.time() * 1000)
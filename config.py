@@ -1,5 +1,6 @@
 import os
 import sys
+import json
 from dotenv import load_dotenv
 
 # تحميل متغيرات البيئة
@@ -9,6 +10,12 @@ load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN', '').strip()
 ADMIN_ID_STR = os.getenv('ADMIN_ID', '').strip()
 
+# رابط Bot API (يمكن توجيهه لخادم محلي للاختبارات: bench/fake_telegram.py)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').strip().rstrip('/')
+
+# مفتاح واجهات الأدمن (ترويسة X-Admin-Key)؛ إذا كان فارغاً تبقى الواجهات معطلة
+ADMIN_API_KEY = os.getenv('ADMIN_API_KEY', '').strip()
+
 # ==================== إعدادات Railway ====================
 RAILWAY_PUBLIC_DOMAIN = os.getenv('RAILWAY_PUBLIC_DOMAIN', '').strip()
 RAILWAY_STATIC_URL = os.getenv('RAILWAY_STATIC_URL', '').strip()
@@ -26,6 +33,28 @@ PORT = int(os.getenv('PORT', '8000'))
 ROUND_DURATION = 60
 BETTING_DURATION = 30
 BET_OPTIONS = [10, 50, 100, 500, 1000, 5000]
+TICK_INTERVAL = float(os.getenv('TICK_INTERVAL', '0.2'))  # نبضة مرحلة العد بالثواني
+
+# مدة احتفاظ تيليجرام بإجابة الوضع المضمن (@bot) لكل مستخدم بالثواني
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '5'))
+
+# الإيقاف (SIGTERM): أقصى انتظار لانفجار الجولات الجارية وتسويتها، وملف ما لم يُسوَّ
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', '45'))
+DRAIN_SNAPSHOT_FILE = os.getenv('DRAIN_SNAPSHOT_FILE', 'unsettled_bets.jsonl')
+
+# ==================== الغرف ====================
+# لكل غرفة إعداداتها الخاصة؛ الغرف الخاصة (private) لا تظهر في القائمة
+# ويُدخل إليها بالرابط فقط. يمكن استبدال القائمة بمتغير ROOMS بصيغة JSON.
+DEFAULT_ROOM = 'main'
+ROOMS = json.loads(os.getenv('ROOMS', '').strip() or 'null') or [
+    {"id": DEFAULT_ROOM, "title": "الغرفة الرئيسية", "round_duration": ROUND_DURATION,
+     "betting_duration": BETTING_DURATION, "bet_options": BET_OPTIONS},
+    {"id": "fast", "title": "الغرفة السريعة", "round_duration": 15,
+     "betting_duration": 7, "bet_options": [10, 50, 100, 500]},
+    {"id": "vip", "title": "غرفة كبار اللاعبين", "round_duration": 60,
+     "betting_duration": 30, "bet_options": [1000, 5000, 10000, 50000]},
+]
+TIMER_WHEEL_TICK = float(os.getenv('TIMER_WHEEL_TICK', '0.05'))  # دقة مجدول الغرف بالثواني
 
 # تحويل ADMIN_ID لرقم
 try:
@@ -78,6 +107,7 @@ def validate_config():
     print(f"🎮 ROUND_DURATION: {ROUND_DURATION} ثانية")
     print(f"🎮 BETTING_DURATION: {BETTING_DURATION} ثانية")
     print(f"🎮 BET_OPTIONS: {BET_OPTIONS}")
+    print(f"🏠 ROOMS: {', '.join(room['id'] for room in ROOMS)}")
     print(f"🌐 PORT: {PORT}")
     
     # عرض التحذيرات
@@ -1,24 +1,505 @@
 import os
-import asyncpg
+import time
+import asyncio
+import functools
 import json
+import hashlib
+import inspect
+import logging
+import contextvars
+from collections import OrderedDict, defaultdict, deque
 from datetime import datetime
-from config import ADMIN_ID
+from config import ADMIN_ID, DEFAULT_ROOM
+from circuit_breaker import CircuitBreaker, DatabaseUnavailable
+from log_pipeline import log_context
+
+logger = logging.getLogger(__name__)
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
+# استيراد مشغل قاعدة البيانات المستخدمة فقط (asyncpg بطيء التحميل)
 if DATABASE_URL and DATABASE_URL.startswith('postgresql://'):
     USE_POSTGRES = True
+    import asyncpg
 else:
     USE_POSTGRES = False
     import sqlite3
 
-async def get_postgres_connection():
-    return await asyncpg.connect(DATABASE_URL)
+# مهلات قصيرة حتى يظهر بطء قاعدة البيانات كأخطاء يراها قاطع الدائرة
+DB_CONNECT_TIMEOUT = float(os.environ.get('DB_CONNECT_TIMEOUT', '5'))
+DB_COMMAND_TIMEOUT = float(os.environ.get('DB_COMMAND_TIMEOUT', '10'))
+
+# ==================== التقسيم الأفقي حسب المستخدم (Sharding) ====================
+# DATABASE_SHARDS (اختياري): قواعد المستخدمين مفصولة بفواصل، روابط PostgreSQL أو
+# ملفات SQLite حسب نوع DATABASE_URL. المستخدم وصفوف users/transactions/bets وقيود
+# دفتره في قاعدة واحدة منها (shard)، والجولات والإحصائيات والمتصدرون ودليل
+# user_shards في القاعدة المنسقة (DATABASE_URL أو game.db).
+# shard = None تعني القاعدة المنسقة (وهي الوحيدة بلا تقسيم).
+# للاختبار محلياً: DATABASE_SHARDS=shard0.db,shard1.db,shard2.db
+# أو DATABASE_SHARDS=postgresql://localhost/aviator_s0,postgresql://localhost/aviator_s1
+SQLITE_PATH = 'game.db'
+DATABASE_SHARDS = [url.strip() for url in os.environ.get('DATABASE_SHARDS', '').split(',') if url.strip()]
+if any(url.startswith('postgresql://') != USE_POSTGRES for url in DATABASE_SHARDS):
+    raise ValueError("DATABASE_SHARDS يجب أن تكون من نوع DATABASE_URL نفسه (PostgreSQL أو SQLite)")
+
+async def get_postgres_connection(shard: int = None):
+    url = DATABASE_URL if shard is None else DATABASE_SHARDS[shard]
+    return await asyncpg.connect(url, timeout=DB_CONNECT_TIMEOUT, command_timeout=DB_COMMAND_TIMEOUT)
+
+def sqlite_connect(shard: int = None, **kwargs):
+    return sqlite3.connect(SQLITE_PATH if shard is None else DATABASE_SHARDS[shard], **kwargs)
+
+# ==================== توجيه القراءة إلى النسخة المتماثلة ====================
+# دوال القراءة فقط تستخدم DATABASE_REPLICA_URL إن وُجد، إلا إذا:
+# - كتب المستخدم/الجولة قبل أقل من REPLICA_STICKY_SECONDS (قراءة ما كتبته)
+# - تأخرت النسخة المتماثلة أكثر من REPLICA_MAX_LAG ثانية أو تعذر الاتصال بها
+# للاختبار تكفي قاعدتان محليتان: DATABASE_URL=postgresql://localhost/aviator
+# DATABASE_REPLICA_URL=postgresql://localhost/aviator_replica (تُعامل بتأخر صفر)
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL') if USE_POSTGRES else None
+REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', '5'))
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', '2'))
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', '1'))
+
+# التأخر بالثواني؛ صفر إذا لم تكن النسخة في وضع الاستعادة (قاعدة محلية بديلة)
+# أو إذا طبقت كل ما استلمته (الرئيسية خاملة)
+REPLICA_LAG_QUERY = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+'''
+
+replica_stats = {
+    "enabled": bool(DATABASE_REPLICA_URL),
+    "replica_reads": 0,
+    "primary_reads": 0,
+    "sticky_reads": 0,
+    "lagging_reads": 0,
+    "errors": 0,
+    "lag": None,
+}
+_replica_checked_at = 0.0
+_replica_healthy = True
+_sticky_until = {}   # {(اسم_دالة_القراءة, المعاملات): وقت انتهاء التوجيه للرئيسية}
+
+def mark_written(name: str, *args):
+    """توجيه قراءات name(*args...) للقاعدة الرئيسية لفترة بعد الكتابة"""
+    if not DATABASE_REPLICA_URL:
+        return
+    now = time.monotonic()
+    _sticky_until[(name, args)] = now + REPLICA_STICKY_SECONDS
+    # تنظيف المنتهي حتى لا يكبر القاموس مع عدد المستخدمين
+    if len(_sticky_until) > 10000:
+        for key in [k for k, until in _sticky_until.items() if until <= now]:
+            del _sticky_until[key]
+
+def _is_sticky(name: str, args: tuple) -> bool:
+    now = time.monotonic()
+    for i in range(len(args) + 1):
+        until = _sticky_until.get((name, args[:i]))
+        if until is not None and until > now:
+            return True
+    return False
+
+async def _replica_usable() -> bool:
+    """فحص تأخر النسخة المتماثلة (مرة كل REPLICA_LAG_CHECK_INTERVAL على الأكثر)"""
+    global _replica_checked_at, _replica_healthy
+    now = time.monotonic()
+    if now - _replica_checked_at >= REPLICA_LAG_CHECK_INTERVAL:
+        _replica_checked_at = now
+        try:
+            conn = await asyncpg.connect(DATABASE_REPLICA_URL, timeout=2)
+            try:
+                replica_stats["lag"] = float(await conn.fetchval(REPLICA_LAG_QUERY))
+            finally:
+                await conn.close()
+            _replica_healthy = True
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+            _replica_healthy = False
+            replica_stats["errors"] += 1
+            logger.warning("⚠️ النسخة المتماثلة غير متاحة: %s", e, extra=log_context("db"))
+    return _replica_healthy and (replica_stats["lag"] or 0) <= REPLICA_MAX_LAG
+
+async def get_read_connection(name: str, *args, shard: int = None):
+    """اتصال لاستعلام قراءة فقط: النسخة المتماثلة إن أمكن وإلا الرئيسية"""
+    global _replica_healthy
+    if shard is not None:
+        # النسخة المتماثلة للقاعدة المنسقة فقط
+        return await get_postgres_connection(shard)
+    if DATABASE_REPLICA_URL:
+        if _is_sticky(name, args):
+            replica_stats["sticky_reads"] += 1
+        elif not await _replica_usable():
+            replica_stats["lagging_reads"] += 1
+        else:
+            try:
+                conn = await asyncpg.connect(DATABASE_REPLICA_URL, timeout=2)
+                replica_stats["replica_reads"] += 1
+                return conn
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+                _replica_healthy = False
+                replica_stats["errors"] += 1
+                logger.warning("⚠️ فشل الاتصال بالنسخة المتماثلة، القراءة من الرئيسية: %s", e,
+                               extra=log_context("db"))
+    replica_stats["primary_reads"] += 1
+    return await get_postgres_connection()
+
+def get_replica_stats() -> dict:
+    return {**replica_stats, "sticky_keys": len(_sticky_until)}
+
+# ==================== دمج الاستعلامات المتزامنة (Single-flight) ====================
+# الاستدعاءات المتزامنة لنفس دالة القراءة بنفس المعاملات تشترك في استعلام واحد
+SINGLE_FLIGHT_DISABLED = {
+    name.strip() for name in os.environ.get('SINGLE_FLIGHT_DISABLED', '').split(',') if name.strip()
+}
+SINGLE_FLIGHT_ENABLED = {}   # {اسم_الدالة: مفعل؟}
+single_flight_stats = {}     # {اسم_الدالة: {"calls", "queries", "saved"}}
+_in_flight = {}              # {(اسم_الدالة, المعاملات بالترتيب): Task}
+
+def _call_args(signature: inspect.Signature, args: tuple, kwargs: dict) -> tuple:
+    """كل المعاملات بترتيب التعريف (الممررة بالاسم والافتراضية أيضاً)"""
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    return tuple(bound.arguments.values())
+
+def single_flight(func):
+    """مشاركة نتيجة الاستعلام الجاري بين الاستدعاءات المتزامنة المتطابقة"""
+    name = func.__name__
+    signature = inspect.signature(func)
+    SINGLE_FLIGHT_ENABLED[name] = name not in SINGLE_FLIGHT_DISABLED
+    single_flight_stats[name] = {"calls": 0, "queries": 0, "saved": 0}
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        stats = single_flight_stats[name]
+        stats["calls"] += 1
+
+        if not SINGLE_FLIGHT_ENABLED.get(name, True):
+            stats["queries"] += 1
+            return await func(*args, **kwargs)
+
+        # المفتاح بالترتيب حتى يطابق single_flight_forget الاستدعاء بالاسم والموضع معاً
+        key = (name, _call_args(signature, args, kwargs))
+        task = _in_flight.get(key)
+        if task is not None:
+            stats["saved"] += 1
+        else:
+            stats["queries"] += 1
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            _in_flight[key] = task
+            task.add_done_callback(lambda t: _in_flight.get(key) is t and _in_flight.pop(key))
+
+        # shield حتى لا يلغي خروج أحد المنتظرين الاستعلام على البقية
+        return await asyncio.shield(task)
+
+    return wrapper
+
+def single_flight_forget(name: str, *args):
+    """فصل الاستعلامات الجارية عن المستدعين الجدد (args: بادئة معاملات دالة القراءة بالترتيب)"""
+    # نفس المفاتيح تحدد ما يُقرأ من الرئيسية بعد الكتابة (قراءة ما كتبته)
+    mark_written(name, *args)
+    for key in [k for k in _in_flight if k[0] == name and k[1][:len(args)] == args]:
+        del _in_flight[key]
+
+def forgets(keys):
+    """دالة كتابة تفصل القراءات التي تغيرها قبل التنفيذ وبعد نجاحه
+
+    keys(المعاملات) تعيد [(اسم دالة القراءة, *بادئة معاملاتها)]. الفصل بعد النجاح
+    ضروري: قراءة بدأت أثناء الكتابة (قبل الحفظ) تصبح الاستعلام الجاري وتعيد القيمة
+    القديمة لكل من يصل بعد الحفظ. تُوضع تحت @guarded حتى يشمل الفصل الإعادة المؤجلة.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            targets = list(keys(bound.arguments))
+            for name, *prefix in targets:
+                single_flight_forget(name, *prefix)
+            result = await func(*args, **kwargs)
+            for name, *prefix in targets:
+                single_flight_forget(name, *prefix)
+            return result
+
+        return wrapper
+    return decorator
+
+def get_single_flight_stats() -> dict:
+    """إحصائيات الاستعلامات الموفرة لكل دالة"""
+    return {
+        name: {**stats, "enabled": SINGLE_FLIGHT_ENABLED.get(name, True)}
+        for name, stats in single_flight_stats.items()
+    }
+
+# ==================== قاطع الدائرة والخدمة المتدهورة ====================
+# كل دالة قاعدة بيانات محمية بـ @guarded:
+# - read: تحفظ آخر نتيجة ناجحة لكل معاملات، وتعيدها بينما القاطع مفتوح
+# - write: ترفض فوراً بـ DatabaseUnavailable بينما القاطع مفتوح
+# - defer: كتابات محاسبة الجولة تُؤجل في طابور وتُعاد بالترتيب عند الإغلاق
+DB_SNAPSHOT_SIZE = int(os.environ.get('DB_SNAPSHOT_SIZE', '10000'))
+DEFERRED_WRITES_LIMIT = int(os.environ.get('DEFERRED_WRITES_LIMIT', '10000'))
+# ما لم يُعد من الكتابات المؤجلة عند الإيقاف (سطر JSON لكل كتابة)
+DEFERRED_WRITES_FILE = os.environ.get('DEFERRED_WRITES_FILE', 'deferred_writes.jsonl')
+
+# أخطاء تعني أن قاعدة البيانات نفسها غير متاحة (وليس خطأ في الاستعلام)
+if USE_POSTGRES:
+    DB_UNAVAILABLE_ERRORS = (
+        OSError, asyncio.TimeoutError, asyncpg.InterfaceError,
+        asyncpg.PostgresConnectionError, asyncpg.QueryCanceledError,
+        asyncpg.TooManyConnectionsError, asyncpg.CannotConnectNowError,
+    )
+else:
+    DB_UNAVAILABLE_ERRORS = (sqlite3.OperationalError,)
 
-async def init_db():
-    """تهيئة قاعدة البيانات"""
+breaker_stats = {
+    "degraded_reads": 0,
+    "snapshot_misses": 0,
+    "deferred": 0,
+    "replayed": 0,
+    "replay_failed": 0,
+    "dropped": 0,
+}
+_snapshots = {}                  # {اسم_الدالة: OrderedDict{المعاملات: النتيجة}}
+_deferred_writes = deque()       # [(الدالة, args, kwargs)]
+_replay_task = None
+_inside_guard = contextvars.ContextVar('inside_guard', default=False)
+
+async def _ping_db():
+    """استعلام فحص خفيف لإعادة إغلاق القاطع"""
     if USE_POSTGRES:
         conn = await get_postgres_connection()
+        await conn.fetchval('SELECT 1')
+        await conn.close()
+    else:
+        conn = sqlite_connect(timeout=DB_CONNECT_TIMEOUT)
+        conn.execute('SELECT 1 FROM sqlite_master LIMIT 1')
+        conn.close()
+
+def _replay_soon():
+    global _replay_task
+    if _deferred_writes and (_replay_task is None or _replay_task.done()):
+        _replay_task = asyncio.ensure_future(replay_deferred_writes())
+
+db_breaker = CircuitBreaker(
+    _ping_db,
+    window=int(os.environ.get('BREAKER_WINDOW', '50')),
+    min_calls=int(os.environ.get('BREAKER_MIN_CALLS', '10')),
+    error_rate=float(os.environ.get('BREAKER_ERROR_RATE', '0.5')),
+    slow_call_seconds=float(os.environ.get('BREAKER_SLOW_SECONDS', '1.0')),
+    slow_rate=float(os.environ.get('BREAKER_SLOW_RATE', '0.5')),
+    open_seconds=float(os.environ.get('BREAKER_OPEN_SECONDS', '10')),
+    probe_successes=int(os.environ.get('BREAKER_PROBES', '3')),
+    on_close=_replay_soon,
+)
+
+def _defer(func, args, kwargs):
+    if len(_deferred_writes) >= DEFERRED_WRITES_LIMIT:
+        _deferred_writes.popleft()
+        breaker_stats["dropped"] += 1
+    _deferred_writes.append((func, args, kwargs))
+    breaker_stats["deferred"] += 1
+
+def guarded(mode: str = "write"):
+    """حماية دالة قاعدة بيانات بالقاطع (mode: read / write / defer)"""
+    def decorator(func):
+        snapshots = _snapshots.setdefault(func.__name__, OrderedDict()) if mode == "read" else None
+
+        def degraded(key, args, kwargs, error=None):
+            if mode == "read" and key in snapshots:
+                breaker_stats["degraded_reads"] += 1
+                return snapshots[key]
+            if mode == "defer":
+                _defer(func, args, kwargs)
+                return None
+            if mode == "read":
+                breaker_stats["snapshot_misses"] += 1
+            raise DatabaseUnavailable(str(error) if error else "قاعدة البيانات غير متاحة مؤقتاً")
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            # الاستدعاءات المتداخلة (دالة محمية تستدعي أخرى) تُحسب مرة واحدة
+            if _inside_guard.get():
+                return await func(*args, **kwargs)
+
+            # repr لأن بعض المعاملات قوائم (period_keys)
+            key = repr((args, sorted(kwargs.items()))) if snapshots is not None else None
+            if not db_breaker.allow():
+                return degraded(key, args, kwargs)
+
+            token = _inside_guard.set(True)
+            started = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except DB_UNAVAILABLE_ERRORS as e:
+                db_breaker.record(False, time.perf_counter() - started)
+                logger.warning("⚠️ %s: قاعدة البيانات غير متاحة: %s", func.__name__, e, extra=log_context("db"))
+                return degraded(key, args, kwargs, e)
+            except Exception:
+                db_breaker.record(True, time.perf_counter() - started)
+                raise
+            finally:
+                _inside_guard.reset(token)
+            db_breaker.record(True, time.perf_counter() - started)
+
+            if snapshots is not None:
+                snapshots[key] = result
+                snapshots.move_to_end(key)
+                if len(snapshots) > DB_SNAPSHOT_SIZE:
+                    snapshots.popitem(last=False)
+            if _deferred_writes:
+                _replay_soon()
+            return result
+
+        return wrapper
+    return decorator
+
+async def replay_deferred_writes():
+    """إعادة تنفيذ الكتابات المؤجلة بالترتيب بعد عودة قاعدة البيانات"""
+    token = _inside_guard.set(True)
+    try:
+        while _deferred_writes and db_breaker.state == "closed":
+            func, args, kwargs = _deferred_writes[0]
+            started = time.perf_counter()
+            try:
+                await func(*args, **kwargs)
+            except DB_UNAVAILABLE_ERRORS as e:
+                db_breaker.record(False, time.perf_counter() - started)
+                logger.warning("⚠️ توقفت إعادة الكتابات المؤجلة: %s", e, extra=log_context("db"))
+                return
+            except Exception as e:
+                breaker_stats["replay_failed"] += 1
+                # فئة مالية: لا يخضع لحد معدل الأخطاء (log_pipeline)
+                logger.error("❌ فشل إعادة الكتابة المؤجلة %s%s: %s", func.__name__, args, e,
+                             extra=log_context("ledger"))
+            else:
+                db_breaker.record(True, time.perf_counter() - started)
+                breaker_stats["replayed"] += 1
+            _deferred_writes.popleft()
+    finally:
+        _inside_guard.reset(token)
+    logger.info("🔁 تمت إعادة الكتابات المؤجلة (المتبقي %s)", len(_deferred_writes), extra=log_context("db"))
+
+async def flush_deferred_writes(timeout: float) -> int:
+    """الإيقاف: إعادة الكتابات المؤجلة خلال timeout ثانية (مع انتظار عودة القاعدة)
+
+    ما بقي يُحفظ في DEFERRED_WRITES_FILE (اسم الدالة ومعاملاتها) لإعادته يدوياً، لأن
+    الطابور في الذاكرة ويضيع بانتهاء العملية. يعيد عدد ما بقي.
+    """
+    deadline = time.monotonic() + timeout
+    while _deferred_writes and time.monotonic() < deadline:
+        if db_breaker.state == "closed":
+            _replay_soon()
+            try:
+                await asyncio.wait_for(asyncio.shield(_replay_task), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                break
+        else:
+            db_breaker.allow()   # يبدأ الفحص بعد التبريد
+            await asyncio.sleep(0.5)
+
+    if _deferred_writes:
+        with open(DEFERRED_WRITES_FILE, "a", encoding="utf-8") as f:
+            for func, args, kwargs in _deferred_writes:
+                f.write(json.dumps({"func": func.__name__, "args": args, "kwargs": kwargs},
+                                   ensure_ascii=False, default=str) + "\n")
+        logger.error("❌ بقيت %s كتابة مؤجلة دون تنفيذ، حُفظت في %s", len(_deferred_writes),
+                     DEFERRED_WRITES_FILE, extra=log_context("ledger"))
+    return len(_deferred_writes)
+
+def peek_snapshot(name: str, *args):
+    """آخر نتيجة ناجحة محفوظة لدالة قراءة بهذه المعاملات دون أي استعلام (None إن لم توجد)"""
+    snapshots = _snapshots.get(name)
+    return snapshots.get(repr((args, []))) if snapshots else None
+
+def get_breaker_stats() -> dict:
+    """حالة القاطع والخدمة المتدهورة"""
+    return {
+        **db_breaker.snapshot(),
+        **breaker_stats,
+        "deferred_pending": len(_deferred_writes),
+        "snapshot_entries": sum(len(s) for s in _snapshots.values()),
+    }
+
+def get_cache_sizes() -> dict:
+    """أحجام البنى الداخلية في الذاكرة (لتشخيص التسرب)"""
+    return {
+        "single_flight_in_flight": len(_in_flight),
+        "replica_sticky_keys": len(_sticky_until),
+        "breaker_snapshot_entries": sum(len(s) for s in _snapshots.values()),
+        "deferred_writes": len(_deferred_writes),
+        "shard_directory": len(_user_shards),
+    }
+
+# أعمدة ملخص الجولة المضافة لاحقاً (ترحيل الجداول القديمة)
+ROUND_SUMMARY_COLUMNS = (
+    ('bettor_count', 'INTEGER'),
+    ('total_wagered', 'BIGINT'),
+    ('total_paid', 'BIGINT'),
+    ('cashed_stake', 'BIGINT'),
+    ('peak_liability', 'BIGINT'),
+)
+# موضع بذرة الجولة في سلسلة النتائج (result_chain.py)؛ البذرة تُكشف بعد الانفجار
+ROUND_SEED_COLUMNS = (
+    ('chain_id', 'INTEGER'),
+    ('chain_index', 'INTEGER'),
+    ('seed', 'VARCHAR(64)'),
+)
+
+# ==================== دفتر القيد المزدوج ====================
+# كل قيد صف واحد: المبلغ يخرج من debit_account ويدخل credit_account،
+# فمجموع أرصدة جميع الحسابات صفر دائماً. حسابات المستخدمين = user_id،
+# وحسابات النظام أرقام سالبة.
+HOUSE_ACCOUNT = -1   # البيت: يستقبل الرهانات ويدفع الأرباح
+MINT_ACCOUNT = -2    # إصدار الرصيد: إضافات الأدمن ورصيده غير المحدود
+SHARD_CLEARING_ACCOUNT = -3   # مقاصة بين القواعد: تحويلات المستخدمين ونقلهم (مجموعه عبر القواعد صفر)
+
+def ledger_account(user_id: int) -> int:
+    """حساب الدفتر للمستخدم (الأدمن يسحب من حساب الإصدار)"""
+    return MINT_ACCOUNT if user_id == ADMIN_ID else user_id
+
+class InsufficientFunds(ValueError):
+    """قيد يجعل رصيد مستخدم سالباً: رُفض داخل معاملة القيد ولم يُكتب منه شيء"""
+
+    def __init__(self, account: int, balance: int):
+        super().__init__(f"رصيد غير كافي للحساب {account} (الرصيد {balance})")
+        self.account = account
+        self.balance = balance   # الرصيد قبل القيد المرفوض
+
+# الرصيد = لقطة آخر نقطة تثبيت + القيود اللاحقة لها (ذيل محدود)
+BALANCE_QUERY = '''
+    SELECT COALESCE((SELECT balance FROM account_balances WHERE account_id = {0}), 0)
+         + COALESCE((SELECT SUM(amount) FROM ledger WHERE credit_account = {0}
+                     AND id > (SELECT COALESCE(MAX(last_posting_id), 0) FROM ledger_checkpoint)), 0)
+         - COALESCE((SELECT SUM(amount) FROM ledger WHERE debit_account = {0}
+                     AND id > (SELECT COALESCE(MAX(last_posting_id), 0) FROM ledger_checkpoint)), 0)
+'''
+
+# رقم إصدار المخطط: يجب زيادته عند أي تعديل على جداول init_db
+SCHEMA_VERSION = 9
+
+async def init_db() -> bool:
+    """تهيئة القاعدة المنسقة وكل القواعد المقسمة. تعيد True إذا طُبق المخطط على أي منها"""
+    # بالترتيب: قد تكون المنسقة نفسها إحدى القواعد المقسمة
+    migrated = False
+    for shard in [None, *range(len(DATABASE_SHARDS))]:
+        migrated = await init_schema(shard) or migrated
+    return migrated
+
+async def init_schema(shard: int = None) -> bool:
+    """تهيئة قاعدة واحدة (تُتخطى إذا كان المخطط محدثاً). كل القواعد بنفس المخطط الكامل"""
+    if USE_POSTGRES:
+        conn = await get_postgres_connection(shard)
+        try:
+            current = await conn.fetchval('SELECT MAX(version) FROM schema_version')
+        except asyncpg.UndefinedTableError:
+            current = None
+        if current is not None and current >= SCHEMA_VERSION:
+            await conn.close()
+            return False
+        
         await conn.execute('''
             CREATE TABLE IF NOT EXISTS users (
                 user_id BIGINT PRIMARY KEY,
@@ -38,15 +519,48 @@ async def init_db():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        # آخر معاملات المستخدم (سجل النشاط) من الفهرس مباشرة
+        await conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (user_id, created_at)')
         await conn.execute('''
             CREATE TABLE IF NOT EXISTS rounds (
                 round_id SERIAL PRIMARY KEY,
                 result FLOAT,
                 status VARCHAR(20) DEFAULT 'waiting',
                 start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                end_time TIMESTAMP
+                end_time TIMESTAMP,
+                bettor_count INTEGER DEFAULT 0,
+                total_wagered BIGINT DEFAULT 0,
+                total_paid BIGINT DEFAULT 0
+            )
+        ''')
+        for column, column_type in ROUND_SUMMARY_COLUMNS:
+            await conn.execute(f'ALTER TABLE rounds ADD COLUMN IF NOT EXISTS {column} {column_type} DEFAULT 0')
+        await conn.execute(f"ALTER TABLE rounds ADD COLUMN IF NOT EXISTS room_id VARCHAR(32) DEFAULT '{DEFAULT_ROOM}'")
+        await conn.execute('CREATE INDEX IF NOT EXISTS idx_rounds_room ON rounds (room_id, round_id)')
+        for column, column_type in ROUND_SEED_COLUMNS:
+            await conn.execute(f'ALTER TABLE rounds ADD COLUMN IF NOT EXISTS {column} {column_type}')
+        await conn.execute('CREATE INDEX IF NOT EXISTS idx_rounds_chain ON rounds (chain_id, chain_index)')
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS result_chains (
+                chain_id SERIAL PRIMARY KEY,
+                room_id VARCHAR(32) NOT NULL,
+                commitment VARCHAR(64) NOT NULL,
+                length INTEGER NOT NULL,
+                salt TEXT DEFAULT '',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        # المواضع المستهلكة: عداد دائم لا يعتمد على rounds (الأرشفة تحذف الجولات القديمة)
+        if not await conn.fetchval(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = 'result_chains' AND column_name = 'used'"
+        ):
+            await conn.execute('ALTER TABLE result_chains ADD COLUMN used INTEGER DEFAULT 0')
+            await conn.execute('''
+                UPDATE result_chains c SET used = r.used
+                FROM (SELECT chain_id, MAX(chain_index) + 1 AS used FROM rounds
+                      WHERE chain_id IS NOT NULL GROUP BY chain_id) r
+                WHERE r.chain_id = c.chain_id
+            ''')
         await conn.execute('''
             CREATE TABLE IF NOT EXISTS bets (
                 id SERIAL PRIMARY KEY,
@@ -59,10 +573,119 @@ async def init_db():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_stats (
+                user_id BIGINT PRIMARY KEY,
+                rounds_played INTEGER DEFAULT 0,
+                total_wagered BIGINT DEFAULT 0,
+                total_won BIGINT DEFAULT 0,
+                best_cashout FLOAT DEFAULT 0,
+                biggest_win BIGINT DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS leaderboard_stats (
+                period VARCHAR(10),
+                period_key VARCHAR(12),
+                user_id BIGINT,
+                biggest_win BIGINT DEFAULT 0,
+                best_multiplier FLOAT DEFAULT 0,
+                net_profit BIGINT DEFAULT 0,
+                PRIMARY KEY (period, period_key, user_id)
+            )
+        ''')
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS daily_rollups (
+                day DATE,
+                table_name VARCHAR(20),
+                type VARCHAR(50),
+                row_count INTEGER DEFAULT 0,
+                total_amount BIGINT DEFAULT 0,
+                total_extra BIGINT DEFAULT 0,
+                PRIMARY KEY (day, table_name, type)
+            )
+        ''')
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS maintenance_state (
+                job VARCHAR(50) PRIMARY KEY,
+                last_id BIGINT DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS ledger (
+                id BIGSERIAL PRIMARY KEY,
+                debit_account BIGINT NOT NULL,
+                credit_account BIGINT NOT NULL,
+                amount BIGINT NOT NULL CHECK (amount > 0),
+                type VARCHAR(20),
+                description TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        await conn.execute('CREATE INDEX IF NOT EXISTS idx_ledger_debit ON ledger (debit_account, id)')
+        await conn.execute('CREATE INDEX IF NOT EXISTS idx_ledger_credit ON ledger (credit_account, id)')
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS account_balances (
+                account_id BIGINT PRIMARY KEY,
+                balance BIGINT DEFAULT 0,
+                last_posting_id BIGINT DEFAULT 0
+            )
+        ''')
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS ledger_checkpoint (
+                id INTEGER PRIMARY KEY,
+                last_posting_id BIGINT DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # الأرصدة الافتتاحية من users.balance عند إنشاء الدفتر لأول مرة
+        if not await conn.fetchval('SELECT EXISTS (SELECT 1 FROM ledger)'):
+            await conn.execute(
+                '''INSERT INTO ledger (debit_account, credit_account, amount, type, description)
+                   SELECT CASE WHEN balance > 0 THEN $1 ELSE user_id END,
+                          CASE WHEN balance > 0 THEN user_id ELSE $1 END,
+                          ABS(balance), 'opening', 'رصيد افتتاحي'
+                   FROM users WHERE balance <> 0 AND user_id <> $2
+                   ORDER BY user_id''',
+                MINT_ACCOUNT, ADMIN_ID
+            )
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_shards (
+                user_id BIGINT PRIMARY KEY,
+                shard INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        await conn.execute('CREATE INDEX IF NOT EXISTS idx_user_shards_shard ON user_shards (shard, user_id)')
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                scope VARCHAR(20) NOT NULL,
+                user_id BIGINT NOT NULL,
+                key VARCHAR(100) NOT NULL,
+                response TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (scope, user_id, key)
+            )
+        ''')
+        await conn.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys (created_at)')
+        await conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER)')
+        await conn.execute('DELETE FROM schema_version')
+        await conn.execute('INSERT INTO schema_version (version) VALUES ($1)', SCHEMA_VERSION)
         await conn.close()
+        return True
     else:
-        conn = sqlite3.connect('game.db')
+        conn = sqlite_connect(shard)
         cursor = conn.cursor()
+        try:
+            current = cursor.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+        except sqlite3.OperationalError:
+            current = None
+        if current is not None and current >= SCHEMA_VERSION:
+            conn.close()
+            return False
+        
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
                 user_id INTEGER PRIMARY KEY,
@@ -82,15 +705,46 @@ async def init_db():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (user_id, created_at)')
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS rounds (
                 round_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 result REAL,
                 status TEXT DEFAULT 'waiting',
                 start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                end_time TIMESTAMP
+                end_time TIMESTAMP,
+                bettor_count INTEGER DEFAULT 0,
+                total_wagered INTEGER DEFAULT 0,
+                total_paid INTEGER DEFAULT 0
             )
         ''')
+        existing = {row[1] for row in cursor.execute('PRAGMA table_info(rounds)')}
+        for column, _ in ROUND_SUMMARY_COLUMNS:
+            if column not in existing:
+                cursor.execute(f'ALTER TABLE rounds ADD COLUMN {column} INTEGER DEFAULT 0')
+        if 'room_id' not in existing:
+            cursor.execute(f"ALTER TABLE rounds ADD COLUMN room_id TEXT DEFAULT '{DEFAULT_ROOM}'")
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rounds_room ON rounds (room_id, round_id)')
+        for column, column_type in ROUND_SEED_COLUMNS:
+            if column not in existing:
+                cursor.execute(f'ALTER TABLE rounds ADD COLUMN {column} {column_type}')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rounds_chain ON rounds (chain_id, chain_index)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS result_chains (
+                chain_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                room_id TEXT NOT NULL,
+                commitment TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                salt TEXT DEFAULT '',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        if 'used' not in {row[1] for row in cursor.execute('PRAGMA table_info(result_chains)')}:
+            cursor.execute('ALTER TABLE result_chains ADD COLUMN used INTEGER DEFAULT 0')
+            cursor.execute('''
+                UPDATE result_chains SET used = COALESCE(
+                    (SELECT MAX(chain_index) + 1 FROM rounds WHERE rounds.chain_id = result_chains.chain_id), 0)
+            ''')
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS bets (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -103,13 +757,399 @@ async def init_db():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_stats (
+                user_id INTEGER PRIMARY KEY,
+                rounds_played INTEGER DEFAULT 0,
+                total_wagered INTEGER DEFAULT 0,
+                total_won INTEGER DEFAULT 0,
+                best_cashout REAL DEFAULT 0,
+                biggest_win INTEGER DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS leaderboard_stats (
+                period TEXT,
+                period_key TEXT,
+                user_id INTEGER,
+                biggest_win INTEGER DEFAULT 0,
+                best_multiplier REAL DEFAULT 0,
+                net_profit INTEGER DEFAULT 0,
+                PRIMARY KEY (period, period_key, user_id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS daily_rollups (
+                day TEXT,
+                table_name TEXT,
+                type TEXT,
+                row_count INTEGER DEFAULT 0,
+                total_amount INTEGER DEFAULT 0,
+                total_extra INTEGER DEFAULT 0,
+                PRIMARY KEY (day, table_name, type)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS maintenance_state (
+                job TEXT PRIMARY KEY,
+                last_id INTEGER DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                debit_account INTEGER NOT NULL,
+                credit_account INTEGER NOT NULL,
+                amount INTEGER NOT NULL CHECK (amount > 0),
+                type TEXT,
+                description TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ledger_debit ON ledger (debit_account, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ledger_credit ON ledger (credit_account, id)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS account_balances (
+                account_id INTEGER PRIMARY KEY,
+                balance INTEGER DEFAULT 0,
+                last_posting_id INTEGER DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ledger_checkpoint (
+                id INTEGER PRIMARY KEY,
+                last_posting_id INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # الأرصدة الافتتاحية من users.balance عند إنشاء الدفتر لأول مرة
+        if not cursor.execute('SELECT EXISTS (SELECT 1 FROM ledger)').fetchone()[0]:
+            cursor.execute(
+                '''INSERT INTO ledger (debit_account, credit_account, amount, type, description)
+                   SELECT CASE WHEN balance > 0 THEN ? ELSE user_id END,
+                          CASE WHEN balance > 0 THEN user_id ELSE ? END,
+                          ABS(balance), 'opening', 'رصيد افتتاحي'
+                   FROM users WHERE balance <> 0 AND user_id <> ?
+                   ORDER BY user_id''',
+                (MINT_ACCOUNT, MINT_ACCOUNT, ADMIN_ID)
+            )
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_shards (
+                user_id INTEGER PRIMARY KEY,
+                shard INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_shards_shard ON user_shards (shard, user_id)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                scope TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                key TEXT NOT NULL,
+                response TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (scope, user_id, key)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys (created_at)')
+        cursor.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER)')
+        cursor.execute('DELETE FROM schema_version')
+        cursor.execute('INSERT INTO schema_version (version) VALUES (?)', (SCHEMA_VERSION,))
+        conn.commit()
+        conn.close()
+        return True
+
+# ==================== توجيه المستخدمين إلى قواعدهم ====================
+# الدليل user_shards في المنسقة هو المرجع: يُسجل المستخدم عند إنشائه في قاعدة
+# hash(user_id) ويبقى فيها حتى تنقله أداة إعادة الموازنة (sharding.py)، فإضافة
+# قاعدة جديدة لا تغير مكان أحد. نسخة الدليل في الذاكرة تجعل التوجيه بلا استعلام.
+SHARD_MOVE_GRACE = float(os.environ.get('SHARD_MOVE_GRACE', '1'))
+
+SHARD_IDS = list(range(len(DATABASE_SHARDS)))
+# الجداول المقسمة حسب المستخدم؛ البقية في المنسقة
+SHARDED_TABLES = {'users', 'transactions', 'bets', 'ledger', 'account_balances', 'ledger_checkpoint'}
+# قيود حسابات النظام وحدها (بلا مستخدم) في أول قاعدة
+SYSTEM_SHARD = 0 if DATABASE_SHARDS else None
+
+shard_stats = {
+    "enabled": bool(DATABASE_SHARDS),
+    "shards": len(DATABASE_SHARDS),
+    "directory_lookups": 0,
+    "fan_outs": 0,
+    "cross_shard_postings": 0,
+    "moved_users": 0,
+}
+_user_shards = {}     # {user_id: shard} نسخة الدليل في الذاكرة
+_moving_users = {}    # {user_id: asyncio.Event} المستخدمون قيد النقل ينتظر توجيههم انتهاءه
+
+def table_shards(table: str) -> list:
+    """القواعد التي تحمل صفوف الجدول ([None] = المنسقة فقط)"""
+    return SHARD_IDS if DATABASE_SHARDS and table in SHARDED_TABLES else [None]
+
+def hash_shard(user_id: int) -> int:
+    """قاعدة المستخدم الجديد (ثابتة عبر العمليات بخلاف hash المدمجة)"""
+    digest = hashlib.blake2b(str(user_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % len(DATABASE_SHARDS)
+
+async def shard_of(user_id: int):
+    """قاعدة المستخدم: من الذاكرة ثم الدليل ثم hash (None بلا تقسيم)"""
+    if not DATABASE_SHARDS:
+        return None
+    moving = _moving_users.get(user_id)
+    if moving:
+        await moving.wait()
+    shard = _user_shards.get(user_id)
+    if shard is None:
+        shard = await get_user_shard(user_id)
+        if shard is None:
+            shard = hash_shard(user_id)
+        _user_shards[user_id] = shard
+    return shard
+
+async def _fan_out(calls) -> list:
+    """تشغيل استدعاءات القواعد معاً؛ يُرفع أول خطأ بعد انتهائها كلها"""
+    calls = list(calls)
+    if len(calls) > 1:
+        shard_stats["fan_outs"] += 1
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+@guarded("read")
+async def get_user_shard(user_id: int):
+    """قاعدة المستخدم من الدليل (None إذا لم يُسجل)"""
+    shard_stats["directory_lookups"] += 1
+    if USE_POSTGRES:
+        conn = await get_read_connection('get_user_shard', user_id)
+        result = await conn.fetchval('SELECT shard FROM user_shards WHERE user_id = $1', user_id)
+        await conn.close()
+        return result
+    else:
+        conn = sqlite_connect()
+        row = conn.execute('SELECT shard FROM user_shards WHERE user_id = ?', (user_id,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+@guarded()
+async def set_user_shards(placements: list, replace: bool = True):
+    """تسجيل قواعد المستخدمين في الدليل: [(user_id, shard)]؛ replace=False يحفظ المسجل سابقاً"""
+    if not placements:
+        return
+    if USE_POSTGRES:
+        conn = await get_postgres_connection()
+        await conn.executemany(
+            '''INSERT INTO user_shards (user_id, shard) VALUES ($1, $2)
+               ON CONFLICT (user_id) DO ''' + (
+                'UPDATE SET shard = EXCLUDED.shard, updated_at = CURRENT_TIMESTAMP' if replace else 'NOTHING'
+            ),
+            placements
+        )
+        await conn.close()
+    else:
+        conn = sqlite_connect()
+        conn.executemany(
+            '''INSERT INTO user_shards (user_id, shard) VALUES (?, ?)
+               ON CONFLICT (user_id) DO ''' + (
+                'UPDATE SET shard = excluded.shard, updated_at = CURRENT_TIMESTAMP' if replace else 'NOTHING'
+            ),
+            placements
+        )
+        conn.commit()
+        conn.close()
+
+@guarded()
+async def get_user_shard_page(after_user_id: int = 0, limit: int = 1000) -> list:
+    """صفحة من الدليل مرتبة حسب المعرف: [(user_id, shard)]"""
+    if USE_POSTGRES:
+        conn = await get_postgres_connection()
+        rows = await conn.fetch(
+            'SELECT user_id, shard FROM user_shards WHERE user_id > $1 ORDER BY user_id LIMIT $2',
+            after_user_id, limit
+        )
+        await conn.close()
+    else:
+        conn = sqlite_connect()
+        rows = conn.execute(
+            'SELECT user_id, shard FROM user_shards WHERE user_id > ? ORDER BY user_id LIMIT ?',
+            (after_user_id, limit)
+        ).fetchall()
+        conn.close()
+    return [tuple(row) for row in rows]
+
+@guarded()
+async def get_shard_user_ids(shard: int, after_user_id: int = 0, limit: int = 1000) -> list:
+    """معرفات المستخدمين الموجودين فعلاً في قاعدة (لتسجيلهم في الدليل)"""
+    if USE_POSTGRES:
+        conn = await get_postgres_connection(shard)
+        rows = await conn.fetch(
+            'SELECT user_id FROM users WHERE user_id > $1 ORDER BY user_id LIMIT $2', after_user_id, limit
+        )
+        await conn.close()
+    else:
+        conn = sqlite_connect(shard)
+        rows = conn.execute(
+            'SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?', (after_user_id, limit)
+        ).fetchall()
+        conn.close()
+    return [row[0] for row in rows]
+
+@guarded()
+async def get_shard_counts() -> dict:
+    """عدد المستخدمين المسجلين في الدليل لكل قاعدة"""
+    if USE_POSTGRES:
+        conn = await get_postgres_connection()
+        rows = await conn.fetch('SELECT shard, COUNT(*) FROM user_shards GROUP BY shard')
+        await conn.close()
+    else:
+        conn = sqlite_connect()
+        rows = conn.execute('SELECT shard, COUNT(*) FROM user_shards GROUP BY shard').fetchall()
+        conn.close()
+    return {row[0]: row[1] for row in rows}
+
+def get_shard_stats() -> dict:
+    return {**shard_stats, "directory_cached": len(_user_shards), "moving": len(_moving_users)}
+
+# ==================== نقل مستخدم بين القواعد ====================
+USER_COLUMNS = ('user_id', 'username', 'balance', 'is_admin', 'created_at')
+TRANSACTION_COLUMNS = ('user_id', 'amount', 'type', 'description', 'created_at')
+BET_COLUMNS = ('user_id', 'round_id', 'amount', 'multiplier', 'win_amount', 'status', 'created_at')
+
+async def _read_user_rows(shard: int, user_id: int):
+    """صف المستخدم ومعاملاته ورهاناته ورصيده في قاعدة واحدة"""
+    queries = (
+        f'SELECT {", ".join(USER_COLUMNS)} FROM users WHERE user_id = {{0}}',
+        f'SELECT {", ".join(TRANSACTION_COLUMNS)} FROM transactions WHERE user_id = {{0}} ORDER BY id',
+        f'SELECT {", ".join(BET_COLUMNS)} FROM bets WHERE user_id = {{0}} ORDER BY id',
+    )
+    if USE_POSTGRES:
+        conn = await get_postgres_connection(shard)
+        users, transactions, bets = [
+            [tuple(row) for row in await conn.fetch(query.format('$1'), user_id)] for query in queries
+        ]
+        balance = await conn.fetchval(BALANCE_QUERY.format('$1'), user_id)
+        await conn.close()
+    else:
+        conn = sqlite_connect(shard)
+        users, transactions, bets = [
+            conn.execute(query.format('?'), (user_id,)).fetchall() for query in queries
+        ]
+        balance = conn.execute(BALANCE_QUERY.format(':account'), {'account': user_id}).fetchone()[0]
+        conn.close()
+    return users, transactions, bets, int(balance or 0)
+
+def _clearing_row(user_id: int, balance: int, incoming: bool):
+    """قيد نقل الرصيد عبر حساب المقاصة (الرصيد السالب يُنقل بالاتجاه المعاكس)"""
+    if incoming == (balance > 0):
+        return (SHARD_CLEARING_ACCOUNT, user_id, abs(balance), 'shard_move', 'نقل من قاعدة أخرى')
+    return (user_id, SHARD_CLEARING_ACCOUNT, abs(balance), 'shard_move', 'نقل إلى قاعدة أخرى')
+
+async def _copy_user_in(shard: int, users: list, transactions: list, bets: list, user_id: int, balance: int):
+    """إدخال صفوف المستخدم وقيد رصيده في القاعدة الهدف (معاملة واحدة)"""
+    inserts = (
+        (f'INSERT INTO users ({", ".join(USER_COLUMNS)}) VALUES ({{}}) ON CONFLICT (user_id) DO NOTHING',
+         USER_COLUMNS, users),
+        (f'INSERT INTO transactions ({", ".join(TRANSACTION_COLUMNS)}) VALUES ({{}})', TRANSACTION_COLUMNS, transactions),
+        (f'INSERT INTO bets ({", ".join(BET_COLUMNS)}) VALUES ({{}})', BET_COLUMNS, bets),
+    )
+    ledger_rows = [_clearing_row(user_id, balance, incoming=True)] if balance else []
+    ledger_insert = '''INSERT INTO ledger (debit_account, credit_account, amount, type, description)
+                       VALUES ({})'''
+    if USE_POSTGRES:
+        conn = await get_postgres_connection(shard)
+        async with conn.transaction():
+            for query, columns, rows in inserts:
+                if rows:
+                    placeholders = ", ".join(f'${i}' for i in range(1, len(columns) + 1))
+                    await conn.executemany(query.format(placeholders), rows)
+            if ledger_rows:
+                await conn.executemany(ledger_insert.format('$1, $2, $3, $4, $5'), ledger_rows)
+        await conn.close()
+    else:
+        conn = sqlite_connect(shard)
+        for query, columns, rows in inserts:
+            if rows:
+                conn.executemany(query.format(", ".join('?' * len(columns))), rows)
+        if ledger_rows:
+            conn.executemany(ledger_insert.format('?, ?, ?, ?, ?'), ledger_rows)
+        conn.commit()
+        conn.close()
+
+async def _remove_user_rows(shard: int, user_id: int, balance: int):
+    """حذف صفوف المستخدم من القاعدة وإخراج رصيده إلى حساب المقاصة (معاملة واحدة)"""
+    deletes = ('DELETE FROM users WHERE user_id = {0}', 'DELETE FROM transactions WHERE user_id = {0}',
+               'DELETE FROM bets WHERE user_id = {0}')
+    ledger_rows = [_clearing_row(user_id, balance, incoming=False)] if balance else []
+    ledger_insert = '''INSERT INTO ledger (debit_account, credit_account, amount, type, description)
+                       VALUES ({})'''
+    if USE_POSTGRES:
+        conn = await get_postgres_connection(shard)
+        async with conn.transaction():
+            for query in deletes:
+                await conn.execute(query.format('$1'), user_id)
+            if ledger_rows:
+                await conn.executemany(ledger_insert.format('$1, $2, $3, $4, $5'), ledger_rows)
+        await conn.close()
+    else:
+        conn = sqlite_connect(shard)
+        for query in deletes:
+            conn.execute(query.format('?'), (user_id,))
+        if ledger_rows:
+            conn.executemany(ledger_insert.format('?, ?, ?, ?, ?'), ledger_rows)
         conn.commit()
         conn.close()
 
+async def move_user(user_id: int, target: int, grace: float = SHARD_MOVE_GRACE) -> int:
+    """نقل المستخدم إلى قاعدة أخرى: صفه ومعاملاته ورهاناته، ورصيده بقيدين عبر حساب المقاصة
+
+    توجيه المستخدم ينتظر حتى ينتهي النقل، وgrace ثانية قبل البدء تُنهي العمليات التي
+    حددت قاعدته قبل ذلك. تاريخ قيوده يبقى في القاعدة الأصلية. يعيد الرصيد المنقول.
+    """
+    source = await shard_of(user_id)
+    if source is None or source == target:
+        return 0
+    if target not in SHARD_IDS:
+        raise ValueError(f"قاعدة غير معروفة: {target}")
+
+    _moving_users[user_id] = moving = asyncio.Event()
+    try:
+        # الانتظار خارج القاطع حتى لا يُحسب استدعاءً بطيئاً
+        await asyncio.sleep(grace)
+        balance = await _move_user_rows(user_id, source, target)
+    finally:
+        del _moving_users[user_id]
+        moving.set()
+
+    for name in ('get_balance', 'get_user_transactions', 'get_user_active_bet'):
+        single_flight_forget(name, user_id)
+    shard_stats["moved_users"] += 1
+    logger.info("🔀 نُقل المستخدم %s من القاعدة %s إلى %s (الرصيد %s)", user_id, source, target, balance,
+                extra=log_context("ledger", user_id=user_id, amount=balance))
+    return balance
+
+@guarded()
+async def _move_user_rows(user_id: int, source: int, target: int) -> int:
+    users, transactions, bets, balance = await _read_user_rows(source, user_id)
+    # الهدف أولاً: إذا فشل حذف الأصل يُزال ما نُسخ فلا يتكرر الرصيد
+    await _copy_user_in(target, users, transactions, bets, user_id, balance)
+    try:
+        await _remove_user_rows(source, user_id, balance)
+    except Exception:
+        await _remove_user_rows(target, user_id, balance)
+        raise
+    _user_shards[user_id] = target
+    await set_user_shards([(user_id, target)])
+    return balance
+
+@guarded()
 async def set_admin_unlimited_balance(admin_id: int):
     """تعيين رصيد غير محدود للأدمن"""
+    shard = await shard_of(admin_id)
     if USE_POSTGRES:
-        conn = await get_postgres_connection()
+        conn = await get_postgres_connection(shard)
         await conn.execute(
             '''INSERT INTO users (user_id, balance, is_admin) 
                VALUES ($1, $2, $3) 
@@ -119,7 +1159,7 @@ async def set_admin_unlimited_balance(admin_id: int):
         )
         await conn.close()
     else:
-        conn = sqlite3.connect('game.db')
+        conn = sqlite_connect(shard)
         cursor = conn.cursor()
         cursor.execute(
             '''INSERT OR REPLACE INTO users (user_id, balance, is_admin) 
@@ -129,31 +1169,39 @@ async def set_admin_unlimited_balance(admin_id: int):
         conn.commit()
         conn.close()
 
+@single_flight
+@guarded("read")
 async def get_balance(user_id: int) -> int:
     """جلب رصيد المستخدم"""
     # إذا كان الأدمن، رجع رصيد غير محدود مباشرة
     if user_id == ADMIN_ID:
         return 999999999
     
+    shard = await shard_of(user_id)
     if USE_POSTGRES:
-        conn = await get_postgres_connection()
-        result = await conn.fetchrow(
-            'SELECT balance FROM users WHERE user_id = $1', user_id
-        )
+        conn = await get_read_connection('get_balance', user_id, shard=shard)
+        result = await conn.fetchval(BALANCE_QUERY.format('$1'), user_id)
         await conn.close()
-        return result['balance'] if result else 0
+        return int(result or 0)
     else:
-        conn = sqlite3.connect('game.db')
+        conn = sqlite_connect(shard)
         cursor = conn.cursor()
-        cursor.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
+        cursor.execute(BALANCE_QUERY.format(':account'), {'account': user_id})
         result = cursor.fetchone()
         conn.close()
-        return result[0] if result else 0
+        return int(result[0] or 0)
 
+@guarded()
+@forgets(lambda a: [('get_balance', a['user_id']), ('get_all_users',)])
 async def create_user(user_id: int, username: str = None):
     """إنشاء مستخدم جديد"""
+    # التسجيل في الدليل أولاً حتى لا يتغير مكانه إذا أضيفت قاعدة لاحقاً
+    shard = await shard_of(user_id)
+    if DATABASE_SHARDS:
+        await set_user_shards([(user_id, shard)], replace=False)
+
     if USE_POSTGRES:
-        conn = await get_postgres_connection()
+        conn = await get_postgres_connection(shard)
         await conn.execute(
             '''INSERT INTO users (user_id, username, balance, is_admin) 
                VALUES ($1, $2, $3, $4) 
@@ -162,7 +1210,7 @@ async def create_user(user_id: int, username: str = None):
         )
         await conn.close()
     else:
-        conn = sqlite3.connect('game.db')
+        conn = sqlite_connect(shard)
         cursor = conn.cursor()
         cursor.execute(
             '''INSERT OR IGNORE INTO users (user_id, username, balance, is_admin) 
@@ -173,46 +1221,307 @@ async def create_user(user_id: int, username: str = None):
         conn.close()
 
 async def update_balance(user_id: int, amount: int) -> int:
-    """تحديث رصيد المستخدم"""
+    """تعديل رصيد المستخدم بقيد تسوية مقابل حساب الإصدار (الخصم فوق الرصيد يرفع InsufficientFunds)"""
     # الأدمن لا يتغير رصيده
     if user_id == ADMIN_ID:
         return 999999999
     
+    if amount > 0:
+        await post_ledger(MINT_ACCOUNT, user_id, amount, 'adjust')
+    elif amount < 0:
+        await post_ledger(user_id, MINT_ACCOUNT, -amount, 'adjust')
+    return await get_balance(user_id)
+
+async def post_ledger(from_account: int, to_account: int, amount: int, type: str, description: str = ""):
+    """قيد واحد: نقل amount من حساب إلى آخر (مع سجل المعاملات) بشكل ذري"""
+    await post_ledger_many([(from_account, to_account, amount, type, description)])
+
+async def _route_postings(postings: list):
+    """توزيع القيود على القواعد: ({shard: (rows, transactions)} للقيود، ومثله لإياب التحويلات)
+
+    القيد بين مستخدمين في قاعدتين يُقسم عبر حساب المقاصة: الذهاب في قاعدة المرسل
+    والإياب في قاعدة المستلم، فيبقى مجموع كل قاعدة صفراً.
+    """
+    direct = defaultdict(lambda: ([], []))
+    followups = defaultdict(lambda: ([], []))
+    for from_account, to_account, amount, type, description in postings:
+        if amount <= 0:
+            continue
+        debit, credit = ledger_account(from_account), ledger_account(to_account)
+        if debit == credit:
+            continue
+        from_shard = await shard_of(from_account) if from_account > 0 else None
+        to_shard = await shard_of(to_account) if to_account > 0 else None
+
+        if from_account > 0 and to_account > 0 and from_shard != to_shard:
+            shard_stats["cross_shard_postings"] += 1
+            rows, transactions = direct[from_shard]
+            rows.append((debit, SHARD_CLEARING_ACCOUNT, amount, type, description))
+            transactions.append((from_account, -amount, type, description))
+            rows, transactions = followups[to_shard]
+            rows.append((SHARD_CLEARING_ACCOUNT, credit, amount, type, description))
+            transactions.append((to_account, amount, type, description))
+            continue
+
+        shard = from_shard if from_account > 0 else to_shard if to_account > 0 else SYSTEM_SHARD
+        rows, transactions = direct[shard]
+        rows.append((debit, credit, amount, type, description))
+        if from_account > 0:
+            transactions.append((from_account, -amount, type, description))
+        if to_account > 0:
+            transactions.append((to_account, amount, type, description))
+    return direct, followups
+
+async def post_ledger_many(postings: list):
+    """تسجيل عدة قيود: معاملة واحدة لكل قاعدة، والقواعد معاً
+
+    postings: [(from_account, to_account, amount, type, description)]
+    from/to إما user_id أو HOUSE_ACCOUNT/MINT_ACCOUNT؛ الأدمن يُحوَّل لحساب الإصدار.
+    كل قيد يضيف أيضاً صف transactions لكل مستخدم طرف فيه (موجب للمستلم وسالب للمرسل).
+    إياب التحويل بين قاعدتين يُكتب بعد نجاح الذهاب ويُؤجل إذا تعطلت قاعدة المستلم.
+    """
+    direct, followups = await _route_postings(postings)
+    await _fan_out(post_shard_ledger(shard, rows, transactions) for shard, (rows, transactions) in direct.items())
+    await _fan_out(
+        post_shard_ledger_deferred(shard, rows, transactions) for shard, (rows, transactions) in followups.items()
+    )
+
+def _ledger_reads(arguments: dict) -> list:
+    """قراءات أطراف القيود (رصيد ومعاملات كل مستخدم في صفوف transactions)"""
+    users = {user_id for user_id, _, _, _ in arguments['transactions']}
+    return [(name, user_id) for user_id in users for name in ('get_balance', 'get_user_transactions')]
+
+def _debited_users(rows: list) -> dict:
+    """{حساب مستخدم: صافي ما يخرج منه في هذه القيود} (حسابات النظام والأدمن بلا حد)"""
+    changes = defaultdict(int)
+    for debit, credit, amount, _, _ in rows:
+        changes[debit] -= amount
+        changes[credit] += amount
+    return {account: -change for account, change in changes.items() if account > 0 and change < 0}
+
+@guarded()
+@forgets(_ledger_reads)
+async def post_shard_ledger(shard: int, rows: list, transactions: list):
+    """قيود قاعدة واحدة وصفوف معاملاتها في معاملة واحدة
+
+    رصيد كل مستخدم يخرج منه مال يُفحص داخل المعاملة نفسها بعد الإدخال: إذا صار سالباً
+    تُلغى المعاملة كلها وتُرفع InsufficientFunds. الفحص المسبق خارجها (get_balance
+    المدمج) لا يمنع رهانين أو تحويلين متزامنين من السحب على الرصيد نفسه.
+    """
+    debited = _debited_users(rows)
     if USE_POSTGRES:
-        conn = await get_postgres_connection()
-        await conn.execute(
-            'UPDATE users SET balance = balance + $1 WHERE user_id = $2',
-            amount, user_id
-        )
-        result = await conn.fetchrow(
-            'SELECT balance FROM users WHERE user_id = $1', user_id
+        conn = await get_postgres_connection(shard)
+        try:
+            async with conn.transaction():
+                # قفل الحسابات المسحوب منها حتى نهاية المعاملة (مرتبة فلا يتقاطع قفلان)
+                for account in sorted(debited):
+                    await conn.execute('SELECT pg_advisory_xact_lock($1)', account)
+                await conn.executemany(
+                    '''INSERT INTO ledger (debit_account, credit_account, amount, type, description)
+                       VALUES ($1, $2, $3, $4, $5)''',
+                    rows
+                )
+                await conn.executemany(
+                    'INSERT INTO transactions (user_id, amount, type, description) VALUES ($1, $2, $3, $4)',
+                    transactions
+                )
+                for account, outflow in debited.items():
+                    balance = int(await conn.fetchval(BALANCE_QUERY.format('$1'), account) or 0)
+                    if balance < 0:
+                        raise InsufficientFunds(account, balance + outflow)
+        finally:
+            await conn.close()
+    else:
+        conn = sqlite_connect(shard)
+        try:
+            cursor = conn.cursor()
+            # أول إدخال يحجز قفل الكتابة حتى commit، فلا يتداخل كاتب آخر مع الفحص
+            cursor.executemany(
+                '''INSERT INTO ledger (debit_account, credit_account, amount, type, description)
+                   VALUES (?, ?, ?, ?, ?)''',
+                rows
+            )
+            cursor.executemany(
+                'INSERT INTO transactions (user_id, amount, type, description) VALUES (?, ?, ?, ?)',
+                transactions
+            )
+            for account, outflow in debited.items():
+                balance = int(cursor.execute(BALANCE_QUERY.format(':account'), {'account': account}).fetchone()[0] or 0)
+                if balance < 0:
+                    conn.rollback()
+                    raise InsufficientFunds(account, balance + outflow)
+            conn.commit()
+        finally:
+            conn.close()
+
+@guarded("defer")
+async def post_shard_ledger_deferred(shard: int, rows: list, transactions: list):
+    """قيود قاعدة واحدة لا يجوز أن تضيع: تُؤجل وتُعاد وحدها إذا تعطلت قاعدتها"""
+    await post_shard_ledger(shard, rows, transactions)
+
+async def post_payouts(postings: list):
+    """قيود الأرباح من البيت؛ دفعة كل قاعدة تُؤجل وتُعاد وحدها إذا تعطلت فلا يضيع ربح ولا يتكرر"""
+    try:
+        direct, followups = await _route_postings(postings)
+    except DatabaseUnavailable:
+        # الدليل غير متاح: تُؤجل الدفعة كاملة قبل أي كتابة
+        _defer(post_payouts, (postings,), {})
+        return
+    batches = [(shard, rows, transactions) for routed in (direct, followups)
+               for shard, (rows, transactions) in routed.items()]
+    if _inside_guard.get():
+        # إعادة مؤجلة: كل قاعدة في الطابور وحدها حتى لا يتكرر ما نجح منها
+        for batch in batches:
+            _defer(post_shard_ledger_deferred, batch, {})
+        return
+    await _fan_out(post_shard_ledger_deferred(*batch) for batch in batches)
+
+@guarded()
+async def get_ledger_checkpoint(shard: int = SYSTEM_SHARD) -> int:
+    """آخر قيد مشمول في لقطة account_balances"""
+    if USE_POSTGRES:
+        conn = await get_postgres_connection(shard)
+        result = await conn.fetchval('SELECT COALESCE(MAX(last_posting_id), 0) FROM ledger_checkpoint')
+        await conn.close()
+        return result
+    else:
+        conn = sqlite_connect(shard)
+        cursor = conn.cursor()
+        cursor.execute('SELECT COALESCE(MAX(last_posting_id), 0) FROM ledger_checkpoint')
+        result = cursor.fetchone()[0]
+        conn.close()
+        return result
+
+@guarded()
+async def checkpoint_ledger(lag_seconds: float = 5, shard: int = SYSTEM_SHARD) -> int:
+    """تثبيت القيود الجديدة في account_balances وتقديم نقطة التثبيت
+
+    لا نثبّت إلا القيود الأقدم من lag_seconds لأن أرقام SERIAL قد تُلتزم بغير ترتيبها.
+    يعيد عدد القيود المثبّتة.
+    """
+    last_id = await get_ledger_checkpoint(shard)
+
+    if USE_POSTGRES:
+        conn = await get_postgres_connection(shard)
+        upto_id = await conn.fetchval(
+            '''SELECT MAX(id) FROM ledger
+               WHERE id > $1 AND created_at <= CURRENT_TIMESTAMP - make_interval(secs => $2)''',
+            last_id, float(lag_seconds)
         )
+        if upto_id:
+            async with conn.transaction():
+                await conn.execute(
+                    '''INSERT INTO account_balances (account_id, balance, last_posting_id)
+                       SELECT account, SUM(delta), $2 FROM (
+                           SELECT credit_account AS account, amount AS delta FROM ledger WHERE id > $1 AND id <= $2
+                           UNION ALL
+                           SELECT debit_account, -amount FROM ledger WHERE id > $1 AND id <= $2
+                       ) AS tail GROUP BY account
+                       ON CONFLICT (account_id) DO UPDATE SET
+                           balance = account_balances.balance + EXCLUDED.balance,
+                           last_posting_id = EXCLUDED.last_posting_id''',
+                    last_id, upto_id
+                )
+                await conn.execute(
+                    '''INSERT INTO ledger_checkpoint (id, last_posting_id) VALUES (1, $1)
+                       ON CONFLICT (id) DO UPDATE SET last_posting_id = EXCLUDED.last_posting_id,
+                           created_at = CURRENT_TIMESTAMP''',
+                    upto_id
+                )
         await conn.close()
-        return result['balance'] if result else 0
     else:
-        conn = sqlite3.connect('game.db')
+        conn = sqlite_connect(shard)
         cursor = conn.cursor()
         cursor.execute(
-            'UPDATE users SET balance = balance + ? WHERE user_id = ?',
-            (amount, user_id)
+            '''SELECT MAX(id) FROM ledger
+               WHERE id > ? AND created_at <= datetime('now', ?)''',
+            (last_id, f'-{int(lag_seconds)} seconds')
         )
-        cursor.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        conn.commit()
+        upto_id = cursor.fetchone()[0]
+        if upto_id:
+            cursor.execute(
+                '''INSERT INTO account_balances (account_id, balance, last_posting_id)
+                   SELECT account, SUM(delta), ? FROM (
+                       SELECT credit_account AS account, amount AS delta FROM ledger WHERE id > ? AND id <= ?
+                       UNION ALL
+                       SELECT debit_account, -amount FROM ledger WHERE id > ? AND id <= ?
+                   ) WHERE 1 GROUP BY account
+                   ON CONFLICT (account_id) DO UPDATE SET
+                       balance = balance + excluded.balance,
+                       last_posting_id = excluded.last_posting_id''',
+                (upto_id, last_id, upto_id, last_id, upto_id)
+            )
+            cursor.execute(
+                '''INSERT INTO ledger_checkpoint (id, last_posting_id) VALUES (1, ?)
+                   ON CONFLICT (id) DO UPDATE SET last_posting_id = excluded.last_posting_id,
+                       created_at = CURRENT_TIMESTAMP''',
+                (upto_id,)
+            )
+            conn.commit()
         conn.close()
-        return result[0] if result else 0
 
+    return (upto_id - last_id) if upto_id else 0
+
+@guarded()
+async def get_ledger_range_deltas(after_id: int, upto_id: int, shard: int = SYSTEM_SHARD):
+    """صافي حركة كل حساب في القيود (after_id, upto_id] مع عدد القيود غير الصالحة"""
+    query = '''
+        SELECT account, SUM(delta) FROM (
+            SELECT credit_account AS account, amount AS delta FROM ledger WHERE id > {0} AND id <= {1}
+            UNION ALL
+            SELECT debit_account, -amount FROM ledger WHERE id > {0} AND id <= {1}
+        ) AS tail GROUP BY account
+    '''
+    invalid_query = '''
+        SELECT COUNT(*) FROM ledger
+        WHERE id > {0} AND id <= {1} AND (amount <= 0 OR debit_account = credit_account)
+    '''
+    if USE_POSTGRES:
+        conn = await get_postgres_connection(shard)
+        rows = await conn.fetch(query.format('$1', '$2'), after_id, upto_id)
+        invalid = await conn.fetchval(invalid_query.format('$1', '$2'), after_id, upto_id)
+        await conn.close()
+        return {row[0]: int(row[1]) for row in rows}, invalid
+    else:
+        conn = sqlite_connect(shard)
+        cursor = conn.cursor()
+        params = {'after': after_id, 'upto': upto_id}
+        cursor.execute(query.format(':after', ':upto'), params)
+        rows = cursor.fetchall()
+        cursor.execute(invalid_query.format(':after', ':upto'), params)
+        invalid = cursor.fetchone()[0]
+        conn.close()
+        return {row[0]: int(row[1]) for row in rows}, invalid
+
+@guarded()
+async def get_account_balances(shard: int = SYSTEM_SHARD) -> dict:
+    """لقطة أرصدة الحسابات عند آخر نقطة تثبيت"""
+    if USE_POSTGRES:
+        conn = await get_postgres_connection(shard)
+        rows = await conn.fetch('SELECT account_id, balance FROM account_balances')
+        await conn.close()
+    else:
+        conn = sqlite_connect(shard)
+        cursor = conn.cursor()
+        cursor.execute('SELECT account_id, balance FROM account_balances')
+        rows = cursor.fetchall()
+        conn.close()
+    return {row[0]: row[1] for row in rows}
+
+@guarded()
+@forgets(lambda a: [('get_user_transactions', a['user_id'])])
 async def add_transaction(user_id: int, amount: int, type: str, description: str = ""):
     """إضافة معاملة"""
+    shard = await shard_of(user_id)
     if USE_POSTGRES:
-        conn = await get_postgres_connection()
+        conn = await get_postgres_connection(shard)
         await conn.execute(
             'INSERT INTO transactions (user_id, amount, type, description) VALUES ($1, $2, $3, $4)',
             user_id, amount, type, description
         )
         await conn.close()
     else:
-        conn = sqlite3.connect('game.db')
+        conn = sqlite_connect(shard)
         cursor = conn.cursor()
         cursor.execute(
             'INSERT INTO transactions (user_id, amount, type, description) VALUES (?, ?, ?, ?)',
@@ -221,76 +1530,97 @@ async def add_transaction(user_id: int, amount: int, type: str, description: str
         conn.commit()
         conn.close()
 
+@single_flight
+@guarded("read")
 async def get_user_transactions(user_id: int, limit: int = 10):
-    """جلب معاملات المستخدم"""
+    """آخر معاملات المستخدم، الأحدث أولاً (فهرس idx_transactions_user)"""
+    shard = await shard_of(user_id)
     if USE_POSTGRES:
-        conn = await get_postgres_connection()
+        conn = await get_read_connection('get_user_transactions', user_id, shard=shard)
         result = await conn.fetch(
-            'SELECT * FROM transactions WHERE user_id = $1 ORDER BY created_at DESC LIMIT $2',
+            '''SELECT amount, type, description, created_at FROM transactions
+               WHERE user_id = $1 ORDER BY created_at DESC, id DESC LIMIT $2''',
             user_id, limit
         )
         await conn.close()
-        return result
+        return [dict(row) for row in result]
     else:
-        conn = sqlite3.connect('game.db')
+        conn = sqlite_connect(shard)
         cursor = conn.cursor()
         cursor.execute(
-            'SELECT * FROM transactions WHERE user_id = ? ORDER BY created_at DESC LIMIT ?',
+            '''SELECT amount, type, description, created_at FROM transactions
+               WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?''',
             (user_id, limit)
         )
-        result = cursor.fetchall()
+        columns = [c[0] for c in cursor.description]
+        result = [dict(zip(columns, row)) for row in cursor.fetchall()]
         conn.close()
         return result
 
-async def create_round() -> int:
-    """إنشاء جولة جديدة"""
+@guarded()
+@forgets(lambda a: [('get_current_round', a['room_id'])])
+async def create_round(room_id: str = DEFAULT_ROOM, chain_id: int = None, chain_index: int = None) -> int:
+    """إنشاء جولة جديدة في الغرفة (مع موضع بذرتها في سلسلة النتائج)"""
     if USE_POSTGRES:
         conn = await get_postgres_connection()
         result = await conn.fetchrow(
-            'INSERT INTO rounds (status) VALUES ($1) RETURNING round_id',
-            'betting'
+            '''INSERT INTO rounds (status, room_id, chain_id, chain_index)
+               VALUES ($1, $2, $3, $4) RETURNING round_id''',
+            'betting', room_id, chain_id, chain_index
         )
         await conn.close()
         return result['round_id']
     else:
-        conn = sqlite3.connect('game.db')
+        conn = sqlite_connect()
         cursor = conn.cursor()
-        cursor.execute('INSERT INTO rounds (status) VALUES (?)', ('betting',))
+        cursor.execute(
+            'INSERT INTO rounds (status, room_id, chain_id, chain_index) VALUES (?, ?, ?, ?)',
+            ('betting', room_id, chain_id, chain_index)
+        )
         round_id = cursor.lastrowid
         conn.commit()
         conn.close()
         return round_id
 
-async def get_current_round():
-    """جلب الجولة الحالية"""
+@single_flight
+@guarded("read")
+async def get_current_round(room_id: str = DEFAULT_ROOM):
+    """جلب الجولة الحالية في الغرفة"""
     if USE_POSTGRES:
-        conn = await get_postgres_connection()
+        conn = await get_read_connection('get_current_round', room_id)
         result = await conn.fetchrow(
-            "SELECT * FROM rounds WHERE status IN ('betting', 'counting') ORDER BY round_id DESC LIMIT 1"
+            """SELECT * FROM rounds WHERE room_id = $1 AND status IN ('betting', 'counting')
+               ORDER BY round_id DESC LIMIT 1""",
+            room_id
         )
         await conn.close()
         return result
     else:
-        conn = sqlite3.connect('game.db')
+        conn = sqlite_connect()
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT * FROM rounds WHERE status IN ('betting', 'counting') ORDER BY round_id DESC LIMIT 1"
+            """SELECT * FROM rounds WHERE room_id = ? AND status IN ('betting', 'counting')
+               ORDER BY round_id DESC LIMIT 1""",
+            (room_id,)
         )
         result = cursor.fetchone()
         conn.close()
         return result
 
+@guarded()
+@forgets(lambda a: [('get_round_bets', a['round_id']), ('get_user_active_bet', a['user_id'], a['round_id'])])
 async def add_bet(user_id: int, round_id: int, amount: int):
     """إضافة رهان"""
+    shard = await shard_of(user_id)
     if USE_POSTGRES:
-        conn = await get_postgres_connection()
+        conn = await get_postgres_connection(shard)
         await conn.execute(
             'INSERT INTO bets (user_id, round_id, amount, status) VALUES ($1, $2, $3, $4)',
             user_id, round_id, amount, 'active'
         )
         await conn.close()
     else:
-        conn = sqlite3.connect('game.db')
+        conn = sqlite_connect(shard)
         cursor = conn.cursor()
         cursor.execute(
             'INSERT INTO bets (user_id, round_id, amount, status) VALUES (?, ?, ?, ?)',
@@ -299,76 +1629,203 @@ async def add_bet(user_id: int, round_id: int, amount: int):
         conn.commit()
         conn.close()
 
+@single_flight
+@guarded("read")
 async def get_round_bets(round_id: int):
-    """جلب رهانات الجولة"""
+    """جلب رهانات الجولة (من كل القواعد معاً)"""
+    async def fetch(shard):
+        if USE_POSTGRES:
+            conn = await get_read_connection('get_round_bets', round_id, shard=shard)
+            result = await conn.fetch(
+                'SELECT * FROM bets WHERE round_id = $1',
+                round_id
+            )
+            await conn.close()
+            return result
+        else:
+            conn = sqlite_connect(shard)
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT * FROM bets WHERE round_id = ?',
+                (round_id,)
+            )
+            result = cursor.fetchall()
+            conn.close()
+            return result
+
+    results = await _fan_out(fetch(shard) for shard in table_shards('bets'))
+    return [row for rows in results for row in rows]
+
+@guarded("defer")
+@forgets(lambda a: [('get_current_round',)])
+async def update_round_result(round_id: int, result: float, seed: str = None):
+    """تحديث نتيجة الجولة وبذرتها"""
     if USE_POSTGRES:
         conn = await get_postgres_connection()
-        result = await conn.fetch(
-            'SELECT * FROM bets WHERE round_id = $1',
-            round_id
+        await conn.execute(
+            'UPDATE rounds SET result = $1, status = $2, seed = $3 WHERE round_id = $4',
+            result, 'counting', seed, round_id
         )
         await conn.close()
-        return result
     else:
-        conn = sqlite3.connect('game.db')
+        conn = sqlite_connect()
         cursor = conn.cursor()
         cursor.execute(
-            'SELECT * FROM bets WHERE round_id = ?',
-            (round_id,)
+            'UPDATE rounds SET result = ?, status = ?, seed = ? WHERE round_id = ?',
+            (result, 'counting', seed, round_id)
         )
-        result = cursor.fetchall()
+        conn.commit()
         conn.close()
-        return result
 
-async def update_round_result(round_id: int, result: float):
-    """تحديث نتيجة الجولة"""
+@guarded("defer")
+@forgets(lambda a: [('get_current_round',)])
+async def finish_round(round_id: int, bettor_count: int = 0, total_wagered: int = 0, total_paid: int = 0,
+                       cashed_stake: int = 0, peak_liability: int = 0):
+    """إنهاء الجولة مع حفظ ملخصها وملخص تعرض البيت"""
     if USE_POSTGRES:
         conn = await get_postgres_connection()
         await conn.execute(
-            'UPDATE rounds SET result = $1, status = $2 WHERE round_id = $3',
-            result, 'counting', round_id
+            '''UPDATE rounds SET status = $1, end_time = CURRENT_TIMESTAMP,
+                   bettor_count = $2, total_wagered = $3, total_paid = $4,
+                   cashed_stake = $5, peak_liability = $6
+               WHERE round_id = $7''',
+            'finished', bettor_count, total_wagered, total_paid, cashed_stake, peak_liability, round_id
         )
         await conn.close()
     else:
-        conn = sqlite3.connect('game.db')
+        conn = sqlite_connect()
         cursor = conn.cursor()
         cursor.execute(
-            'UPDATE rounds SET result = ?, status = ? WHERE round_id = ?',
-            (result, 'counting', round_id)
+            '''UPDATE rounds SET status = ?, end_time = CURRENT_TIMESTAMP,
+                   bettor_count = ?, total_wagered = ?, total_paid = ?,
+                   cashed_stake = ?, peak_liability = ?
+               WHERE round_id = ?''',
+            ('finished', bettor_count, total_wagered, total_paid, cashed_stake, peak_liability, round_id)
         )
         conn.commit()
         conn.close()
 
-async def finish_round(round_id: int):
-    """إنهاء الجولة"""
+@guarded("read")
+async def get_finished_rounds(limit: int = 20, before_round_id: int = None, room_id: str = DEFAULT_ROOM):
+    """جلب الجولات المنتهية في الغرفة (الأحدث أولاً) عبر فهرس (room_id, round_id)"""
+    columns = ('round_id', 'result', 'bettor_count', 'total_wagered', 'total_paid', 'seed')
+    before = before_round_id if before_round_id is not None else 2 ** 31 - 1
     if USE_POSTGRES:
         conn = await get_postgres_connection()
-        await conn.execute(
-            'UPDATE rounds SET status = $1, end_time = CURRENT_TIMESTAMP WHERE round_id = $2',
-            'finished', round_id
+        result = await conn.fetch(
+            f'''SELECT {", ".join(columns)} FROM rounds
+                WHERE room_id = $1 AND round_id < $2 AND status = 'finished'
+                ORDER BY round_id DESC LIMIT $3''',
+            room_id, before, limit
+        )
+        await conn.close()
+    else:
+        conn = sqlite_connect()
+        cursor = conn.cursor()
+        cursor.execute(
+            f'''SELECT {", ".join(columns)} FROM rounds
+                WHERE room_id = ? AND round_id < ? AND status = 'finished'
+                ORDER BY round_id DESC LIMIT ?''',
+            (room_id, before, limit)
+        )
+        result = cursor.fetchall()
+        conn.close()
+    return [dict(zip(columns, tuple(row))) for row in result]
+
+# ==================== سلسلة النتائج ====================
+@guarded()
+async def add_result_chain(room_id: str, commitment: str, length: int, salt: str = '') -> int:
+    """تسجيل سلسلة بذور جديدة للغرفة (التزامها فقط؛ البذور لا تُحفظ في قاعدة البيانات)"""
+    if USE_POSTGRES:
+        conn = await get_postgres_connection()
+        chain_id = await conn.fetchval(
+            '''INSERT INTO result_chains (room_id, commitment, length, salt)
+               VALUES ($1, $2, $3, $4) RETURNING chain_id''',
+            room_id, commitment, length, salt
         )
         await conn.close()
+        return chain_id
     else:
-        conn = sqlite3.connect('game.db')
+        conn = sqlite_connect()
         cursor = conn.cursor()
         cursor.execute(
-            'UPDATE rounds SET status = ?, end_time = CURRENT_TIMESTAMP WHERE round_id = ?',
-            ('finished', round_id)
+            'INSERT INTO result_chains (room_id, commitment, length, salt) VALUES (?, ?, ?, ?)',
+            (room_id, commitment, length, salt)
+        )
+        chain_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        return chain_id
+
+@guarded()
+async def advance_result_chain(chain_id: int, used: int):
+    """حفظ عدد المواضع المستهلكة من السلسلة (لا يتراجع) قبل استخدام البذرة"""
+    if USE_POSTGRES:
+        conn = await get_postgres_connection()
+        await conn.execute(
+            'UPDATE result_chains SET used = GREATEST(used, $2) WHERE chain_id = $1',
+            chain_id, used
         )
+        await conn.close()
+    else:
+        conn = sqlite_connect()
+        conn.execute('UPDATE result_chains SET used = MAX(used, ?) WHERE chain_id = ?', (used, chain_id))
         conn.commit()
         conn.close()
 
-async def update_bet_result(bet_id: int, multiplier: float, win_amount: int):
-    """تحديث نتيجة الرهان"""
+@guarded("read")
+async def get_result_chains() -> list:
+    """كل السلاسل مع عدد المواضع المستهلكة منها (الأقدم أولاً)"""
+    query = '''SELECT chain_id, room_id, commitment, length, salt, created_at, COALESCE(used, 0)
+               FROM result_chains ORDER BY chain_id'''
+    columns = ('chain_id', 'room_id', 'commitment', 'length', 'salt', 'created_at', 'used')
+    if USE_POSTGRES:
+        conn = await get_postgres_connection()
+        rows = await conn.fetch(query)
+        await conn.close()
+    else:
+        conn = sqlite_connect()
+        rows = conn.execute(query).fetchall()
+        conn.close()
+    return [dict(zip(columns, tuple(row))) for row in rows]
+
+@guarded("read")
+async def get_round_seeds(chain_id: int, after_index: int = -1, limit: int = 100000) -> list:
+    """الجولات المكشوفة في السلسلة بعد after_index: [(round_id, chain_index, seed, result)]"""
     if USE_POSTGRES:
         conn = await get_postgres_connection()
+        rows = await conn.fetch(
+            """SELECT round_id, chain_index, seed, result FROM rounds
+               WHERE chain_id = $1 AND chain_index > $2 AND seed IS NOT NULL AND status = 'finished'
+               ORDER BY chain_index LIMIT $3""",
+            chain_id, after_index, limit
+        )
+        await conn.close()
+    else:
+        conn = sqlite_connect()
+        rows = conn.execute(
+            """SELECT round_id, chain_index, seed, result FROM rounds
+               WHERE chain_id = ? AND chain_index > ? AND seed IS NOT NULL AND status = 'finished'
+               ORDER BY chain_index LIMIT ?""",
+            (chain_id, after_index, limit)
+        ).fetchall()
+        conn.close()
+    return [tuple(row) for row in rows]
+
+@guarded("defer")
+@forgets(lambda a: [('get_round_bets',), ('get_user_active_bet',)])
+async def update_bet_result(bet_id: int, multiplier: float, win_amount: int, user_id: int = None):
+    """تحديث نتيجة الرهان (user_id يحدد قاعدته عند التقسيم: معرفات الرهانات محلية لكل قاعدة)"""
+    shard = await shard_of(user_id) if user_id else SYSTEM_SHARD
+    if USE_POSTGRES:
+        conn = await get_postgres_connection(shard)
         await conn.execute(
             'UPDATE bets SET multiplier = $1, win_amount = $2, status = $3 WHERE id = $4',
             multiplier, win_amount, 'completed', bet_id
         )
         await conn.close()
     else:
-        conn = sqlite3.connect('game.db')
+        conn = sqlite_connect(shard)
         cursor = conn.cursor()
         cursor.execute(
             'UPDATE bets SET multiplier = ?, win_amount = ?, status = ? WHERE id = ?',
@@ -377,10 +1834,13 @@ async def update_bet_result(bet_id: int, multiplier: float, win_amount: int):
         conn.commit()
         conn.close()
 
+@single_flight
+@guarded("read")
 async def get_user_active_bet(user_id: int, round_id: int):
     """جلب الرهان النشط للمستخدم"""
+    shard = await shard_of(user_id)
     if USE_POSTGRES:
-        conn = await get_postgres_connection()
+        conn = await get_read_connection('get_user_active_bet', user_id, round_id, shard=shard)
         result = await conn.fetchrow(
             'SELECT * FROM bets WHERE user_id = $1 AND round_id = $2 AND status = $3',
             user_id, round_id, 'active'
@@ -388,7 +1848,7 @@ async def get_user_active_bet(user_id: int, round_id: int):
         await conn.close()
         return result
     else:
-        conn = sqlite3.connect('game.db')
+        conn = sqlite_connect(shard)
         cursor = conn.cursor()
         cursor.execute(
             'SELECT * FROM bets WHERE user_id = ? AND round_id = ? AND status = ?',
@@ -398,17 +1858,476 @@ async def get_user_active_bet(user_id: int, round_id: int):
         conn.close()
         return result
 
+@single_flight
+@guarded("read")
 async def get_all_users():
-    """جلب جميع المستخدمين"""
+    """جلب جميع المستخدمين (من كل القواعد معاً، الأحدث أولاً)"""
+    async def fetch(shard):
+        if USE_POSTGRES:
+            conn = await get_read_connection('get_all_users', shard=shard)
+            result = await conn.fetch('SELECT * FROM users ORDER BY created_at DESC')
+            await conn.close()
+            return result
+        else:
+            conn = sqlite_connect(shard)
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM users ORDER BY created_at DESC')
+            result = cursor.fetchall()
+            conn.close()
+            return result
+
+    results = await _fan_out(fetch(shard) for shard in table_shards('users'))
+    if len(results) == 1:
+        return results[0]
+    # created_at العمود الخامس في users
+    return sorted((row for rows in results for row in rows), key=lambda row: str(row[4]), reverse=True)
+
+# ==================== إحصائيات اللاعبين ولوحات المتصدرين ====================
+@guarded("defer")
+@forgets(lambda a: [('get_user_stats', a['user_id'])])
+async def record_bet_stats(user_id: int, amount: int, period_keys: list):
+    """تحديث ملخصات الإحصائيات عند وضع رهان"""
+    if USE_POSTGRES:
+        conn = await get_postgres_connection()
+        async with conn.transaction():
+            await conn.execute(
+                '''INSERT INTO user_stats (user_id, rounds_played, total_wagered)
+                   VALUES ($1, 1, $2)
+                   ON CONFLICT (user_id) DO UPDATE SET
+                       rounds_played = user_stats.rounds_played + 1,
+                       total_wagered = user_stats.total_wagered + $2,
+                       updated_at = CURRENT_TIMESTAMP''',
+                user_id, amount
+            )
+            await conn.executemany(
+                '''INSERT INTO leaderboard_stats (period, period_key, user_id, net_profit)
+                   VALUES ($1, $2, $3, $4)
+                   ON CONFLICT (period, period_key, user_id) DO UPDATE SET
+                       net_profit = leaderboard_stats.net_profit + $4''',
+                [(period, key, user_id, -amount) for period, key in period_keys]
+            )
+        await conn.close()
+    else:
+        conn = sqlite_connect()
+        cursor = conn.cursor()
+        cursor.execute(
+            '''INSERT INTO user_stats (user_id, rounds_played, total_wagered)
+               VALUES (?, 1, ?)
+               ON CONFLICT (user_id) DO UPDATE SET
+                   rounds_played = rounds_played + 1,
+                   total_wagered = total_wagered + excluded.total_wagered,
+                   updated_at = CURRENT_TIMESTAMP''',
+            (user_id, amount)
+        )
+        cursor.executemany(
+            '''INSERT INTO leaderboard_stats (period, period_key, user_id, net_profit)
+               VALUES (?, ?, ?, ?)
+               ON CONFLICT (period, period_key, user_id) DO UPDATE SET
+                   net_profit = net_profit + excluded.net_profit''',
+            [(period, key, user_id, -amount) for period, key in period_keys]
+        )
+        conn.commit()
+        conn.close()
+
+async def record_win_stats(user_id: int, win_amount: int, multiplier: float, period_keys: list):
+    """تحديث ملخصات الإحصائيات عند الصرف أو التسوية"""
+    await record_win_stats_many([(user_id, win_amount, multiplier)], period_keys)
+
+@guarded("defer")
+@forgets(lambda a: [('get_user_stats', user_id) for user_id, _, _ in a['wins']])
+async def record_win_stats_many(wins: list, period_keys: list):
+    """تحديث ملخصات الإحصائيات لمجموعة أرباح دفعة واحدة: [(user_id, win_amount, multiplier)]"""
+    if not wins:
+        return
+
     if USE_POSTGRES:
         conn = await get_postgres_connection()
-        result = await conn.fetch('SELECT * FROM users ORDER BY created_at DESC')
+        async with conn.transaction():
+            await conn.executemany(
+                '''INSERT INTO user_stats (user_id, total_won, best_cashout, biggest_win)
+                   VALUES ($1, $2, $3, $2)
+                   ON CONFLICT (user_id) DO UPDATE SET
+                       total_won = user_stats.total_won + $2,
+                       best_cashout = GREATEST(user_stats.best_cashout, $3),
+                       biggest_win = GREATEST(user_stats.biggest_win, $2),
+                       updated_at = CURRENT_TIMESTAMP''',
+                wins
+            )
+            await conn.executemany(
+                '''INSERT INTO leaderboard_stats
+                       (period, period_key, user_id, biggest_win, best_multiplier, net_profit)
+                   VALUES ($1, $2, $3, $4, $5, $4)
+                   ON CONFLICT (period, period_key, user_id) DO UPDATE SET
+                       biggest_win = GREATEST(leaderboard_stats.biggest_win, $4),
+                       best_multiplier = GREATEST(leaderboard_stats.best_multiplier, $5),
+                       net_profit = leaderboard_stats.net_profit + $4''',
+                [(period, key, user_id, win_amount, multiplier)
+                 for user_id, win_amount, multiplier in wins for period, key in period_keys]
+            )
         await conn.close()
+    else:
+        conn = sqlite_connect()
+        cursor = conn.cursor()
+        cursor.executemany(
+            '''INSERT INTO user_stats (user_id, total_won, best_cashout, biggest_win)
+               VALUES (?, ?, ?, ?)
+               ON CONFLICT (user_id) DO UPDATE SET
+                   total_won = total_won + excluded.total_won,
+                   best_cashout = MAX(best_cashout, excluded.best_cashout),
+                   biggest_win = MAX(biggest_win, excluded.biggest_win),
+                   updated_at = CURRENT_TIMESTAMP''',
+            [(user_id, win_amount, multiplier, win_amount) for user_id, win_amount, multiplier in wins]
+        )
+        cursor.executemany(
+            '''INSERT INTO leaderboard_stats
+                   (period, period_key, user_id, biggest_win, best_multiplier, net_profit)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (period, period_key, user_id) DO UPDATE SET
+                   biggest_win = MAX(biggest_win, excluded.biggest_win),
+                   best_multiplier = MAX(best_multiplier, excluded.best_multiplier),
+                   net_profit = net_profit + excluded.net_profit''',
+            [(period, key, user_id, win_amount, multiplier, win_amount)
+             for user_id, win_amount, multiplier in wins for period, key in period_keys]
+        )
+        conn.commit()
+        conn.close()
+
+@single_flight
+@guarded("read")
+async def get_user_stats(user_id: int):
+    """جلب إحصائيات اللاعب من جدول الملخصات"""
+    columns = ('user_id', 'rounds_played', 'total_wagered', 'total_won', 'best_cashout', 'biggest_win')
+    if USE_POSTGRES:
+        conn = await get_read_connection('get_user_stats', user_id)
+        result = await conn.fetchrow(
+            f'SELECT {", ".join(columns)} FROM user_stats WHERE user_id = $1', user_id
+        )
+        await conn.close()
+    else:
+        conn = sqlite_connect()
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT {", ".join(columns)} FROM user_stats WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
+        conn.close()
+    if not result:
+        return None
+    return dict(zip(columns, tuple(result)))
+
+@guarded("read")
+async def get_leaderboard_rows(period_keys: list):
+    """جلب صفوف ملخصات المتصدرين للفترات الحالية (لتهيئة الذاكرة عند التشغيل)"""
+    query = '''SELECT period, period_key, user_id, biggest_win, best_multiplier, net_profit
+               FROM leaderboard_stats WHERE period = {0} AND period_key = {1}'''
+    rows = []
+    if USE_POSTGRES:
+        conn = await get_postgres_connection()
+        for period, key in period_keys:
+            rows.extend(tuple(r) for r in await conn.fetch(query.format('$1', '$2'), period, key))
+        await conn.close()
+    else:
+        conn = sqlite_connect()
+        cursor = conn.cursor()
+        for period, key in period_keys:
+            cursor.execute(query.format('?', '?'), (period, key))
+            rows.extend(cursor.fetchall())
+        conn.close()
+    return rows
+
+# ==================== مفاتيح منع التكرار (Idempotency) ====================
+# إعادة الطلب نفسه (مفتاح العميل في /api/bet و /api/cashout، أو update_id لأوامر
+# تيليجرام) تعيد النتيجة الأصلية. النسخة في الذاكرة (idempotency.py) تجيب معظم
+# الإعادات، والقيد الفريد هنا يمنع التنفيذ مرتين بعد إعادة التشغيل أو إخلاء الذاكرة.
+# المفاتيح في المنسقة؛ response فارغ يعني أن التنفيذ الأصلي لم ينته بعد.
+
+@guarded()
+async def claim_idempotency_key(scope: str, user_id: int, key: str):
+    """حجز المفتاح قبل التنفيذ: (True, None) إذا حُجز الآن، أو (False, الاستجابة المحفوظة)"""
+    if USE_POSTGRES:
+        conn = await get_postgres_connection()
+        claimed = await conn.fetchval(
+            '''INSERT INTO idempotency_keys (scope, user_id, key) VALUES ($1, $2, $3)
+               ON CONFLICT (scope, user_id, key) DO NOTHING RETURNING 1''',
+            scope, user_id, key
+        )
+        response = None if claimed else await conn.fetchval(
+            'SELECT response FROM idempotency_keys WHERE scope = $1 AND user_id = $2 AND key = $3',
+            scope, user_id, key
+        )
+        await conn.close()
+    else:
+        conn = sqlite_connect()
+        cursor = conn.cursor()
+        cursor.execute(
+            'INSERT OR IGNORE INTO idempotency_keys (scope, user_id, key) VALUES (?, ?, ?)',
+            (scope, user_id, key)
+        )
+        claimed = cursor.rowcount == 1
+        response = None
+        if not claimed:
+            cursor.execute(
+                'SELECT response FROM idempotency_keys WHERE scope = ? AND user_id = ? AND key = ?',
+                (scope, user_id, key)
+            )
+            response = cursor.fetchone()[0]
+        conn.commit()
+        conn.close()
+    return bool(claimed), response
+
+@guarded("defer")
+async def record_idempotent_response(scope: str, user_id: int, key: str, response: str):
+    """حفظ استجابة التنفيذ الأصلي (يُنشئ المفتاح إذا لم يُحجز أثناء تعطل القاعدة)"""
+    if USE_POSTGRES:
+        conn = await get_postgres_connection()
+        await conn.execute(
+            '''INSERT INTO idempotency_keys (scope, user_id, key, response) VALUES ($1, $2, $3, $4)
+               ON CONFLICT (scope, user_id, key) DO UPDATE SET response = $4''',
+            scope, user_id, key, response
+        )
+        await conn.close()
+    else:
+        conn = sqlite_connect()
+        conn.execute(
+            '''INSERT INTO idempotency_keys (scope, user_id, key, response) VALUES (?, ?, ?, ?)
+               ON CONFLICT (scope, user_id, key) DO UPDATE SET response = excluded.response''',
+            (scope, user_id, key, response)
+        )
+        conn.commit()
+        conn.close()
+
+@guarded()
+async def release_idempotency_key(scope: str, user_id: int, key: str):
+    """إلغاء حجز لم يكتمل (فشل التنفيذ) حتى تُنفذ الإعادة من جديد"""
+    if USE_POSTGRES:
+        conn = await get_postgres_connection()
+        await conn.execute(
+            '''DELETE FROM idempotency_keys
+               WHERE scope = $1 AND user_id = $2 AND key = $3 AND response IS NULL''',
+            scope, user_id, key
+        )
+        await conn.close()
+    else:
+        conn = sqlite_connect()
+        conn.execute(
+            'DELETE FROM idempotency_keys WHERE scope = ? AND user_id = ? AND key = ? AND response IS NULL',
+            (scope, user_id, key)
+        )
+        conn.commit()
+        conn.close()
+
+@guarded()
+async def prune_idempotency_keys(cutoff: datetime) -> int:
+    """حذف المفاتيح الأقدم من cutoff. يعيد عدد المحذوف"""
+    if USE_POSTGRES:
+        conn = await get_postgres_connection()
+        result = await conn.execute('DELETE FROM idempotency_keys WHERE created_at < $1', cutoff)
+        await conn.close()
+        return int(result.split()[-1])
+    else:
+        conn = sqlite_connect()
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM idempotency_keys WHERE created_at < ?', (cutoff.strftime('%Y-%m-%d %H:%M:%S'),))
+        deleted = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return deleted
+
+# ==================== الأرشفة والصيانة ====================
+# {الجدول: (عمود المعرف, عمود الوقت)}
+ARCHIVE_TABLES = {
+    'transactions': ('id', 'created_at'),
+    'bets': ('id', 'created_at'),
+    'rounds': ('round_id', 'start_time'),
+}
+
+@guarded()
+async def get_maintenance_state(job: str, shard: int = None) -> int:
+    """آخر معرف تمت معالجته لمهمة صيانة (للاستئناف)"""
+    if USE_POSTGRES:
+        conn = await get_postgres_connection(shard)
+        result = await conn.fetchrow('SELECT last_id FROM maintenance_state WHERE job = $1', job)
+        await conn.close()
+        return result['last_id'] if result else 0
+    else:
+        conn = sqlite_connect(shard)
+        cursor = conn.cursor()
+        cursor.execute('SELECT last_id FROM maintenance_state WHERE job = ?', (job,))
+        result = cursor.fetchone()
+        conn.close()
+        return result[0] if result else 0
+
+@guarded()
+async def get_archive_batch(table: str, after_id: int, cutoff: datetime, limit: int, shard: int = None):
+    """جلب دفعة من الصفوف الأقدم من الأفق مرتبة حسب المعرف"""
+    id_column, time_column = ARCHIVE_TABLES[table]
+    if USE_POSTGRES:
+        conn = await get_postgres_connection(shard)
+        result = await conn.fetch(
+            f'''SELECT * FROM {table}
+                WHERE {id_column} > $1 AND {time_column} < $2
+                ORDER BY {id_column} LIMIT $3''',
+            after_id, cutoff, limit
+        )
+        await conn.close()
+        return [dict(row) for row in result]
+    else:
+        conn = sqlite_connect(shard)
+        cursor = conn.cursor()
+        cursor.execute(
+            f'''SELECT * FROM {table}
+                WHERE {id_column} > ? AND {time_column} < ?
+                ORDER BY {id_column} LIMIT ?''',
+            (after_id, cutoff.strftime('%Y-%m-%d %H:%M:%S'), limit)
+        )
+        columns = [c[0] for c in cursor.description]
+        result = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        conn.close()
         return result
+
+@guarded()
+async def commit_archive_batch(table: str, ids: list, rollups: list, last_id: int, shard: int = None):
+    """حذف الدفعة المؤرشفة وتحديث الملخصات اليومية وتقدم المهمة في معاملة واحدة
+
+    rollups: [(day, type, row_count, total_amount, total_extra)]
+    """
+    id_column, _ = ARCHIVE_TABLES[table]
+    job = f'archive_{table}'
+    if USE_POSTGRES:
+        conn = await get_postgres_connection(shard)
+        async with conn.transaction():
+            await conn.executemany(
+                '''INSERT INTO daily_rollups (day, table_name, type, row_count, total_amount, total_extra)
+                   VALUES ($1::date, $2, $3, $4, $5, $6)
+                   ON CONFLICT (day, table_name, type) DO UPDATE SET
+                       row_count = daily_rollups.row_count + $4,
+                       total_amount = daily_rollups.total_amount + $5,
+                       total_extra = daily_rollups.total_extra + $6''',
+                [(datetime.strptime(day, '%Y-%m-%d').date(), table, type, count, amount, extra)
+                 for day, type, count, amount, extra in rollups]
+            )
+            await conn.execute(f'DELETE FROM {table} WHERE {id_column} = ANY($1::bigint[])', ids)
+            await conn.execute(
+                '''INSERT INTO maintenance_state (job, last_id) VALUES ($1, $2)
+                   ON CONFLICT (job) DO UPDATE SET last_id = $2, updated_at = CURRENT_TIMESTAMP''',
+                job, last_id
+            )
+        await conn.close()
     else:
-        conn = sqlite3.connect('game.db')
+        conn = sqlite_connect(shard)
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users ORDER BY created_at DESC')
-        result = cursor.fetchall()
+        cursor.executemany(
+            '''INSERT INTO daily_rollups (day, table_name, type, row_count, total_amount, total_extra)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (day, table_name, type) DO UPDATE SET
+                   row_count = row_count + excluded.row_count,
+                   total_amount = total_amount + excluded.total_amount,
+                   total_extra = total_extra + excluded.total_extra''',
+            [(day, table, type, count, amount, extra) for day, type, count, amount, extra in rollups]
+        )
+        cursor.executemany(f'DELETE FROM {table} WHERE {id_column} = ?', [(i,) for i in ids])
+        cursor.execute(
+            '''INSERT INTO maintenance_state (job, last_id) VALUES (?, ?)
+               ON CONFLICT (job) DO UPDATE SET last_id = excluded.last_id, updated_at = CURRENT_TIMESTAMP''',
+            (job, last_id)
+        )
+        conn.commit()
+        conn.close()
+
+@guarded()
+async def run_db_maintenance(vacuum: bool = False, shard: int = None):
+    """تحديث إحصائيات المخطط وتنظيف المساحة ونقاط WAL"""
+    tables = list(ARCHIVE_TABLES)
+    if USE_POSTGRES:
+        conn = await get_postgres_connection(shard)
+        for table in tables:
+            # VACUUM لا يعمل داخل معاملة: كل أمر مستقل
+            await conn.execute(f'VACUUM (ANALYZE) {table}' if vacuum else f'ANALYZE {table}')
+        try:
+            await conn.execute('CHECKPOINT')
+        except asyncpg.PostgresError:
+            pass  # يتطلب صلاحيات superuser
+        await conn.close()
+    else:
+        # أوامر SQLite متزامنة وقد تستغرق ثواني (VACUUM يعيد كتابة الملف): خارج حلقة الأحداث
+        await asyncio.to_thread(_sqlite_maintenance, vacuum, shard)
+
+def _sqlite_maintenance(vacuum: bool, shard: int = None):
+    conn = sqlite_connect(shard)
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    if vacuum:
+        conn.execute('VACUUM')
+    conn.close()
+
+@guarded()
+async def set_maintenance_state(job: str, last_id: int, shard: int = None):
+    """حفظ تقدم مهمة (علامة الاستئناف)"""
+    if USE_POSTGRES:
+        conn = await get_postgres_connection(shard)
+        await conn.execute(
+            '''INSERT INTO maintenance_state (job, last_id) VALUES ($1, $2)
+               ON CONFLICT (job) DO UPDATE SET last_id = $2, updated_at = CURRENT_TIMESTAMP''',
+            job, last_id
+        )
+        await conn.close()
+    else:
+        conn = sqlite_connect(shard)
+        conn.execute(
+            '''INSERT INTO maintenance_state (job, last_id) VALUES (?, ?)
+               ON CONFLICT (job) DO UPDATE SET last_id = excluded.last_id, updated_at = CURRENT_TIMESTAMP''',
+            (job, last_id)
+        )
+        conn.commit()
         conn.close()
-        return result
\ No newline at end of file
+
+# ==================== التصدير للتحليلات ====================
+# {الجدول: (عمود المعرف, عمود الوقت, تصدير تدريجي؟)}
+# معرفات users هي معرفات تيليجرام وليست متزايدة، فيُصدَّر الجدول كاملاً كل مرة
+EXPORT_TABLES = {
+    'rounds': ('round_id', 'start_time', True),
+    'bets': ('id', 'created_at', True),
+    'transactions': ('id', 'created_at', True),
+    'users': ('user_id', 'created_at', False),
+}
+
+async def stream_export_rows(table: str, after_id: int, cutoff: datetime = None, batch_size: int = 10000,
+                             shard: int = None):
+    """دفعات من صفوف الجدول بعد after_id والأقدم من cutoff مرتبة حسب المعرف
+
+    PostgreSQL: مؤشر من جهة الخادم في معاملة للقراءة فقط (النسخة المتماثلة إن وجدت)
+    SQLite: قراءات keyset متتالية. الذاكرة بحجم دفعة واحدة مهما كبر الجدول.
+    """
+    id_column, time_column, _ = EXPORT_TABLES[table]
+    # cutoff=None: كل الصفوف (للجداول التي تُصدَّر كاملة)
+    cutoff = cutoff or datetime.max.replace(year=9999)
+    query = f'SELECT * FROM {table} WHERE {id_column} > {{}} AND {time_column} < {{}} ORDER BY {id_column}'
+    if USE_POSTGRES:
+        conn = await get_read_connection('stream_export_rows', shard=shard)
+        try:
+            async with conn.transaction(readonly=True, isolation='repeatable_read'):
+                batch = []
+                async for row in conn.cursor(query.format('$1', '$2'), after_id, cutoff, prefetch=batch_size):
+                    batch.append(dict(row))
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+                if batch:
+                    yield batch
+        finally:
+            await conn.close()
+    else:
+        while True:
+            conn = sqlite_connect(shard)
+            cursor = conn.cursor()
+            cursor.execute(
+                query.format('?', '?') + ' LIMIT ?',
+                (after_id, cutoff.strftime('%Y-%m-%d %H:%M:%S'), batch_size)
+            )
+            columns = [c[0] for c in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            conn.close()
+            if not rows:
+                return
+            yield rows
+            if len(rows) < batch_size:
+                return
+            after_id = rows[-1][id_column]
@@ -0,0 +1,180 @@
+"""
+تصدير الجولات والرهانات والمعاملات والمستخدمين للتحليلات
+
+- القراءة على دفعات (مؤشر من جهة الخادم في PostgreSQL، keyset في SQLite)
+  فتبقى الذاكرة ثابتة مهما كبر الجدول
+- ملفات عمودية مضغوطة مقسمة حسب اليوم:
+  exports/<table>/day=<YYYY-MM-DD>/<first_id>-<last_id>.<parquet|arrow|csv.gz>
+  Parquet أو Arrow IPC (zstd) إذا توفرت pyarrow، وإلا CSV مضغوط
+- التصدير تدريجي: علامة آخر معرف مُصدَّر محفوظة في maintenance_state
+  (export_<table>)، ولا تُصدَّر إلا الصفوف الأقدم من EXPORT_LAG_SECONDS حتى
+  لا تفوت صفوف ما زالت الجولة تعدّلها
+- مع التقسيم (DATABASE_SHARDS) تُصدَّر جداول المستخدمين من كل قاعدة على حدة:
+  ملفات s<shard>-... وعمود shard في كل صف (المعرفات محلية لكل قاعدة) وعلامة
+  export_<table>_s<shard>
+
+التشغيل يدوياً:
+    python export.py [table ...] [--full]
+"""
+
+import os
+import io
+import csv
+import sys
+import gzip
+import asyncio
+import logging
+import clock
+from log_pipeline import log_context
+from collections import defaultdict
+from datetime import datetime, timedelta
+from database import (
+    EXPORT_TABLES, stream_export_rows, get_maintenance_state, set_maintenance_state, table_shards
+)
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.getenv('EXPORT_DIR', 'exports')
+EXPORT_FORMAT = os.getenv('EXPORT_FORMAT', 'parquet' if pyarrow else 'csv')
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '50000'))
+EXPORT_LAG_SECONDS = float(os.getenv('EXPORT_LAG_SECONDS', '300'))
+
+EXPORT_EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow', 'csv': 'csv.gz'}
+
+export_stats = {
+    "exported": defaultdict(int),
+    "files": 0,
+    "last_run": None,
+    "last_error": None,
+}
+_export_lock = asyncio.Lock()   # تصدير واحد في كل مرة حتى لا تتسابق العلامات
+
+
+def _row_day(row: dict, time_column: str) -> str:
+    value = row[time_column]
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+    return str(value)[:10] if value else 'unknown'
+
+def csv_chunk(rows: list, header: bool) -> bytes:
+    """دفعة صفوف بصيغة CSV مضغوطة (أعضاء gzip المتتالية ملف gzip صالح)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(rows[0].keys())
+    for row in rows:
+        writer.writerow(row.values())
+    return gzip.compress(buffer.getvalue().encode('utf-8'))
+
+def write_export_file(path: str, rows: list, export_format: str):
+    tmp_path = path + ".tmp"
+    if export_format == 'csv':
+        with open(tmp_path, "wb") as f:
+            f.write(csv_chunk(rows, header=True))
+    elif export_format == 'parquet':
+        pyarrow.parquet.write_table(pyarrow.Table.from_pylist(rows), tmp_path, compression='zstd')
+    else:
+        table = pyarrow.Table.from_pylist(rows)
+        options = pyarrow.ipc.IpcWriteOptions(compression='zstd')
+        with pyarrow.ipc.new_file(tmp_path, table.schema, options=options) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def write_export_batch(table: str, rows: list, export_format: str, day: str = None, shard: int = None) -> list:
+    """كتابة دفعة في ملفات حسب اليوم (بنفس الاسم عند الإعادة). day يثبّت القسم للجداول الكاملة"""
+    id_column, time_column, _ = EXPORT_TABLES[table]
+    first_id, last_id = rows[0][id_column], rows[-1][id_column]
+    by_day = defaultdict(list)
+    for row in rows:
+        by_day[day or _row_day(row, time_column)].append(row)
+
+    paths = []
+    for row_day, day_rows in by_day.items():
+        directory = os.path.join(EXPORT_DIR, table, f"day={row_day}")
+        os.makedirs(directory, exist_ok=True)
+        prefix = f"s{shard}-" if shard is not None else ""
+        path = os.path.join(directory, f"{prefix}{first_id:015d}-{last_id:015d}.{EXPORT_EXTENSIONS[export_format]}")
+        write_export_file(path, day_rows, export_format)
+        paths.append(path)
+    return paths
+
+
+async def export_table(table: str, full: bool = False, export_format: str = EXPORT_FORMAT,
+                       now: datetime = None) -> int:
+    """تصدير الصفوف الجديدة من الجدول منذ آخر علامة (من كل قاعدة). يعيد عدد الصفوف المُصدَّرة
+
+    now بتوقيت UTC مثل أعمدة CURRENT_TIMESTAMP التي يُقارن بها الأفق
+    """
+    if export_format not in EXPORT_EXTENSIONS:
+        raise ValueError(f"صيغة تصدير غير معروفة: {export_format}")
+    if export_format != 'csv' and pyarrow is None:
+        raise ValueError(f"صيغة {export_format} تتطلب pyarrow")
+
+    now = now or clock.utcnow()
+    exported = 0
+    for shard in table_shards(table):
+        exported += await export_shard(table, shard, full, export_format, now)
+    if exported:
+        logger.info("📦 تم تصدير %s صف من %s", exported, table, extra=log_context("export"))
+    return exported
+
+async def export_shard(table: str, shard: int, full: bool, export_format: str, now: datetime) -> int:
+    id_column, _, incremental = EXPORT_TABLES[table]
+    job = f'export_{table}' if shard is None else f'export_{table}_s{shard}'
+    after_id = 0 if full or not incremental else await get_maintenance_state(job)
+    cutoff = now - timedelta(seconds=EXPORT_LAG_SECONDS) if incremental else None
+    snapshot_day = None if incremental else now.strftime('%Y-%m-%d')
+    exported = 0
+
+    async for rows in stream_export_rows(table, after_id, cutoff, EXPORT_BATCH_SIZE, shard):
+        if shard is not None:
+            for row in rows:
+                row['shard'] = shard
+        # الكتابة والضغط خارج حلقة الأحداث
+        paths = await asyncio.to_thread(write_export_batch, table, rows, export_format, snapshot_day, shard)
+        if incremental:
+            await set_maintenance_state(job, rows[-1][id_column])
+        exported += len(rows)
+        export_stats["exported"][table] += len(rows)
+        export_stats["files"] += len(paths)
+    return exported
+
+async def run_export(tables: list = None, full: bool = False) -> dict:
+    """تصدير الجداول المطلوبة (كلها افتراضياً)"""
+    results = {}
+    async with _export_lock:
+        try:
+            for table in tables or EXPORT_TABLES:
+                results[table] = await export_table(table, full)
+        except Exception as e:
+            export_stats["last_error"] = str(e)
+            raise
+    export_stats["last_run"] = datetime.now().isoformat()
+    return results
+
+async def stream_csv(table: str, after_id: int = 0, shard: int = None):
+    """CSV مضغوط على دفعات لواجهة الأدمن (بدون حفظ على القرص ولا تحريك العلامة)"""
+    _, _, incremental = EXPORT_TABLES[table]
+    cutoff = clock.utcnow() - timedelta(seconds=EXPORT_LAG_SECONDS) if incremental else None
+    header = True
+    async for rows in stream_export_rows(table, after_id, cutoff, EXPORT_BATCH_SIZE, shard):
+        yield await asyncio.to_thread(csv_chunk, rows, header)
+        header = False
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    unknown = [table for table in args if table not in EXPORT_TABLES]
+    if unknown:
+        sys.exit(f"جداول غير معروفة: {', '.join(unknown)} (المتاح: {', '.join(EXPORT_TABLES)})")
+    counts = asyncio.run(run_export(args or None, full="--full" in sys.argv))
+    for table, count in counts.items():
+        logger.info("📦 %s: %s صف", table, count, extra=log_context("export"))
@@ -0,0 +1,70 @@
+"""
+تعرض البيت (exposure) للجولة الحالية
+
+تُحدَّث المجاميع تدريجياً عند كل رهان وكل صرف بدل جلب رهانات الجولة وجمعها،
+فالإجابة عن "كم ندفع لو انتهت الجولة الآن عند 7.3x؟" تحتاج O(1):
+
+    الالتزام عند m = المدفوع فعلاً + الرهانات غير المصروفة × m
+
+الالتزام حد أعلى: الرهانات ذات الصرف التلقائي الأقل من m تُدفع عند هدفها.
+"""
+
+
+class RoundExposure:
+    """مجاميع رهانات الجولة ومدفوعاتها"""
+
+    __slots__ = ("round_id", "bettors", "total_stake", "uncashed_stake",
+                 "cashed_stake", "paid", "peak_liability", "peak_multiplier")
+
+    def __init__(self):
+        self.reset(None)
+
+    def reset(self, round_id):
+        self.round_id = round_id
+        self.bettors = 0
+        self.total_stake = 0       # كل ما رُهن في الجولة
+        self.uncashed_stake = 0    # رهانات لم تُصرف بعد
+        self.cashed_stake = 0      # رهانات صُرفت (يدوياً أو تلقائياً أو عند النهاية)
+        self.paid = 0              # المدفوعات المحققة
+        self.peak_liability = 0
+        self.peak_multiplier = 1.0
+
+    def add_bet(self, amount: int):
+        self.bettors += 1
+        self.total_stake += amount
+        self.uncashed_stake += amount
+
+    def cash_out(self, amount: int, win_amount: int):
+        self.uncashed_stake -= amount
+        self.cashed_stake += amount
+        self.paid += win_amount
+
+    def liability(self, multiplier: float) -> int:
+        """إجمالي ما يدفعه البيت لو انتهت الجولة عند multiplier"""
+        return self.paid + int(self.uncashed_stake * multiplier)
+
+    def house_net(self, multiplier: float) -> int:
+        """ربح البيت (أو خسارته بالسالب) لو انتهت الجولة عند multiplier"""
+        return self.total_stake - self.liability(multiplier)
+
+    def observe(self, multiplier: float):
+        """تسجيل أعلى التزام بلغته الجولة (يُستدعى مع نبضات العد)"""
+        liability = self.liability(multiplier)
+        if liability > self.peak_liability:
+            self.peak_liability = liability
+            self.peak_multiplier = multiplier
+
+    def snapshot(self, multiplier: float = 1.0) -> dict:
+        return {
+            "round_id": self.round_id,
+            "bettors": self.bettors,
+            "total_stake": self.total_stake,
+            "uncashed_stake": self.uncashed_stake,
+            "cashed_stake": self.cashed_stake,
+            "paid": self.paid,
+            "multiplier": multiplier,
+            "liability": self.liability(multiplier),
+            "house_net": self.house_net(multiplier),
+            "peak_liability": self.peak_liability,
+            "peak_multiplier": self.peak_multiplier,
+        }
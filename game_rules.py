@@ -0,0 +1,62 @@
+"""
+قواعد اللعبة: توليد النتيجة، منحنى المضاعف، وحساب الربح
+
+مصدر واحد تستخدمه حلقة الجولات في main.py وأدوات المحاكاة.
+
+منحنى المضاعف لا يعتمد على النتيجة: GROWTH_BASE ** (elapsed / duration)
+فيبلغ RESULT_MAX في نهاية مرحلة العد، والجولة "تنفجر" عند وصوله إلى النتيجة.
+لذلك يرسم العميل المنحنى محلياً من معاملاته (curve_params) دون معرفة النتيجة،
+والخادم يرسل حدث الانفجار فقط.
+"""
+
+import hmac
+import math
+import random
+import hashlib
+from config import ROUND_DURATION, BETTING_DURATION
+
+RESULT_MIN = 1.5
+RESULT_MAX = 10.0
+GROWTH_BASE = RESULT_MAX
+COUNTING_DURATION = ROUND_DURATION - BETTING_DURATION
+
+def generate_result(rng=random) -> float:
+    """توليد نتيجة الجولة"""
+    return round(rng.uniform(RESULT_MIN, RESULT_MAX), 2)
+
+# حشوتا HMAC كجداول ترجمة: key.translate(_IPAD) = key XOR 0x36 لكل بايت
+_IPAD = bytes(x ^ 0x36 for x in range(256))
+_OPAD = bytes(x ^ 0x5C for x in range(256))
+
+def result_from_seed(seed: bytes, salt: bytes = b"") -> float:
+    """نتيجة الجولة من بذرتها في سلسلة النتائج: HMAC-SHA256(البذرة, الملح) يُحوَّل إلى
+    عدد منتظم في [0, 1) من أول 52 بت، ثم إلى المدى نفسه الذي يستخدمه generate_result"""
+    if len(seed) <= 64:
+        # HMAC مكتوب مباشرة (المفتاح أقصر من كتلة SHA-256): أسرع بعدة مرات للتحقق الجماعي
+        key = seed.ljust(64, b"\0")
+        inner = hashlib.sha256(key.translate(_IPAD) + salt).digest()
+        digest = hashlib.sha256(key.translate(_OPAD) + inner).digest()
+    else:
+        digest = hmac.digest(seed, salt, "sha256")
+    fraction = (int.from_bytes(digest[:8], "big") >> 12) / 2 ** 52
+    return round(RESULT_MIN + (RESULT_MAX - RESULT_MIN) * fraction, 2)
+
+def curve_params(duration: float = COUNTING_DURATION) -> dict:
+    """معاملات المنحنى التي تُرسل للعميل (لا تتضمن النتيجة)"""
+    return {"base": GROWTH_BASE, "duration": duration}
+
+def growth_at(elapsed: float, duration: float = COUNTING_DURATION) -> float:
+    """قيمة المنحنى بعد elapsed ثانية من نهاية وقت الرهان"""
+    return GROWTH_BASE ** (min(max(0.0, elapsed), duration) / duration)
+
+def multiplier_at(result: float, elapsed: float, duration: float = COUNTING_DURATION) -> float:
+    """المضاعف بعد elapsed ثانية من نهاية وقت الرهان (المنحنى حتى يبلغ النتيجة)"""
+    return round(min(result, growth_at(elapsed, duration)), 2)
+
+def crash_after(result: float, duration: float = COUNTING_DURATION) -> float:
+    """الثواني من نهاية وقت الرهان حتى يبلغ المنحنى النتيجة"""
+    return duration * math.log(result) / math.log(GROWTH_BASE)
+
+def payout(amount: int, multiplier: float) -> int:
+    """مبلغ الربح لرهان عند مضاعف معين"""
+    return int(amount * multiplier)
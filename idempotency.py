@@ -0,0 +1,195 @@
+"""
+منع تكرار الطلبات (Idempotency)
+
+اتصالات الجوال المتقطعة تعيد إرسال /api/bet و /api/cashout، وتيليجرام يعيد
+تسليم التحديث إذا لم يصله رد الـ webhook في وقته. الطلب الذي يحمل مفتاحاً
+(ترويسة Idempotency-Key، أو update_id لأوامر البوت) يُنفذ مرة واحدة:
+
+1. النسخة في الذاكرة (LRU بمدة صلاحية): الإعادة تأخذ الاستجابة الأصلية دون أي استعلام
+2. الإعادة المتزامنة مع التنفيذ الأصلي تنتظر نتيجته نفسها
+3. غير ذلك يُحجز المفتاح في idempotency_keys (قيد فريد) قبل التنفيذ، فلا يتكرر
+   التنفيذ بعد إعادة التشغيل؛ المفتاح المحجوز يعيد الاستجابة المحفوظة معه
+
+الاستجابات بحالة 500 فما فوق (أو الاستثناءات) لا تُحفظ ويُلغى حجزها: الإعادة
+تُنفذ من جديد، إلا إذا حفظ المعالج أثراً مالياً قبل الفشل (mark_committed): عندها
+تُحفظ استجابة الفشل ويبقى المفتاح محجوزاً فلا يتكرر الخصم. أثناء تعطل قاعدة
+البيانات يكفي حجز الذاكرة وتُؤجل كتابة المفتاح.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import contextvars
+from collections import OrderedDict
+from database import claim_idempotency_key, record_idempotent_response, release_idempotency_key
+from circuit_breaker import DatabaseUnavailable
+from log_pipeline import log_context
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', '20000'))
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', '600'))   # بالثواني في الذاكرة
+MAX_KEY_LENGTH = 100
+
+# ما يُعاد للمفتاح المحجوز في القاعدة دون استجابة (التنفيذ الأصلي لم يكتمل)
+IN_PROGRESS_RESPONSE = ({"error": "الطلب الأصلي قيد التنفيذ، أعد المحاولة بعد قليل"}, 409)
+# استثناء بعد حفظ أثر مالي: الإعادة تأخذ هذه الاستجابة ولا تُنفذ من جديد
+COMMITTED_ERROR_RESPONSE = ({"error": "فشل الطلب بعد تنفيذ جزء منه، راجع سجل حركاتك قبل إعادته"}, 500)
+
+idempotency_stats = {
+    "executed": 0,
+    "memory_hits": 0,
+    "joined": 0,
+    "db_hits": 0,
+    "in_progress": 0,
+    "released": 0,
+    "committed_failures": 0,
+    "evicted": 0,
+}
+
+
+class IdempotencyCache:
+    """آخر الاستجابات لكل مفتاح: LRU محدود الحجم مع مدة صلاحية"""
+
+    def __init__(self, size: int = IDEMPOTENCY_CACHE_SIZE, ttl: float = IDEMPOTENCY_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()   # {(scope, user_id, key): (انتهاء الصلاحية, الاستجابة)}
+
+    def get(self, cache_key):
+        entry = self.entries.get(cache_key)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        if expires_at < time.monotonic():
+            del self.entries[cache_key]
+            return None
+        self.entries.move_to_end(cache_key)
+        return response
+
+    def put(self, cache_key, response):
+        self.entries[cache_key] = (time.monotonic() + self.ttl, response)
+        self.entries.move_to_end(cache_key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            idempotency_stats["evicted"] += 1
+
+    def discard(self, cache_key):
+        self.entries.pop(cache_key, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+idempotency_cache = IdempotencyCache()
+_in_flight = {}   # {(scope, user_id, key): Future} التنفيذ الأصلي الجاري
+_committed = contextvars.ContextVar("idempotency_committed", default=None)   # حالة تنفيذ المعالج الجاري
+
+
+def mark_committed():
+    """المعالج الجاري حفظ أثراً مالياً (قيداً): فشله بعد ذلك لا يلغي حجز المفتاح"""
+    state = _committed.get()
+    if state is not None:
+        state["committed"] = True
+
+
+def valid_key(key) -> bool:
+    return isinstance(key, str) and 0 < len(key) <= MAX_KEY_LENGTH
+
+def _status(response) -> int:
+    return response[1] if isinstance(response, tuple) else 200
+
+async def run_once(scope: str, user_id: int, key: str, handler):
+    """تنفيذ handler() مرة واحدة لكل (scope, user_id, key) وإعادة استجابته لكل إعادة
+
+    key = None يعني طلباً بلا مفتاح: يُنفذ دائماً.
+    """
+    if key is None:
+        return await handler()
+
+    cache_key = (scope, user_id, key)
+    response = idempotency_cache.get(cache_key)
+    if response is not None:
+        idempotency_stats["memory_hits"] += 1
+        return response
+
+    future = _in_flight.get(cache_key)
+    if future is not None:
+        idempotency_stats["joined"] += 1
+        # shield حتى لا يلغي انقطاع المعيد التنفيذ الأصلي
+        return await asyncio.shield(future)
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[cache_key] = future
+    try:
+        response = await _execute(scope, user_id, key, handler)
+        future.set_result(response)
+        return response
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except BaseException as e:
+        future.set_exception(e)
+        future.exception()   # لا تحذير "exception was never retrieved" إذا لم ينتظره أحد
+        raise
+    finally:
+        del _in_flight[cache_key]
+
+async def _execute(scope: str, user_id: int, key: str, handler):
+    cache_key = (scope, user_id, key)
+    try:
+        claimed, stored = await claim_idempotency_key(scope, user_id, key)
+    except DatabaseUnavailable:
+        # حجز الذاكرة يكفي بينما القاعدة متعطلة (عامل واحد يملك الحالة)
+        claimed, stored = True, None
+
+    if not claimed:
+        if stored is None:
+            idempotency_stats["in_progress"] += 1
+            return IN_PROGRESS_RESPONSE
+        idempotency_stats["db_hits"] += 1
+        response = json.loads(stored)
+        response = tuple(response) if isinstance(response, list) else response
+        idempotency_cache.put(cache_key, response)
+        return response
+
+    idempotency_stats["executed"] += 1
+    state = {"committed": False}
+    token = _committed.set(state)
+    try:
+        response = await handler()
+    except BaseException:
+        if state["committed"]:
+            await _store(scope, user_id, key, COMMITTED_ERROR_RESPONSE)
+        else:
+            await _release(scope, user_id, key)
+        raise
+    finally:
+        _committed.reset(token)
+
+    if _status(response) >= 500 and not state["committed"]:
+        await _release(scope, user_id, key)
+        return response
+
+    await _store(scope, user_id, key, response)
+    return response
+
+async def _store(scope: str, user_id: int, key: str, response):
+    """حفظ استجابة المفتاح في الذاكرة والقاعدة (تُؤجل كتابتها إذا تعطلت القاعدة)"""
+    if _status(response) >= 500:
+        idempotency_stats["committed_failures"] += 1
+    idempotency_cache.put((scope, user_id, key), response)
+    await record_idempotent_response(scope, user_id, key, json.dumps(response, ensure_ascii=False, default=str))
+
+async def _release(scope: str, user_id: int, key: str):
+    idempotency_stats["released"] += 1
+    try:
+        await release_idempotency_key(scope, user_id, key)
+    except Exception as e:
+        logger.warning("⚠️ تعذر إلغاء حجز مفتاح التكرار %s/%s/%s: %s", scope, user_id, key, e,
+                       extra=log_context("idempotency", user_id=user_id))
+
+def get_idempotency_stats() -> dict:
+    return {**idempotency_stats, "cached": len(idempotency_cache), "in_flight": len(_in_flight)}
@@ -0,0 +1,181 @@
+"""
+لوحات المتصدرين وإحصائيات اللاعبين
+
+تُحدَّث تدريجياً عند الرهان والصرف والتسوية: جداول ملخصات في قاعدة البيانات
+وقائمة أفضل K لاعب في الذاكرة، فلا نحتاج GROUP BY على جداول transactions/bets.
+"""
+
+import os
+import bisect
+import heapq
+import logging
+import clock
+from datetime import datetime
+from config import ADMIN_ID
+from log_pipeline import log_context
+from database import record_bet_stats, record_win_stats, record_win_stats_many, get_leaderboard_rows
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_SIZE = int(os.getenv('LEADERBOARD_SIZE', '10'))
+PERIODS = ("daily", "weekly", "all")
+METRICS = ("biggest_win", "best_multiplier", "net_profit")
+
+def period_key(period: str, now: datetime = None) -> str:
+    """مفتاح الفترة الحالية (يوم / أسبوع ISO / كل الأوقات)"""
+    now = now or clock.now()
+    if period == "daily":
+        return now.strftime("%Y-%m-%d")
+    if period == "weekly":
+        year, week, _ = now.isocalendar()
+        return f"{year}-W{week:02d}"
+    return "all"
+
+def current_period_keys(now: datetime = None) -> list:
+    """مفاتيح جميع الفترات الحالية [(period, key)]"""
+    return [(period, period_key(period, now)) for period in PERIODS]
+
+
+class TopK:
+    """أفضل K قيمة مع تحديث تدريجي وقراءة O(K)
+
+    top يحمل حتى 2K مرشح: أعلى len(top) قيمة بالضبط بين كل اللاعبين. نزول قيمة
+    مرشح يخرجه من القائمة إذا تجاوزه آخرها، ولا نعيد المسح الكامل O(n) إلا عندما
+    يقل المرشحون عن K، أي بعد K نزول على الأقل منذ آخر مسح.
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        self.capacity = 2 * k
+        self.scores = {}   # {user_id: score}
+        self.top = []      # [(-score, user_id)] مرتبة تصاعدياً = الأعلى أولاً
+        self._snapshot = None
+
+    def set(self, user_id: int, score):
+        """تعيين قيمة اللاعب"""
+        old = self.scores.get(user_id)
+        if old == score:
+            return
+        self.scores[user_id] = score
+
+        if old is not None:
+            i = bisect.bisect_left(self.top, (-old, user_id))
+            if i < len(self.top) and self.top[i] == (-old, user_id):
+                del self.top[i]
+                self._snapshot = None
+
+        # خارج القائمة كل اللاعبين الآخرين الذين ليسوا فيها، وكلهم لا يتجاوزون آخرها
+        entry = (-score, user_id)
+        others_outside = len(self.scores) - 1 > len(self.top)
+        if not others_outside or (self.top and entry < self.top[-1]):
+            bisect.insort(self.top, entry)
+            del self.top[self.capacity:]
+            self._snapshot = None
+
+        if len(self.top) < self.k and len(self.scores) > len(self.top):
+            self._rescan()
+
+    def _rescan(self):
+        """إعادة ملء المرشحين من كل اللاعبين"""
+        self.top = heapq.nsmallest(self.capacity, ((-s, u) for u, s in self.scores.items()))
+        self._snapshot = None
+
+    def add(self, user_id: int, delta):
+        """إضافة قيمة (للأرباح الصافية)"""
+        self.set(user_id, self.scores.get(user_id, 0) + delta)
+
+    def raise_to(self, user_id: int, score):
+        """رفع القيمة إلى الأعلى فقط (لأكبر ربح وأعلى مضاعف)"""
+        if score > self.scores.get(user_id, 0):
+            self.set(user_id, score)
+
+    def items(self) -> list:
+        """قائمة المتصدرين الجاهزة للإرسال"""
+        if self._snapshot is None:
+            self._snapshot = [
+                {"rank": rank, "user_id": user_id, "value": -neg_score}
+                for rank, (neg_score, user_id) in enumerate(self.top[:self.k], start=1)
+            ]
+        return self._snapshot
+
+
+class Leaderboards:
+    """لوحات المتصدرين لكل فترة ومقياس"""
+
+    def __init__(self, k: int = LEADERBOARD_SIZE):
+        self.k = k
+        self.keys = {}     # {period: period_key}
+        self.boards = {}   # {(period, metric): TopK}
+
+    def board(self, period: str, metric: str, now: datetime = None) -> TopK:
+        """لوحة الفترة الحالية (تُصفّر تلقائياً عند بداية يوم/أسبوع جديد)"""
+        key = period_key(period, now)
+        if self.keys.get(period) != key:
+            self.keys[period] = key
+            for m in METRICS:
+                self.boards[(period, m)] = TopK(self.k)
+        return self.boards[(period, metric)]
+
+    def record_bet(self, user_id: int, amount: int):
+        for period in PERIODS:
+            self.board(period, "net_profit").add(user_id, -amount)
+
+    def record_win(self, user_id: int, win_amount: int, multiplier: float):
+        for period in PERIODS:
+            self.board(period, "biggest_win").raise_to(user_id, win_amount)
+            self.board(period, "best_multiplier").raise_to(user_id, multiplier)
+            self.board(period, "net_profit").add(user_id, win_amount)
+
+    def load(self, rows):
+        """تهيئة اللوحات من صفوف leaderboard_stats"""
+        for period, key, user_id, biggest_win, best_multiplier, net_profit in rows:
+            if key != period_key(period):
+                continue
+            self.board(period, "biggest_win").raise_to(user_id, biggest_win or 0)
+            self.board(period, "best_multiplier").raise_to(user_id, best_multiplier or 0)
+            self.board(period, "net_profit").set(user_id, net_profit or 0)
+
+    def top(self, period: str, metric: str) -> list:
+        return self.board(period, metric).items()
+
+leaderboards = Leaderboards()
+
+
+# ==================== نقاط التحديث ====================
+async def load_leaderboards():
+    """تحميل لوحات الفترات الحالية من جدول الملخصات"""
+    rows = await get_leaderboard_rows(current_period_keys())
+    leaderboards.load(rows)
+    logger.info("🏆 تم تحميل %s صف من لوحات المتصدرين", len(rows), extra=log_context("startup"))
+
+async def record_bet(user_id: int, amount: int):
+    """تسجيل رهان في الإحصائيات"""
+    if user_id == ADMIN_ID:
+        return
+    leaderboards.record_bet(user_id, amount)
+    try:
+        await record_bet_stats(user_id, amount, current_period_keys())
+    except Exception as e:
+        logger.error("❌ خطأ في تحديث إحصائيات الرهان للمستخدم %s: %s", user_id, e,
+                     extra=log_context("leaderboard", user_id=user_id, amount=amount))
+
+async def record_win(user_id: int, win_amount: int, multiplier: float):
+    """تسجيل ربح (صرف أو تسوية) في الإحصائيات"""
+    if user_id == ADMIN_ID:
+        return
+    leaderboards.record_win(user_id, win_amount, multiplier)
+    try:
+        await record_win_stats(user_id, win_amount, multiplier, current_period_keys())
+    except Exception as e:
+        logger.error("❌ خطأ في تحديث إحصائيات الربح للمستخدم %s: %s", user_id, e,
+                     extra=log_context("leaderboard", user_id=user_id, amount=win_amount, multiplier=multiplier))
+
+async def record_wins(wins: list):
+    """تسجيل مجموعة أرباح دفعة واحدة: [(user_id, win_amount, multiplier)]"""
+    wins = [w for w in wins if w[0] != ADMIN_ID]
+    for user_id, win_amount, multiplier in wins:
+        leaderboards.record_win(user_id, win_amount, multiplier)
+    try:
+        await record_win_stats_many(wins, current_period_keys())
+    except Exception as e:
+        logger.error("❌ خطأ في تحديث إحصائيات الأرباح: %s", e, extra=log_context("leaderboard"))
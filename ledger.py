@@ -0,0 +1,155 @@
+"""
+دفتر القيد المزدوج: نقاط التثبيت والتحقق
+
+- ledger_checkpoint_loop: تثبيت القيود الجديدة في account_balances دورياً،
+  فيبقى حساب الرصيد (لقطة + ذيل) محدوداً مهما طال تاريخ الحساب
+- LedgerVerifier: تحقق تدريجي يمر على القيود مرة واحدة فقط ويحفظ تقدمه
+  في ملف JSON، ويتأكد أن مجموع كل الحسابات صفر وأن اللقطة تطابق الدفتر
+- مع التقسيم (DATABASE_SHARDS) لكل قاعدة دفترها ونقطة تثبيتها وملف تحققها،
+  ويُنبَّه إذا لم يكن مجموع حساب المقاصة عبر القواعد صفراً
+
+التحقق يدوياً:
+    python ledger.py verify [--full]
+    python ledger.py checkpoint
+"""
+
+import os
+import sys
+import json
+import asyncio
+import logging
+from log_pipeline import log_context
+from database import (
+    checkpoint_ledger, get_ledger_checkpoint, get_ledger_range_deltas,
+    get_account_balances, table_shards, SHARD_CLEARING_ACCOUNT
+)
+
+logger = logging.getLogger(__name__)
+
+LEDGER_CHECKPOINT_INTERVAL = float(os.getenv('LEDGER_CHECKPOINT_INTERVAL', '30'))
+LEDGER_CHECKPOINT_LAG = float(os.getenv('LEDGER_CHECKPOINT_LAG', '5'))
+LEDGER_VERIFY_STATE = os.getenv('LEDGER_VERIFY_STATE', 'ledger_verify.json')
+LEDGER_VERIFY_BATCH = int(os.getenv('LEDGER_VERIFY_BATCH', '10000'))
+
+ledger_stats = {
+    "checkpoints": 0,
+    "postings_checkpointed": 0,
+    "last_error": None,
+}
+
+
+async def ledger_checkpoint_loop(is_busy=None):
+    """تقديم نقطة التثبيت دورياً في الخلفية"""
+    while True:
+        await asyncio.sleep(LEDGER_CHECKPOINT_INTERVAL)
+        # لا نزاحم حلقة الجولات أثناء العد والتسوية
+        while is_busy and is_busy():
+            await asyncio.sleep(1)
+        try:
+            counts = await asyncio.gather(*(
+                checkpoint_ledger(LEDGER_CHECKPOINT_LAG, shard) for shard in table_shards('ledger')
+            ))
+            count = sum(counts)
+            if count:
+                ledger_stats["checkpoints"] += 1
+                ledger_stats["postings_checkpointed"] += count
+        except Exception as e:
+            ledger_stats["last_error"] = str(e)
+            logger.error("❌ خطأ في تثبيت الدفتر: %s", e, extra=log_context("ledger"))
+
+
+class LedgerVerifier:
+    """تحقق تدريجي من الدفتر: يتابع من آخر قيد تم التحقق منه"""
+
+    def __init__(self, state_path: str = LEDGER_VERIFY_STATE, shard: int = None):
+        if shard is not None:
+            root, ext = os.path.splitext(state_path)
+            state_path = f"{root}.shard{shard}{ext}"
+        self.state_path = state_path
+        self.shard = shard
+        self.verified_id = 0
+        self.balances = {}   # {account_id: balance} حتى verified_id
+
+    def load(self):
+        if not os.path.exists(self.state_path):
+            return
+        with open(self.state_path, encoding="utf-8") as f:
+            state = json.load(f)
+        self.verified_id = state["verified_id"]
+        self.balances = {int(k): v for k, v in state["balances"].items()}
+
+    def save(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"verified_id": self.verified_id, "balances": self.balances}, f)
+        os.replace(tmp_path, self.state_path)
+
+    async def run(self, full: bool = False) -> list:
+        """التحقق حتى نقطة التثبيت الحالية. يعيد قائمة المشاكل (فارغة = سليم)"""
+        if full:
+            self.verified_id, self.balances = 0, {}
+        else:
+            self.load()
+
+        problems = []
+        snapshot, upto_id = None, await get_ledger_checkpoint(self.shard)
+        while snapshot is None:
+            while self.verified_id < upto_id:
+                batch_end = min(self.verified_id + LEDGER_VERIFY_BATCH, upto_id)
+                deltas, invalid = await get_ledger_range_deltas(self.verified_id, batch_end, self.shard)
+                if invalid:
+                    problems.append(f"{invalid} قيد غير صالح بين #{self.verified_id + 1} و #{batch_end}")
+                for account, delta in deltas.items():
+                    self.balances[account] = self.balances.get(account, 0) + delta
+                self.verified_id = batch_end
+            # إذا تقدمت نقطة التثبيت أثناء القراءة نكمل حتى النقطة الجديدة
+            snapshot = await get_account_balances(self.shard)
+            latest_id = await get_ledger_checkpoint(self.shard)
+            if latest_id != upto_id:
+                snapshot, upto_id = None, latest_id
+
+        total = sum(self.balances.values())
+        if total != 0:
+            problems.append(f"مجموع الأرصدة {total} وليس صفراً")
+
+        for account in set(snapshot) | set(self.balances):
+            expected, actual = self.balances.get(account, 0), snapshot.get(account, 0)
+            if expected != actual:
+                problems.append(f"الحساب {account}: الدفتر {expected} واللقطة {actual}")
+
+        if not problems:
+            self.save()
+        return problems
+
+
+async def verify(full: bool = False) -> int:
+    failed = False
+    clearing = 0
+    for shard in table_shards('ledger'):
+        verifier = LedgerVerifier(shard=shard)
+        problems = await verifier.run(full)
+        where = f" (القاعدة {shard})" if shard is not None else ""
+        for problem in problems:
+            logger.error("❌ %s%s", problem, where, extra=log_context("ledger"))
+        if not problems:
+            logger.info("✅ الدفتر سليم حتى القيد #%s (%s حساب)%s", verifier.verified_id, len(verifier.balances), where,
+                        extra=log_context("ledger"))
+        failed = failed or bool(problems)
+        clearing += verifier.balances.get(SHARD_CLEARING_ACCOUNT, 0)
+    if clearing:
+        # نقاط تثبيت القواعد مستقلة: تحويل لم يُثبَّت طرفاه بعد، أو إياب مؤجل لم يُكتب
+        logger.warning("⚠️ مجموع حساب المقاصة بين القواعد %s (يجب أن يعود صفراً)", clearing,
+                       extra=log_context("ledger", amount=clearing))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    if command == "checkpoint":
+        for shard in table_shards('ledger'):
+            count = asyncio.run(checkpoint_ledger(LEDGER_CHECKPOINT_LAG, shard))
+            logger.info("📒 تم تثبيت %s قيد%s", count, f" في القاعدة {shard}" if shard is not None else "",
+                        extra=log_context("ledger"))
+        sys.exit(0)
+    sys.exit(asyncio.run(verify(full="--full" in sys.argv)))
@@ -0,0 +1,193 @@
+"""
+التسجيل خارج المسار الساخن
+
+- الاستدعاءات لا تنسق الرسالة ولا تكتب: السجل يدخل طابوراً محدوداً وخيط
+  الكاتب (QueueListener) ينسقه ويكتبه، فلا تمر أي عملية إدخال/إخراج على حلقة
+  الأحداث. استخدم صيغة %s (logger.info("... %s", x)) حتى يؤجل التنسيق أيضاً
+- JSON سطر لكل سجل مع حقول السياق: category و room_id و round_id و user_id
+  و amount و multiplier (تُمرر عبر extra=log_context(...))
+- أخذ عينات حسب الفئة للأحداث كثيفة العدد (LOG_SAMPLE_RATES، مثلاً
+  "poll=0.01,bet=0.1")؛ الرفض يحدث قبل أي تنسيق
+- سجلات الأخطاء محدودة المعدل لكل موقع استدعاء: LOG_ERROR_BURST سجل في كل
+  LOG_ERROR_WINDOW ثانية، وأول سجل بعد النافذة يحمل عدد ما حُذف (suppressed)
+- الفئات المالية (MONEY_CATEGORIES) لا تخضع للعينات ولا لحد المعدل، وإذا امتلأ
+  الطابور تنتظر مكاناً بدل أن تُحذف
+
+LOG_FORMAT=text يعيد الصيغة النصية المقروءة للتطوير المحلي.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').strip().lower()   # json أو text
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').strip().upper()
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_ERROR_BURST = int(os.getenv('LOG_ERROR_BURST', '5'))
+LOG_ERROR_WINDOW = float(os.getenv('LOG_ERROR_WINDOW', '60'))
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# الأموال تُسجل كاملة دائماً: stake الرهان المقبول، أما bet فمحاولات الرهان المرفوضة
+MONEY_CATEGORIES = frozenset({"stake", "payout", "cashout", "transfer", "mint", "ledger"})
+CONTEXT_FIELDS = ("category", "room_id", "round_id", "user_id", "amount", "multiplier")
+
+log_stats = {
+    "format": LOG_FORMAT,
+    "queued": 0,
+    "sampled_out": 0,
+    "rate_limited": 0,
+    "dropped": 0,      # طابور ممتلئ (فئات غير مالية)
+    "waited": 0,       # طابور ممتلئ وانتظر سجل مالي
+}
+
+_state = {"listener": None, "queue": None}
+
+
+def parse_sample_rates(value: str) -> dict:
+    """"poll=0.01,bet=0.1" → {"poll": 0.01, "bet": 0.1}"""
+    rates = {}
+    for part in value.split(","):
+        if "=" in part:
+            category, rate = part.split("=", 1)
+            rates[category.strip()] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+LOG_SAMPLE_RATES = parse_sample_rates(os.getenv('LOG_SAMPLE_RATES', 'poll=0.01,bet=0.1,access=0.05'))
+
+
+def log_context(category: str, **fields) -> dict:
+    """حقول extra لسجل: logger.info("...", x, extra=log_context("bet", user_id=1))"""
+    return {"category": category, **{k: v for k, v in fields.items() if v is not None}}
+
+def record_category(record: logging.LogRecord):
+    category = getattr(record, "category", None)
+    if category is None and record.name == "uvicorn.access":
+        # سجل الوصول: الاستطلاعات GET هي الأكثف
+        args = record.args if isinstance(record.args, tuple) else ()
+        category = "poll" if len(args) > 1 and args[1] == "GET" else "access"
+        record.category = category
+    return category
+
+
+class SamplingFilter(logging.Filter):
+    """العينات حسب الفئة وحد معدل الأخطاء؛ يعمل في خيط المستدعي قبل التنسيق"""
+
+    def __init__(self, rates: dict = None, burst: int = LOG_ERROR_BURST, window: float = LOG_ERROR_WINDOW):
+        super().__init__()
+        self.rates = LOG_SAMPLE_RATES if rates is None else rates
+        self.burst = burst
+        self.window = window
+        self._errors = {}   # {(الملف, السطر): [بداية النافذة, العدد, المحذوف]}
+
+    def _allow_error(self, record) -> bool:
+        # المفتاح موقع الاستدعاء لا نص الرسالة (رسائل f-string تختلف كل مرة)
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        slot = self._errors.get(key)
+        if slot is None or now - slot[0] >= self.window:
+            suppressed = slot[2] if slot else 0
+            self._errors[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        if slot[1] < self.burst:
+            slot[1] += 1
+            return True
+        slot[2] += 1
+        log_stats["rate_limited"] += 1
+        return False
+
+    def filter(self, record) -> bool:
+        category = record_category(record)
+        if category in MONEY_CATEGORIES:
+            return True
+        if record.levelno >= logging.ERROR:
+            return self._allow_error(record)
+        rate = self.rates.get(category)
+        if rate is not None and rate < 1.0:
+            if random.random() >= rate:
+                log_stats["sampled_out"] += 1
+                return False
+            record.sample_rate = rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """سطر JSON لكل سجل (يعمل في خيط الكاتب)"""
+
+    def format(self, record) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        for field in ("sample_rate", "suppressed"):
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """يمرر السجل كما هو دون تنسيق؛ لا يحجب إلا للسجلات المالية عند امتلاء الطابور"""
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if getattr(record, "category", None) not in MONEY_CATEGORIES:
+                log_stats["dropped"] += 1
+                return
+            log_stats["waited"] += 1
+            self.queue.put(record)
+        log_stats["queued"] += 1
+
+
+def setup_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT) -> QueueListener:
+    """استبدال معالجات الجذر بالطابور وبدء خيط الكاتب (مرة واحدة)"""
+    if _state["listener"]:
+        return _state["listener"]
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+
+    records = queue.Queue(LOG_QUEUE_SIZE)
+    handler = DeferredQueueHandler(records)
+    handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+    listener = QueueListener(records, output)
+    listener.start()
+    _state.update(listener=listener, queue=records)
+    atexit.register(stop_logging)
+    return listener
+
+def stop_logging():
+    """كتابة ما في الطابور ثم إيقاف الخيط"""
+    listener = _state["listener"]
+    if listener:
+        _state["listener"] = None
+        listener.stop()
+
+def logging_stats() -> dict:
+    records = _state["queue"]
+    return {**log_stats, "pending": records.qsize() if records else 0}
@@ -1,23 +1,35 @@
 import os
+import time
+import hmac
+import json
 import asyncio
-import random
 import aiohttp
 import logging
 from datetime import datetime, timedelta
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.bot.api import TelegramAPIServer
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 
 # ==================== إعداد التسجيل ====================
-logging.basicConfig(level=logging.INFO)
+# طابور وخيط كاتب: لا تنسيق ولا كتابة على حلقة الأحداث (log_pipeline)
+from log_pipeline import setup_logging, stop_logging, log_context, logging_stats
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # ==================== استيراد الإعدادات ====================
+from config import (
+    BOT_TOKEN, ADMIN_ID, ADMIN_API_KEY, BASE_URL, TELEGRAM_API_URL,
+    ROUND_DURATION, BETTING_DURATION, BET_OPTIONS, TICK_INTERVAL,
+    DEFAULT_ROOM, TIMER_WHEEL_TICK, INLINE_CACHE_TIME, DRAIN_TIMEOUT, DRAIN_SNAPSHOT_FILE
+)
+# ساعة محرك الجولات (افتراضية في المحاكاة: bench/round_sim.py)
+import clock
+
 # ==================== قاعدة البيانات ====================
 try:
     from database import (
@@ -26,15 +38,40 @@ try:
         create_round, add_bet, get_current_round,
         get_round_bets, finish_round, update_round_result,
         set_admin_unlimited_balance, update_bet_result,
-        get_user_active_bet, get_all_users
+        get_user_active_bet, get_all_users, post_ledger_many,
+        get_single_flight_stats, get_replica_stats, get_user_stats, HOUSE_ACCOUNT, MINT_ACCOUNT,
+        post_payouts, db_breaker, get_breaker_stats, get_cache_sizes, get_shard_stats, table_shards,
+        peek_snapshot, flush_deferred_writes, InsufficientFunds
+    )
+    from circuit_breaker import DatabaseUnavailable
+    from leaderboard import (
+        leaderboards, load_leaderboards, record_bet, record_win, record_wins,
+        PERIODS, METRICS
     )
-    logger.info("✅ تم تحميل قاعدة البيانات بنجاح")
+    from round_history import load_round_history, get_history_json
+    from maintenance import maintenance_loop, maintenance_stats
+    from game_rules import multiplier_at, crash_after, payout
+    from result_chain import result_engine, fairness_info
+    from auto_cashout import MIN_AUTO_CASHOUT
+    from rooms import Room, rooms, rooms_state, load_rooms, add_room, get_room, public_rooms, rounds_busy
+    from timer_wheel import TimerWheel
+    from ledger import ledger_checkpoint_loop, ledger_stats
+    from export import EXPORT_TABLES, export_stats, run_export, stream_csv
+    from sharding import rebalance, shard_status
+    from idempotency import run_once, mark_committed, valid_key, idempotency_cache, get_idempotency_stats
+    from activity import activity_log, record_postings, get_activity, get_activity_stats, ACTIVITY_SIZE
+    from traffic_recorder import TrafficRecorder, traffic_log, recorder_stats
+    from memory_diagnostics import (
+        register_counter, memory_loop, memory_stats, memory_report,
+        start_tracemalloc, stop_tracemalloc, take_snapshot
+    )
+    logger.info("✅ تم تحميل قاعدة البيانات بنجاح", extra=log_context("startup"))
 except ImportError as e:
-    logger.error(f"❌ خطأ في تحميل قاعدة البيانات: {e}")
+    logger.error("❌ خطأ في تحميل قاعدة البيانات: %s", e, extra=log_context("startup"))
     exit(1)
 
 # ==================== إعداد البوت ====================
-bot = Bot(token=BOT_TOKEN, parse_mode="HTML")
+bot = Bot(token=BOT_TOKEN, parse_mode="HTML", server=TelegramAPIServer.from_base(TELEGRAM_API_URL))
 Bot.set_current(bot)
 storage = MemoryStorage()
 dp = Dispatcher(bot, storage=storage)
@@ -48,258 +85,416 @@ try:
         get_round_bets, finish_round, update_round_result,
         set_admin_unlimited_balance  # ⬅️ جديد
     )
-    logger.info("✅ تم تحميل قاعدة البيانات بنجاح")
+    logger.info("✅ تم تحميل قاعدة البيانات بنجاح", extra=log_context("startup"))
 except ImportError as e:
-    logger.error(f"❌ خطأ في تحميل قاعدة البيانات: {e}")
+    logger.error("❌ خطأ في تحميل قاعدة البيانات: %s", e, extra=log_context("startup"))
     exit(1)
 
-# ==================== حالة الجولة ====================
-class GameRound:
-    def __init__(self):
-        self.round_id = None
-        self.start_time = None
-        self.betting_end = None
-        self.round_end = None
-        self.result = None
-        self.status = "waiting"
-        self.bets = {}
-        self.remaining_time = 0
+# ==================== الغرف والمجدول ====================
+# كل الغرف يقودها مجدول واحد: كل حدث في الجولة يجدول الحدث التالي لغرفته
+scheduler = TimerWheel(tick=TIMER_WHEEL_TICK)
+ROUND_PAUSE = 2        # أقل انتظار بين الجولات
+ROUND_RETRY_DELAY = 5  # إعادة المحاولة بعد خطأ في الجولة
+
+def schedule_room(room: Room, delay: float, event):
+    """جدولة الحدث التالي للغرفة (يستبدل أي حدث سابق)"""
+    if room.timer:
+        room.timer.cancel()
+    room.timer = scheduler.schedule(delay, run_room_event, room, event)
 
-game_round = GameRound()
+# زمن المعالجة الفعلي لكل مرحلة (لا زمن الجولة): {المرحلة: {"count", "total_ms", "max_ms"}}
+round_phase_stats = {}
+phase_samples = None   # {المرحلة: [ثوان]} تجمعها المحاكاة لحساب النسب المئوية
+
+def record_phase(phase: str, seconds: float):
+    stats = round_phase_stats.setdefault(phase, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+    stats["count"] += 1
+    stats["total_ms"] += seconds * 1000
+    stats["max_ms"] = max(stats["max_ms"], round(seconds * 1000, 3))
+    if phase_samples is not None:
+        phase_samples.setdefault(phase, []).append(seconds)
+
+async def run_room_event(room: Room, event):
+    """تشغيل حدث الغرفة؛ عند الخطأ تبدأ الغرفة جولة جديدة بعد مهلة"""
+    started = time.perf_counter()
+    try:
+        await event(room)
+    except Exception as e:
+        logger.error("❌ خطأ في معالجة جولة الغرفة %s: %s", room.room_id, e,
+                     extra=log_context("round", room_id=room.room_id, round_id=room.round_id))
+        room.status = "waiting"
+        schedule_room(room, ROUND_RETRY_DELAY, start_new_round)
+    finally:
+        # نبضة الانفجار تستدعي end_round مباشرة: تُحسب تسوية لا نبضة عد
+        phase = event.__name__
+        if phase == "counting_tick" and room.status == "crashed":
+            phase = "end_round"
+        record_phase(phase, time.perf_counter() - started)
 
 
 # ==================== إدارة الرهانات النشطة ====================
 class ActiveBet:
-    def __init__(self, user_id: int, amount: int, round_id: int):
+    def __init__(self, user_id: int, amount: int, round_id: int, auto_cashout: float = None):
         self.user_id = user_id
         self.amount = amount
         self.round_id = round_id
         self.cashed_out = False
         self.cashout_multiplier = 1.0
+        self.auto_cashout = auto_cashout
+
+DB_UNAVAILABLE_MESSAGE = "⏳ الخدمة مشغولة مؤقتاً، الرهانات متوقفة لحظياً. حاول بعد قليل"
+
+def current_multiplier(room: Room) -> float:
+    """المضاعف الحالي للجولة من المنحنى (النتيجة بعد الانفجار)"""
+    if room.status == "counting" and room.result and room.betting_end:
+        elapsed = (clock.now() - room.betting_end).total_seconds()
+        return multiplier_at(room.result, elapsed, room.counting_duration)
+    if room.status == "crashed":
+        return room.result
+    return 1.0
+
+async def post_ledger_activity(postings: list):
+    """قيود الدفتر مع تسجيلها في سجل نشاط أطرافها (/history)"""
+    await post_ledger_many(postings)
+    record_postings(postings)
 
-active_bets = {}  # تخزين الرهانات النشطة {user_id: ActiveBet}
+async def post_payouts_activity(postings: list):
+    """قيود الأرباح والاسترداد (تُؤجل إذا تعطلت القاعدة) مع تسجيلها في سجل النشاط"""
+    await post_payouts(postings)
+    record_postings(postings)
 
-async def process_bet_cashout(user_id: int):
+async def process_bet_cashout(room: Room, user_id: int):
     """معالجة صرف الرهان"""
-    if user_id not in active_bets:
+    if user_id not in room.active_bets:
         return None
     
-    bet = active_bets[user_id]
-    if bet.cashed_out:
+    bet = room.active_bets[user_id]
+    if bet.cashed_out or room.status != "counting":
         return None
     
-    # حساب المبلغ الفائز
-    win_amount = int(bet.amount * bet.cashout_multiplier)
+    # تحديث حالة الرهان قبل أي انتظار حتى لا يُصرف مرتين (يدوي + تلقائي)
+    bet.cashed_out = True
+    bet.cashout_multiplier = current_multiplier(room)
+    room.auto_cashouts.cancel(user_id)
     
-    # تحديث رصيد المستخدم (الأدمن لا يتغير رصيده)
-    if user_id != ADMIN_ID:
-        await update_balance(user_id, win_amount)
+    # حساب المبلغ الفائز
+    win_amount = payout(bet.amount, bet.cashout_multiplier)
+    room.exposure.cash_out(bet.amount, win_amount)
     
-    # تحديث حالة الرهان
-    bet.cashed_out = True
+    # قيد الربح من البيت إلى المستخدم (يُؤجل إذا تعطلت قاعدة البيانات)
+    await post_payouts_activity([(HOUSE_ACCOUNT, user_id, win_amount, "win", f"فوز بمضاعف {bet.cashout_multiplier}x")])
     
-    # إضافة معاملة
-    await add_transaction(user_id, win_amount, "win", f"فوز بمضاعف {bet.cashout_multiplier}x")
+    # تحديث الإحصائيات ولوحات المتصدرين
+    await record_win(user_id, win_amount, bet.cashout_multiplier)
     
     return win_amount
 
 
 # ==================== إدارة الجولات ====================
-async def start_new_round():
-    """بدء جولة جديدة"""
-    global game_round
-    try:
-        game_round.round_id = await create_round()
-        game_round.start_time = datetime.now()
-        game_round.betting_end = game_round.start_time + timedelta(seconds=BETTING_DURATION)
-        game_round.round_end = game_round.start_time + timedelta(seconds=ROUND_DURATION)
-        game_round.result = None
-        game_round.status = "betting"
-        game_round.bets = {}
-        game_round.remaining_time = ROUND_DURATION
-        
-        logger.info(f"🔄 بدأت الجولة #{game_round.round_id}")
+async def start_new_round(room: Room):
+    """بدء جولة جديدة في الغرفة"""
+    if rooms_state["draining"]:
+        room.status = "waiting"
+        return False
+    try:
+        # النتيجة محددة سلفاً بالبذرة التالية في سلسلة الغرفة، وhash البذرة يُنشر مع الجولة
+        seed = await result_engine.draw(room.room_id)
+        room.round_id = await create_round(room.room_id, seed.chain_id, seed.index)
+        room.seed = seed
+        room.start_time = clock.now()
+        room.betting_end = room.start_time + timedelta(seconds=room.betting_duration)
+        room.round_end = room.start_time + timedelta(seconds=room.round_duration)
+        room.result = None
+        room.crash_after = None
+        room.status = "betting"
+        room.bets = {}
+        room.exposure.reset(room.round_id)
+        room.auto_cashouts.reset(room.round_id)
+        
+        room.publish("round")
+        schedule_room(room, room.betting_duration, start_counting)
+        logger.info("🔄 بدأت الجولة #%s في الغرفة %s", room.round_id, room.room_id,
+                    extra=log_context("round", room_id=room.room_id, round_id=room.round_id))
         return True
     except Exception as e:
-        logger.error(f"❌ خطأ في بدء الجولة: {e}")
+        # إعادة المحاولة بعد مهلة
+        room.status = "waiting"
+        schedule_room(room, ROUND_RETRY_DELAY, start_new_round)
+        logger.error("❌ خطأ في بدء الجولة في الغرفة %s: %s", room.room_id, e,
+                     extra=log_context("round", room_id=room.room_id))
         return False
 
-async def process_round():
-    """معالجة الجولة الحالية"""
-    logger.info("🎮 بدء نظام الجولات...")
+async def start_counting(room: Room):
+    """انتهاء وقت الرهان: تثبيت النتيجة وبث معاملات المنحنى وبدء نبضات العد"""
+    # النتيجة من بذرة الجولة في سلسلة النتائج
+    room.result = room.seed.result
+    room.crash_after = crash_after(room.result, room.counting_duration)
+    room.status = "counting"
     
-    # بدء الجولة الأولى
-    await start_new_round()
+    # العميل يرسم المضاعف محلياً من المنحنى؛ النتيجة لا تُرسل قبل الانفجار
+    room.publish("counting")
     
-    while True:
-        try:
-            now = datetime.now()
-            
-            # حساب الوقت المتبقي
-            if game_round.round_end:
-                game_round.remaining_time = max(0, int((game_round.round_end - now).total_seconds()))
-            else:
-                game_round.remaining_time = ROUND_DURATION
-            
-            # التحقق من انتهاء وقت الرهان
-            if game_round.status == "betting" and game_round.betting_end and now >= game_round.betting_end:
-                game_round.status = "counting"
-                
-                # توليد نتيجة عشوائية بين 1.0 و 15.0
-                game_round.result = round(random.uniform(1.5, 10.0), 2)
-                
-                await update_round_result(game_round.round_id, game_round.result)
-                logger.info(f"🎯 نتيجة الجولة #{game_round.round_id}: {game_round.result}x")
-                
-                # انتظار نهاية الجولة
-                counting_duration = ROUND_DURATION - BETTING_DURATION
-                await asyncio.sleep(counting_duration)
-                
-                # معالجة الرهانات النهائية
-                await process_final_bets()
-                
-                # إنهاء الجولة الحالية وبدء جولة جديدة
-                await finish_round(game_round.round_id)
-                await asyncio.sleep(2)  # انتظار 2 ثواني بين الجولات
-                await start_new_round()
-                
-            # تحديث مضاعفات الرهانات النشطة أثناء العد
-            elif game_round.status == "counting" and game_round.result:
-                elapsed = (now - game_round.betting_end).total_seconds()
-                total_counting = ROUND_DURATION - BETTING_DURATION
-                
-                if elapsed <= total_counting:
-                    progress = min(1.0, elapsed / total_counting)
-                    current_multiplier = 1.0 + (game_round.result - 1.0) * progress
-                    
-                    # تحديث مضاعفات الرهانات النشطة
-                    for user_id, bet in active_bets.items():
-                        if not bet.cashed_out and bet.round_id == game_round.round_id:
-                            bet.cashout_multiplier = round(current_multiplier, 2)
-            
-            elif game_round.status == "waiting":
-                await start_new_round()
-            
-            await asyncio.sleep(1)
-        except Exception as e:
-            logger.error(f"❌ خطأ في معالجة الجولة: {e}")
-            await asyncio.sleep(5)
+    await update_round_result(room.round_id, room.result, room.seed.seed)
+    logger.info("🎯 نتيجة الجولة #%s (%s): %sx", room.round_id, room.room_id, room.result,
+                extra=log_context("round", room_id=room.room_id, round_id=room.round_id,
+                                  multiplier=room.result))
+    
+    schedule_room(room, min(TICK_INTERVAL, room.crash_after), counting_tick)
 
-async def process_final_bets():
-    """معالجة الرهانات النهائية"""
+async def counting_tick(room: Room):
+    """نبضة مرحلة العد: صرف تلقائي لكل هدف يتجاوزه المضاعف حتى الانفجار"""
+    elapsed = (clock.now() - room.betting_end).total_seconds()
+    if elapsed >= room.crash_after:
+        await end_round(room)
+        return
+    
+    multiplier = multiplier_at(room.result, elapsed, room.counting_duration)
+    room.exposure.observe(multiplier)
+    await process_auto_cashouts(room, multiplier)
+    schedule_room(room, min(TICK_INTERVAL, room.crash_after - elapsed), counting_tick)
+
+async def end_round(room: Room):
+    """الانفجار: التسوية والتسجيل ثم جدولة الجولة التالية في موعدها"""
+    # لا صرف يدوي بعد الانفجار
+    room.status = "crashed"
+    room.publish("crash")
+    
+    # الأهداف التي تساوي النتيجة النهائية بالضبط
+    room.exposure.observe(room.result)
+    await process_auto_cashouts(room, room.result)
+    
+    rooms_state["settling"] += 1
     try:
-        # جلب جميع الرهانات النشطة لهذه الجولة
-        bets_to_process = []
-        for user_id, bet in list(active_bets.items()):
-            if bet.round_id == game_round.round_id and not bet.cashed_out:
-                bets_to_process.append(bet)
-                del active_bets[user_id]  # إزالة من الرهانات النشطة
-        
-        # معالجة كل رهان
-        for bet in bets_to_process:
-            try:
-                # المستخدمون الذين لم يصرفوا يحصلون على المضاعف النهائي
-                win_amount = int(bet.amount * game_round.result)
-                
-                # تحديث رصيد المستخدم (الأدمن لا يتغير رصيده)
-                if bet.user_id != ADMIN_ID:
-                    await update_balance(bet.user_id, win_amount)
-                
-                # إضافة معاملة
-                await add_transaction(
-                    bet.user_id, 
-                    win_amount, 
-                    "win", 
-                    f"فوز نهائي بمضاعف {game_round.result}x"
-                )
-                
-                # محاولة إرسال رسالة للمستخدم
-                try:
-                    await bot.send_message(
-                        bet.user_id,
-                        f"🎉 <b>انتهت الجولة #{game_round.round_id}</b>\n\n"
-                        f"🎯 النتيجة النهائية: {game_round.result}x\n"
-                        f"💰 رهانك: {bet.amount}\n"
-                        f"🏆 ربحك: {win_amount}\n"
-                        f"💳 رصيدك الجديد: {await get_balance(bet.user_id)}"
-                    )
-                except Exception as e:
-                    logger.error(f"❌ خطأ في إرسال رسالة للمستخدم {bet.user_id}: {e}")
-                    
-            except Exception as e:
-                logger.error(f"❌ خطأ في معالجة الرهان للمستخدم {bet.user_id}: {e}")
-                
-    except Exception as e:
-        logger.error(f"❌ خطأ عام في معالجة الرهانات النهائية: {e}")
-
-async def process_all_bets():
-    """معالجة جميع الرهانات"""
-    try:
-        bets = await get_round_bets(game_round.round_id)
-        
-        for bet in bets:
-            try:
-                if isinstance(bet, dict):
-                    user_id = bet.get('user_id')
-                    amount = bet.get('amount')
-                else:
-                    user_id = bet[1] if len(bet) > 1 else None
-                    amount = bet[3] if len(bet) > 3 else 0
-                
-                if user_id and amount and game_round.result:
-                    if game_round.result > 1.0:
-                        win_amount = int(amount * game_round.result)
-                        await update_balance(user_id, win_amount)
-                        
-                        try:
-                            await bot.send_message(
-                                user_id,
-                                f"🎉 <b>ربحت!</b>\n\n"
-                                f"🎯 النتيجة: {game_round.result}x\n"
-                                f"💰 الرهان: {amount}\n"
-                                f"🏆 الربح: {win_amount}\n"
-                                f"📈 رصيدك الجديد: {await get_balance(user_id)}"
-                            )
-                        except Exception as e:
-                            logger.error(f"❌ خطأ في إرسال رسالة للمستخدم {user_id}: {e}")
-            except Exception as e:
-                logger.error(f"❌ خطأ في معالجة الرهان: {e}")
-    except Exception as e:
-        logger.error(f"❌ خطأ عام في معالجة الرهانات: {e}")
+        # معالجة الرهانات النهائية
+        await process_final_bets(room)
+        
+        # إنهاء الجولة الحالية مع ملخص التعرض
+        exposure = room.exposure
+        await finish_round(
+            room.round_id,
+            exposure.bettors,
+            exposure.total_stake,
+            exposure.paid,
+            exposure.cashed_stake,
+            exposure.peak_liability
+        )
+        room.history.append(
+            room.round_id,
+            room.result,
+            exposure.bettors,
+            exposure.total_stake,
+            exposure.paid,
+            room.seed.seed
+        )
+    finally:
+        rooms_state["settling"] -= 1
+    
+    # الجولة التالية في موعدها الثابت حتى لا يكشف طول الجولة وقت الانفجار
+    until_end = (room.round_end - clock.now()).total_seconds()
+    schedule_room(room, max(ROUND_PAUSE, until_end), start_new_round)
+
+async def process_auto_cashouts(room: Room, multiplier: float) -> int:
+    """صرف الرهانات التي وصل المضاعف إلى هدفها دفعة واحدة"""
+    triggered = room.auto_cashouts.pop_triggered(multiplier)
+    if not triggered:
+        return 0
+    
+    wins = []
+    for user_id, target in triggered:
+        bet = room.active_bets.get(user_id)
+        if not bet or bet.cashed_out or bet.round_id != room.round_id:
+            continue
+        
+        bet.cashed_out = True
+        bet.cashout_multiplier = target
+        win_amount = payout(bet.amount, target)
+        room.exposure.cash_out(bet.amount, win_amount)
+        del room.active_bets[user_id]
+        wins.append((user_id, win_amount, target))
+        room.publish("cashout", {"user_id": user_id, "multiplier": target, "win_amount": win_amount, "auto": True})
+    
+    try:
+        await post_payouts_activity([
+            (HOUSE_ACCOUNT, user_id, win_amount, "win", f"صرف تلقائي بمضاعف {target}x")
+            for user_id, win_amount, target in wins
+        ])
+        await record_wins(wins)
+        for user_id, win_amount, target in wins:
+            logger.info("🤖 صرف تلقائي %s للمستخدم %s عند %sx", win_amount, user_id, target,
+                        extra=log_context("payout", room_id=room.room_id, round_id=room.round_id,
+                                          user_id=user_id, amount=win_amount, multiplier=target))
+    except Exception as e:
+        logger.error("❌ خطأ في الصرف التلقائي لـ %s رهان: %s", len(wins), e,
+                     extra=log_context("payout", room_id=room.room_id, round_id=room.round_id))
+    
+    return len(wins)
+
+async def process_final_bets(room: Room):
+    """تسوية الرهانات التي لم تُصرف بالمضاعف النهائي: قيد واحد للجولة ثم الرسائل بالتوازي"""
+    settled = []
+    for user_id, bet in list(room.active_bets.items()):
+        if bet.round_id != room.round_id or bet.cashed_out:
+            continue
+        del room.active_bets[user_id]  # إزالة من الرهانات النشطة
+        
+        # المستخدمون الذين لم يصرفوا يحصلون على المضاعف النهائي
+        win_amount = payout(bet.amount, room.result)
+        room.exposure.cash_out(bet.amount, win_amount)
+        room.publish("cashout", {"user_id": bet.user_id, "multiplier": room.result,
+                                 "win_amount": win_amount, "final": True})
+        settled.append((bet, win_amount))
+    
+    if not settled:
+        return
+    
+    try:
+        # قيود أرباح الجولة كلها معاً (تُؤجل إذا تعطلت قاعدة البيانات)
+        await post_payouts_activity([
+            (HOUSE_ACCOUNT, bet.user_id, win_amount, "win", f"فوز نهائي بمضاعف {room.result}x")
+            for bet, win_amount in settled
+        ])
+        await record_wins([(bet.user_id, win_amount, room.result) for bet, win_amount in settled])
+        for bet, win_amount in settled:
+            logger.info("🏁 فوز نهائي %s للمستخدم %s عند %sx", win_amount, bet.user_id, room.result,
+                        extra=log_context("payout", room_id=room.room_id, round_id=room.round_id,
+                                          user_id=bet.user_id, amount=win_amount, multiplier=room.result))
+    except Exception as e:
+        logger.error("❌ خطأ في تسوية %s رهان نهائي: %s", len(settled), e,
+                     extra=log_context("payout", room_id=room.room_id, round_id=room.round_id))
+        return
+    
+    # الرسائل بعد القيد وبالتوازي: بطء تيليجرام لا يؤخر تسوية باقي الرهانات
+    await asyncio.gather(*(notify_final_win(room, bet, win_amount) for bet, win_amount in settled))
+
+async def notify_final_win(room: Room, bet, win_amount: int):
+    """رسالة نتيجة الجولة للمستخدم (الفشل يُسجل فقط)"""
+    try:
+        await bot.send_message(
+            bet.user_id,
+            f"🎉 <b>انتهت الجولة #{room.round_id}</b> - {room.title}\n\n"
+            f"🎯 النتيجة النهائية: {room.result}x\n"
+            f"💰 رهانك: {bet.amount}\n"
+            f"🏆 ربحك: {win_amount}\n"
+            f"💳 رصيدك الجديد: {await get_balance(bet.user_id)}"
+        )
+    except Exception as e:
+        logger.error("❌ خطأ في إرسال رسالة للمستخدم %s: %s", bet.user_id, e,
+                     extra=log_context("notify", round_id=room.round_id, user_id=bet.user_id))
+
+def register_memory_counters():
+    """عدادات الكائنات الحية لتشخيص الذاكرة"""
+    register_counter("rooms", lambda: len(rooms))
+    register_counter("active_bets", lambda: sum(len(room.active_bets) for room in rooms.values()))
+    register_counter("round_bets", lambda: sum(len(room.bets) for room in rooms.values()))
+    register_counter("auto_cashouts", lambda: sum(len(room.auto_cashouts) for room in rooms.values()))
+    register_counter("round_history", lambda: sum(len(room.history.rounds) for room in rooms.values()))
+    register_counter("leaderboard_scores", lambda: sum(len(board.scores) for board in leaderboards.boards.values()))
+    register_counter("fsm_storage", lambda: len(storage.data))
+    register_counter("idempotency_keys", lambda: len(idempotency_cache))
+    register_counter("activity_users", lambda: len(activity_log))
+    register_counter("scheduler_timers", scheduler.pending)
+    register_counter("asyncio_tasks", lambda: len(asyncio.all_tasks()))
+    for name in get_cache_sizes():
+        register_counter(name, lambda name=name: get_cache_sizes()[name])
+    if traffic_log:
+        register_counter("traffic_buffer", lambda: len(traffic_log.buffer))
+
+def start_rooms():
+    """بدء جولات جميع الغرف على المجدول الواحد"""
+    logger.info("🎮 بدء نظام الجولات لـ %s غرفة...", len(rooms), extra=log_context("round"))
+    for room in rooms.values():
+        schedule_room(room, 0, start_new_round)
+    asyncio.create_task(scheduler.run())
 
 # ==================== إعداد Webhook ====================
 async def setup_webhook():
     """تعيين Webhook للبوت"""
     try:
         webhook_url = f"{BASE_URL}/webhook"
-        logger.info(f"🔗 محاولة تعيين Webhook على: {webhook_url}")
+        logger.info("🔗 محاولة تعيين Webhook على: %s", webhook_url, extra=log_context("startup"))
         
-        await bot.delete_webhook()
+        # set_webhook يستبدل أي Webhook سابق فلا حاجة لـ delete_webhook
         await bot.set_webhook(
             webhook_url,
             max_connections=100,
-            allowed_updates=["message", "callback_query"]
+            allowed_updates=["message", "callback_query", "inline_query"]
         )
         
-        logger.info(f"✅ تم تعيين Webhook بنجاح!")
-        
-        try:
-            await bot.send_message(
-                ADMIN_ID,
-                f"🤖 <b>البوت يعمل بنجاح!</b>\n\n"
-                f"🔗 الرابط: {BASE_URL}\n"
-                f"🕐 الوقت: {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-            )
-        except Exception as e:
-            logger.warning(f"⚠️  لم يتم إرسال رسالة للأدمن: {e}")
-        
+        logger.info("✅ تم تعيين Webhook بنجاح!", extra=log_context("startup"))
         return True
         
     except Exception as e:
-        logger.error(f"❌ خطأ في تعيين Webhook: {str(e)}")
+        logger.error("❌ خطأ في تعيين Webhook: %s", e, extra=log_context("startup"))
         return False
 
+async def notify_admin_startup():
+    """إرسال رسالة بدء التشغيل للأدمن"""
+    try:
+        await bot.send_message(
+            ADMIN_ID,
+            f"🤖 <b>البوت يعمل بنجاح!</b>\n\n"
+            f"🔗 الرابط: {BASE_URL}\n"
+            f"🕐 الوقت: {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+        )
+        return True
+    except Exception as e:
+        logger.warning("⚠️  لم يتم إرسال رسالة للأدمن: %s", e, extra=log_context("startup"))
+        return False
+
+STARTUP_RETRY_ATTEMPTS = 5
+STARTUP_RETRY_DELAY = 2.0
+
+async def run_with_retries(name: str, func, attempts: int = STARTUP_RETRY_ATTEMPTS,
+                           delay: float = STARTUP_RETRY_DELAY):
+    """تشغيل مهمة مع إعادة المحاولة (تأخير مضاعف) حتى تعيد قيمة غير False"""
+    for attempt in range(1, attempts + 1):
+        try:
+            if await func() is not False:
+                return True
+        except Exception as e:
+            logger.warning("⚠️ فشل %s (محاولة %s/%s): %s", name, attempt, attempts, e,
+                           extra=log_context("startup"))
+        if attempt < attempts:
+            await asyncio.sleep(delay * 2 ** (attempt - 1))
+    logger.error("❌ فشل %s بعد %s محاولات", name, attempts, extra=log_context("startup"))
+    return False
+
+async def background_startup():
+    """مهام التشغيل التي لا تحتاجها الطلبات الأولى"""
+    started = time.perf_counter()
+    
+    # الأدمن يحصل على رصيد غير محدود مباشرة في get_balance/update_balance
+    await run_with_retries("تعيين رصيد الأدمن", lambda: set_admin_unlimited_balance(ADMIN_ID))
+    
+    if await run_with_retries("تعيين Webhook", setup_webhook):
+        await run_with_retries("رسالة الأدمن", notify_admin_startup, attempts=3)
+    
+    logger.info("⏱️ مهام التشغيل في الخلفية انتهت خلال %.2f ثانية", time.perf_counter() - started,
+                extra=log_context("startup"))
+
 # ==================== أوامر البوت ====================
+def room_game_url(room: Room, user_id: int) -> str:
+    return f"{BASE_URL}/game?user_id={user_id}&room={room.room_id}"
+
+def rooms_text() -> str:
+    """سطر لكل غرفة عامة: المدة ووقت الرهان وخيارات الرهان"""
+    return "\n".join(
+        f"• <b>{room.title}</b> (<code>{room.room_id}</code>): "
+        f"{room.round_duration} ث، رهان {room.betting_duration} ث، "
+        f"{', '.join(map(str, room.bet_options))}"
+        for room in public_rooms()
+    )
+
+def room_from_args(message: types.Message) -> Room:
+    """الغرفة من أول معامل في الأمر (أو الافتراضية)"""
+    parts = message.text.split()
+    return get_room(parts[1] if len(parts) > 1 else None)
+
+def update_key() -> str:
+    """مفتاح منع التكرار لأمر البوت الحالي: update_id الذي يعيده تيليجرام مع كل إعادة تسليم"""
+    update = types.Update.get_current()
+    return str(update.update_id) if update else None
+
 @dp.message_handler(commands=["start", "play", "ابدأ"])
 async def cmd_start(message: types.Message):
     """بدء البوت"""
@@ -319,6 +514,10 @@ async def cmd_start(message: types.Message):
         
         keyboard = InlineKeyboardMarkup(row_width=2)
         keyboard.add(InlineKeyboardButton("🎮 ابدأ اللعب الآن", url=game_url))
+        keyboard.add(*[
+            InlineKeyboardButton(f"🏠 {room.title}", url=room_game_url(room, user_id))
+            for room in public_rooms() if room.room_id != DEFAULT_ROOM
+        ])
         
         keyboard.row(
             InlineKeyboardButton("💰 معرفة الرصيد", callback_data="check_balance"),
@@ -332,10 +531,8 @@ async def cmd_start(message: types.Message):
 
 💰 <b>رصيدك الحالي:</b> <code>{balance if user_id != ADMIN_ID else '∞ (غير محدود)'}</code> نقطة
 
-📊 <b>معلومات النظام:</b>
-• الجولة: {ROUND_DURATION} ثانية
-• وقت الرهان: {BETTING_DURATION} ثانية
-• خيارات الرهان: {', '.join(map(str, BET_OPTIONS))}
+🏠 <b>الغرف:</b>
+{rooms_text()}
 
 🎯 <b>كيف تلعب:</b>
 1. اضغط على زر 'ابدأ اللعب'
@@ -347,10 +544,12 @@ async def cmd_start(message: types.Message):
         """
         
         await message.answer(welcome_text, reply_markup=keyboard)
-        logger.info(f"📨 تم إرسال رسالة start للمستخدم {user_id}")
+        logger.info("📨 تم إرسال رسالة start للمستخدم %s", user_id,
+                    extra=log_context("command", command="start", user_id=user_id))
         
     except Exception as e:
-        logger.error(f"❌ خطأ في أمر start: {e}")
+        logger.error("❌ خطأ في أمر start: %s", e,
+                     extra=log_context("command", command="start", user_id=message.from_user.id))
 
 @dp.message_handler(commands=["balance", "رصيدي", "رصيد"])
 async def cmd_balance(message: types.Message):
@@ -365,10 +564,12 @@ async def cmd_balance(message: types.Message):
             balance_text += "\n\n👑 <b>أنت الأدمن - رصيدك غير محدود</b>"
         
         await message.answer(balance_text)
-        logger.info(f"💰 تم عرض الرصيد للمستخدم {user_id}")
+        logger.info("💰 تم عرض الرصيد للمستخدم %s", user_id,
+                    extra=log_context("command", command="balance", user_id=user_id))
         
     except Exception as e:
-        logger.error(f"❌ خطأ في أمر balance: {e}")
+        logger.error("❌ خطأ في أمر balance: %s", e,
+                     extra=log_context("command", command="balance", user_id=message.from_user.id))
 
 @dp.message_handler(commands=["send", "ارسال", "تحويل"])
 async def cmd_send(message: types.Message):
@@ -400,35 +601,38 @@ async def cmd_send(message: types.Message):
             await message.answer("❌ المبلغ يجب أن يكون أكبر من صفر")
             return
         
-        # الأدمن يمكنه الإرسال دائماً
-        if user_id != ADMIN_ID:
-            sender_balance = await get_balance(user_id)
-            if sender_balance < amount:
-                await message.answer(f"❌ رصيدك غير كافي. رصيدك: {sender_balance}")
-                return
-        
         if user_id == to_user_id:
             await message.answer("❌ لا يمكنك إرسال الرصيد لنفسك")
             return
         
-        # الأدمن لا يخصم منه
-        if user_id != ADMIN_ID:
-            await update_balance(user_id, -amount)
-        await update_balance(to_user_id, amount)
-        
-        await add_transaction(user_id, to_user_id, amount)
-        
-        await message.answer(
-            f"✅ <b>تم إرسال الرصيد بنجاح</b>\n\n"
-            f"👤 <b>إلى:</b> <code>{to_user_id}</code>\n"
-            f"💰 <b>المبلغ:</b> <code>{amount}</code> نقطة\n"
-            f"💳 <b>حالة الرصيد:</b> تمت العملية"
-        )
+        async def transfer():
+            # الأدمن يمكنه الإرسال دائماً
+            if user_id != ADMIN_ID:
+                sender_balance = await get_balance(user_id)
+                if sender_balance < amount:
+                    return f"❌ رصيدك غير كافي. رصيدك: {sender_balance}"
+            
+            # قيد تحويل واحد (الأدمن يحوّل من حساب الإصدار فلا يخصم منه)؛
+            # القيد نفسه يرفض السحب المتزامن الذي يتجاوز الرصيد
+            try:
+                await post_ledger_activity([(user_id, to_user_id, amount, "transfer", f"تحويل من {user_id} إلى {to_user_id}")])
+            except InsufficientFunds as e:
+                return f"❌ رصيدك غير كافي. رصيدك: {e.balance}"
+            logger.info("📤 المستخدم %s أرسل %s إلى %s", user_id, amount, to_user_id,
+                        extra=log_context("transfer", user_id=user_id, amount=amount))
+            return (
+                f"✅ <b>تم إرسال الرصيد بنجاح</b>\n\n"
+                f"👤 <b>إلى:</b> <code>{to_user_id}</code>\n"
+                f"💰 <b>المبلغ:</b> <code>{amount}</code> نقطة\n"
+                f"💳 <b>حالة الرصيد:</b> تمت العملية"
+            )
         
-        logger.info(f"📤 المستخدم {user_id} أرسل {amount} إلى {to_user_id}")
+        # تيليجرام قد يعيد تسليم الأمر نفسه: update_id يمنع تكرار التحويل
+        await message.answer(await run_once("send", user_id, update_key(), transfer))
         
     except Exception as e:
-        logger.error(f"❌ خطأ في أمر send: {e}")
+        logger.error("❌ خطأ في أمر send: %s", e,
+                     extra=log_context("command", command="send", user_id=message.from_user.id))
         await message.answer("❌ حدث خطأ في إرسال الرصيد")
 
 @dp.message_handler(commands=["add", "اضافة", "اعطاء"])
@@ -458,64 +662,272 @@ async def cmd_add(message: types.Message):
             await message.answer("❌ المبلغ يجب أن يكون أكبر من صفر")
             return
         
-        old_balance = await get_balance(user_id)
-        new_balance = await update_balance(user_id, amount)
-        
-        await message.answer(
-            f"✅ <b>تم إضافة الرصيد</b>\n\n"
-            f"👤 <b>المستخدم:</b> <code>{user_id}</code>\n"
-            f"➕ <b>المضاف:</b> <code>{amount}</code> نقطة\n"
-            f"📊 <b>السابق:</b> <code>{old_balance}</code> نقطة\n"
-            f"💰 <b>الجديد:</b> <code>{new_balance}</code> نقطة"
-        )
+        async def credit():
+            old_balance = await get_balance(user_id)
+            await post_ledger_activity([(MINT_ACCOUNT, user_id, amount, "credit", "إضافة من الأدمن")])
+            new_balance = await get_balance(user_id)
+            logger.info("➕ الأدمن أضف %s للمستخدم %s", amount, user_id,
+                        extra=log_context("mint", user_id=user_id, amount=amount))
+            return (
+                f"✅ <b>تم إضافة الرصيد</b>\n\n"
+                f"👤 <b>المستخدم:</b> <code>{user_id}</code>\n"
+                f"➕ <b>المضاف:</b> <code>{amount}</code> نقطة\n"
+                f"📊 <b>السابق:</b> <code>{old_balance}</code> نقطة\n"
+                f"💰 <b>الجديد:</b> <code>{new_balance}</code> نقطة"
+            )
         
-        logger.info(f"➕ الأدمن أضف {amount} للمستخدم {user_id}")
+        await message.answer(await run_once("add", ADMIN_ID, update_key(), credit))
         
     except Exception as e:
-        logger.error(f"❌ خطأ في أمر add: {e}")
+        logger.error("❌ خطأ في أمر add: %s", e,
+                     extra=log_context("command", command="add", user_id=message.from_user.id))
         await message.answer("❌ حدث خطأ في إضافة الرصيد")
 
 @dp.message_handler(commands=["round", "جولة"])
 async def cmd_round(message: types.Message):
-    """معلومات الجولة الحالية"""
+    """معلومات الجولة الحالية في الغرفة"""
     try:
-        now = datetime.now()
+        room = room_from_args(message)
+        if not room:
+            await message.answer("❌ الغرفة غير موجودة. استخدم /rooms لعرض الغرف")
+            return
         
-        if game_round.status == "waiting" or not game_round.round_id:
+        if room.status == "waiting" or not room.round_id:
             await message.answer("⏳ <b>جاري إعداد الجولة القادمة...</b>")
             return
         
-        time_left = game_round.remaining_time
+        time_left = room.remaining_time
         
-        if game_round.status == "betting":
-            betting_left = max(0, int((game_round.betting_end - now).total_seconds()))
+        if room.status == "betting":
+            betting_left = room.betting_time_left()
             status_text = f"""
-🔄 <b>الجولة #{game_round.round_id}</b>
+🔄 <b>الجولة #{room.round_id}</b> - {room.title}
 
 ⏰ <b>الحالة:</b> وقت الرهان
 🕐 <b>متبقي للرهان:</b> {betting_left} ثانية
 ⏳ <b>متبقي للجولة:</b> {time_left} ثانية
 
 🎯 <b>قواعد:</b>
-• الرهان: خلال أول {BETTING_DURATION} ثانية
+• الرهان: خلال أول {room.betting_duration} ثانية
 • النتيجة: بعد انتهاء وقت الرهان
-• الرهانات: {', '.join(map(str, BET_OPTIONS))}
+• الرهانات: {', '.join(map(str, room.bet_options))}
+            """
+        elif room.status == "crashed":
+            status_text = f"""
+💥 <b>الجولة #{room.round_id}</b> - {room.title}
+
+⏰ <b>الحالة:</b> انفجرت عند {room.result}x
+⏳ <b>الجولة القادمة بعد:</b> {time_left} ثانية
             """
         else:
             status_text = f"""
-🎯 <b>الجولة #{game_round.round_id}</b>
+🎯 <b>الجولة #{room.round_id}</b> - {room.title}
 
 ⏰ <b>الحالة:</b> جارية
-🎲 <b>النتيجة:</b> {game_round.result if game_round.result else 'قيد التحديد'}x
 ⏳ <b>متبقي:</b> {time_left} ثانية
 
-📊 <b>المضاعف الحالي:</b> {game_round.result if game_round.result else '1.00'}x
+📊 <b>المضاعف الحالي:</b> {current_multiplier(room)}x
             """
         
         await message.answer(status_text)
         
     except Exception as e:
-        logger.error(f"❌ خطأ في أمر round: {e}")
+        logger.error("❌ خطأ في أمر round: %s", e,
+                     extra=log_context("command", command="round", user_id=message.from_user.id))
+
+@dp.message_handler(commands=["rooms", "الغرف"])
+async def cmd_rooms(message: types.Message):
+    """قائمة الغرف العامة وروابط اللعب"""
+    try:
+        user_id = message.from_user.id
+        keyboard = InlineKeyboardMarkup(row_width=1)
+        keyboard.add(*[
+            InlineKeyboardButton(f"🎮 {room.title}", url=room_game_url(room, user_id))
+            for room in public_rooms()
+        ])
+        await message.answer(f"🏠 <b>الغرف المتاحة:</b>\n\n{rooms_text()}", reply_markup=keyboard)
+    except Exception as e:
+        logger.error("❌ خطأ في أمر rooms: %s", e,
+                     extra=log_context("command", command="rooms", user_id=message.from_user.id))
+
+@dp.message_handler(commands=["newroom", "غرفة_جديدة"])
+async def cmd_newroom(message: types.Message):
+    """إنشاء غرفة خاصة (للأدمن فقط)"""
+    try:
+        if message.from_user.id != ADMIN_ID:
+            await message.answer("⛔ غير مصرح لك بهذا الأمر")
+            return
+        
+        parts = message.text.split()
+        if len(parts) < 4:
+            await message.answer(
+                "📝 <b>طريقة الاستخدام:</b>\n"
+                "<code>/newroom معرف_الغرفة مدة_الجولة وقت_الرهان [مبالغ,الرهان]</code>\n\n"
+                "📌 <b>مثال:</b>\n"
+                "<code>/newroom friends 30 15 10,50,100</code>"
+            )
+            return
+        
+        try:
+            bet_options = [int(x) for x in parts[4].split(",")] if len(parts) > 4 else None
+            room = add_room(parts[1], parts[1], int(parts[2]), int(parts[3]), bet_options, private=True)
+        except ValueError as e:
+            await message.answer(f"❌ {e}")
+            return
+        
+        schedule_room(room, 0, start_new_round)
+        await message.answer(
+            f"✅ <b>تم إنشاء الغرفة الخاصة</b> <code>{room.room_id}</code>\n\n"
+            f"🔗 رابط اللعب: {BASE_URL}/game?room={room.room_id}\n"
+            f"⚠️ الغرف المنشأة بالأمر تُحذف عند إعادة التشغيل"
+        )
+        
+    except Exception as e:
+        logger.error("❌ خطأ في أمر newroom: %s", e,
+                     extra=log_context("command", command="newroom", user_id=message.from_user.id))
+
+@dp.message_handler(commands=["exposure", "التعرض"])
+async def cmd_exposure(message: types.Message):
+    """تعرض البيت في الجولة الحالية (للأدمن فقط)"""
+    try:
+        if message.from_user.id != ADMIN_ID:
+            await message.answer("⛔ غير مصرح لك بهذا الأمر")
+            return
+        
+        parts = message.text.split()
+        room = get_room(parts[1] if len(parts) > 1 else None)
+        if not room:
+            await message.answer("❌ الغرفة غير موجودة. اكتب /rooms لعرض الغرف")
+            return
+        
+        try:
+            multiplier = float(parts[2]) if len(parts) > 2 else current_multiplier(room)
+        except ValueError:
+            await message.answer("❌ المضاعف يجب أن يكون رقماً")
+            return
+        
+        e = room.exposure.snapshot(multiplier)
+        await message.answer(
+            f"📉 <b>تعرض البيت - {room.title}</b>\n\n"
+            f"🎮 الجولة: #{e['round_id']} ({room.status})\n"
+            f"👥 اللاعبون: {e['bettors']}\n"
+            f"💰 إجمالي الرهانات: {e['total_stake']}\n"
+            f"⏳ غير مصروف: {e['uncashed_stake']}\n"
+            f"🏆 المدفوع: {e['paid']}\n\n"
+            f"📈 عند {multiplier}x: الالتزام {e['liability']} | صافي البيت {e['house_net']}\n"
+            f"🔝 أعلى التزام: {e['peak_liability']} عند {e['peak_multiplier']}x"
+        )
+    except Exception as e:
+        logger.error("❌ خطأ في أمر exposure: %s", e,
+                     extra=log_context("command", command="exposure", user_id=message.from_user.id))
+
+LEADERBOARD_TITLES = {
+    "daily": "اليوم",
+    "weekly": "هذا الأسبوع",
+    "all": "كل الأوقات",
+}
+
+METRIC_TITLES = {
+    "biggest_win": "🏆 أكبر ربح",
+    "best_multiplier": "🚀 أعلى مضاعف",
+    "net_profit": "💹 صافي الربح",
+}
+
+@dp.message_handler(commands=["top", "المتصدرين"])
+async def cmd_top(message: types.Message):
+    """قائمة المتصدرين"""
+    try:
+        parts = message.text.split()
+        period = parts[1].lower() if len(parts) > 1 else "daily"
+        if period not in PERIODS:
+            await message.answer(
+                "📝 <b>طريقة الاستخدام:</b>\n"
+                "<code>/top daily|weekly|all</code>"
+            )
+            return
+        
+        lines = [f"🏅 <b>المتصدرون - {LEADERBOARD_TITLES[period]}</b>"]
+        for metric in METRICS:
+            lines.append(f"\n<b>{METRIC_TITLES[metric]}:</b>")
+            entries = leaderboards.top(period, metric)
+            if not entries:
+                lines.append("لا توجد بيانات بعد")
+            for entry in entries:
+                value = f"{entry['value']}x" if metric == "best_multiplier" else entry["value"]
+                lines.append(f"{entry['rank']}. <code>{entry['user_id']}</code> - {value}")
+        
+        await message.answer("\n".join(lines))
+        
+    except Exception as e:
+        logger.error("❌ خطأ في أمر top: %s", e,
+                     extra=log_context("command", command="top", user_id=message.from_user.id))
+
+@dp.message_handler(commands=["mystats", "احصائياتي"])
+async def cmd_mystats(message: types.Message):
+    """إحصائيات اللاعب"""
+    try:
+        user_id = message.from_user.id
+        stats = await get_user_stats(user_id)
+        
+        if not stats:
+            await message.answer("📊 لا توجد إحصائيات بعد. ضع رهانك الأول!")
+            return
+        
+        await message.answer(
+            f"📊 <b>إحصائياتك</b>\n\n"
+            f"🎮 <b>الجولات:</b> <code>{stats['rounds_played']}</code>\n"
+            f"💰 <b>إجمالي الرهانات:</b> <code>{stats['total_wagered']}</code> نقطة\n"
+            f"🏆 <b>إجمالي الأرباح:</b> <code>{stats['total_won']}</code> نقطة\n"
+            f"🚀 <b>أفضل صرف:</b> <code>{stats['best_cashout']}x</code>\n"
+            f"💎 <b>أكبر ربح:</b> <code>{stats['biggest_win']}</code> نقطة"
+        )
+        
+    except Exception as e:
+        logger.error("❌ خطأ في أمر mystats: %s", e,
+                     extra=log_context("command", command="mystats", user_id=message.from_user.id))
+
+ACTIVITY_LABELS = {
+    "bet": "🎲 رهان",
+    "win": "🏆 ربح",
+    "transfer": "🔁 تحويل",
+    "credit": "➕ إضافة",
+    "refund": "↩️ استرداد",
+    "adjust": "⚙️ تسوية",
+    "opening": "📂 رصيد افتتاحي",
+}
+
+@dp.message_handler(commands=["history", "سجلي", "حركاتي"])
+async def cmd_history(message: types.Message):
+    """آخر حركات اللاعب (من سجل النشاط في الذاكرة)"""
+    try:
+        activity = await get_activity(message.from_user.id, 10)
+        if not activity:
+            await message.answer("📜 لا توجد حركات بعد. ضع رهانك الأول!")
+            return
+        lines = [
+            f"{ACTIVITY_LABELS.get(entry['type'], entry['type'])}: <code>{entry['amount']:+}</code> "
+            f"<i>{(entry['created_at'] or '')[5:16]}</i>"
+            for entry in activity
+        ]
+        await message.answer("📜 <b>آخر حركاتك</b>\n\n" + "\n".join(lines))
+    except DatabaseUnavailable:
+        await message.answer(DB_UNAVAILABLE_MESSAGE)
+    except Exception as e:
+        logger.error("❌ خطأ في أمر history: %s", e,
+                     extra=log_context("command", command="history", user_id=message.from_user.id))
+
+@dp.message_handler(commands=["results", "النتائج"])
+async def cmd_results(message: types.Message):
+    """آخر نتائج الجولات"""
+    try:
+        room = room_from_args(message)
+        if not room:
+            await message.answer("❌ الغرفة غير موجودة. استخدم /rooms لعرض الغرف")
+            return
+        await message.answer(room.history.latest_text())
+    except Exception as e:
+        logger.error("❌ خطأ في أمر results: %s", e,
+                     extra=log_context("command", command="results", user_id=message.from_user.id))
 
 @dp.message_handler(commands=["help", "مساعدة", "الاوامر"])
 async def cmd_help(message: types.Message):
@@ -528,14 +940,18 @@ async def cmd_help(message: types.Message):
 /start - بدء البوت وعرض رابط اللعبة
 /balance - عرض رصيدك
 /send معرف مبلغ - إرسال رصيد لمستخدم
-/round - حالة الجولة الحالية
+/rooms - قائمة الغرف وروابط اللعب
+/round [غرفة] - حالة الجولة الحالية
+/results [غرفة] - آخر نتائج الجولات
+/top - قائمة المتصدرين (daily/weekly/all)
+/mystats - إحصائياتك
+/history - آخر حركاتك (رهانات وأرباح وتحويلات)
 /help - عرض هذه القائمة
 
 🎯 <b>لعبة الرهان:</b>
 • اضغط /start للحصول على رابط اللعبة
-• الجولة: {ROUND_DURATION} ثانية
-• وقت الرهان: {BETTING_DURATION} ثانية
-• خيارات الرهان: {', '.join(map(str, BET_OPTIONS))}
+• اكتب اسم البوت مع @ في أي محادثة لمشاركة الجولة والنتائج ورصيدك
+{rooms_text()}
 
 💰 <b>نظام الرصيد:</b>
 • ابدأ برصيد 0
@@ -544,6 +960,8 @@ async def cmd_help(message: types.Message):
 
 ⚙️ <b>أوامر الأدمن:</b>
 /add معرف مبلغ - إضافة رصيد لمستخدم
+/newroom معرف مدة رهان - إنشاء غرفة خاصة
+/exposure [غرفة] [مضاعف] - تعرض البيت في الجولة الحالية
 
 📞 <b>الدعم:</b>
 تواصل مع الأدمن للمساعدة
@@ -552,7 +970,92 @@ async def cmd_help(message: types.Message):
         await message.answer(help_text)
         
     except Exception as e:
-        logger.error(f"❌ خطأ في أمر help: {e}")
+        logger.error("❌ خطأ في أمر help: %s", e,
+                     extra=log_context("command", command="help", user_id=message.from_user.id))
+
+# ==================== الوضع المضمن (@bot) ====================
+# الإجابة كلها من الذاكرة: حالة الغرفة وسجلها ولقطة الرصيد الأخيرة، دون أي استعلام
+inline_stats = {"queries": 0, "built": 0, "balance_known": 0, "balance_unknown": 0}
+_inline_articles = {}   # {room_id: ((round_id, status), [مقالات مشتركة])}
+
+def inline_round_text(room: Room) -> str:
+    """نص الجولة للمشاركة في أي محادثة (بلا عدادات ثوانٍ تتقادم فور الإرسال)"""
+    if room.status == "betting":
+        state = f"🕒 وقت الرهان مفتوح\n🎯 الرهانات: {', '.join(map(str, room.bet_options))}"
+    elif room.status == "counting":
+        state = "✈️ الطائرة في الجو!"
+    elif room.status == "crashed":
+        state = f"💥 انفجرت عند <b>{room.result}x</b>"
+    else:
+        state = "⏳ جاري إعداد الجولة القادمة"
+    fairness = f"\n🔐 <code>{room.seed.hash}</code>" if room.seed else ""
+    return f"🎮 <b>{room.title}</b> - الجولة #{room.round_id or 0}\n\n{state}{fairness}"
+
+def inline_shared_articles(room: Room) -> list:
+    """مقالتا الجولة وآخر النتائج: تُبنى مرة واحدة لكل حالة جولة وتُشارك بين كل الاستعلامات"""
+    key = (room.round_id, room.status)
+    cached = _inline_articles.get(room.room_id)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    inline_stats["built"] += 1
+    articles = [
+        types.InlineQueryResultArticle(
+            id=f"round:{room.room_id}:{room.round_id}:{room.status}",
+            title=f"🎮 {room.title} - الجولة #{room.round_id or 0}",
+            description={"betting": "وقت الرهان مفتوح", "counting": "الجولة جارية",
+                         "crashed": f"انفجرت عند {room.result}x"}.get(room.status, "انتظار الجولة القادمة"),
+            input_message_content=types.InputTextMessageContent(inline_round_text(room), parse_mode="HTML"),
+        ),
+        types.InlineQueryResultArticle(
+            id=f"results:{room.room_id}:{room.round_id}:{room.status}",
+            title="📜 آخر النتائج",
+            description=" | ".join(f"{r['result']}x" for r in list(room.history.rounds)[:5]) or "لا توجد جولات بعد",
+            input_message_content=types.InputTextMessageContent(room.history.latest_text(), parse_mode="HTML"),
+        ),
+    ]
+    _inline_articles[room.room_id] = (key, articles)
+    return articles
+
+def inline_balance_article(user_id: int):
+    """رصيد المستخدم من آخر قراءة ناجحة في الذاكرة (لا استعلام)؛ None إن لم يُقرأ بعد"""
+    if user_id == ADMIN_ID:
+        balance = "∞ (غير محدود)"
+    else:
+        balance = peek_snapshot("get_balance", user_id)
+        if balance is None:
+            inline_stats["balance_unknown"] += 1
+            return None
+    inline_stats["balance_known"] += 1
+    return types.InlineQueryResultArticle(
+        id=f"balance:{user_id}",
+        title=f"💰 رصيدك: {balance} نقطة",
+        description="آخر رصيد معروف",
+        input_message_content=types.InputTextMessageContent(f"💰 رصيدي في Aviator: <b>{balance}</b> نقطة",
+                                                            parse_mode="HTML"),
+    )
+
+@dp.inline_handler()
+async def inline_query(query: types.InlineQuery):
+    """@bot [غرفة]: الجولة الحالية وآخر النتائج ورصيد المستخدم"""
+    inline_stats["queries"] += 1
+    try:
+        room = get_room(query.query.strip().split()[0] if query.query.strip() else None) or get_room(None)
+        results = list(inline_shared_articles(room))
+        balance = inline_balance_article(query.from_user.id)
+        if balance:
+            results.append(balance)
+        # is_personal: الرصيد يختلف لكل مستخدم؛ cache_time قصير لأن الجولة تتغير كل ثوانٍ
+        await query.answer(
+            results,
+            cache_time=INLINE_CACHE_TIME,
+            is_personal=True,
+            switch_pm_text="🎮 العب الآن" if balance is None else None,
+            switch_pm_parameter=room.room_id if balance is None else None,
+        )
+    except Exception as e:
+        logger.error("❌ خطأ في الاستعلام المضمن: %s", e,
+                     extra=log_context("command", command="inline", user_id=query.from_user.id))
 
 # ==================== معالجة Callback ====================
 @dp.callback_query_handler(lambda c: c.data in ["check_balance", "send_balance_menu"])
@@ -583,46 +1086,160 @@ async def process_callback(callback_query: types.CallbackQuery):
             await bot.answer_callback_query(callback_query.id)
             
     except Exception as e:
-        logger.error(f"❌ خطأ في معالجة callback: {e}")
+        logger.error("❌ خطأ في معالجة callback: %s", e,
+                     extra=log_context("command", command=callback_query.data,
+                                       user_id=callback_query.from_user.id))
+
+# ==================== الإيقاف الآمن ====================
+async def refund_round(room: Room):
+    """إلغاء جولة ما زالت في وقت الرهان وإرجاع رهاناتها (لم يرَ أحد أي مضاعف بعد)"""
+    if room.timer:
+        room.timer.cancel()
+        room.timer = None
+    bets = [bet for bet in room.active_bets.values() if bet.round_id == room.round_id]
+    for bet in bets:
+        del room.active_bets[bet.user_id]
+    room.status = "waiting"
+    room.bets = {}
+    room.auto_cashouts.reset(room.round_id)
+    room.publish("round")
+    if bets:
+        # تُؤجل إذا تعطلت قاعدة البيانات ثم تُعاد أو تُحفظ في flush_deferred_writes
+        await post_payouts_activity([
+            (HOUSE_ACCOUNT, bet.user_id, bet.amount, "refund", f"إرجاع رهان الجولة #{room.round_id} (إيقاف الخادم)")
+            for bet in bets
+        ])
+        logger.info("↩️ أُرجع %s رهان من الجولة #%s في الغرفة %s", len(bets), room.round_id, room.room_id,
+                    extra=log_context("payout", room_id=room.room_id, round_id=room.round_id,
+                                      amount=sum(bet.amount for bet in bets)))
+
+def unsettled_bets(room: Room) -> list:
+    """رهانات الجولة الجارية التي لم تُصرف ولم تُسوَّ بعد"""
+    if room.status not in ("counting", "crashed"):
+        return []
+    return [bet for bet in room.active_bets.values() if bet.round_id == room.round_id and not bet.cashed_out]
+
+def save_unsettled(path: str = DRAIN_SNAPSHOT_FILE) -> int:
+    """الرهانات التي لم تُسوَّ خلال مهلة الإيقاف مع نتيجة جولتها (للتسوية اليدوية)"""
+    unsettled = [
+        {
+            "room_id": room.room_id,
+            "round_id": room.round_id,
+            "result": room.result,
+            "bets": [
+                {"user_id": bet.user_id, "amount": bet.amount, "auto_cashout": bet.auto_cashout}
+                for bet in unsettled_bets(room)
+            ],
+        }
+        for room in rooms.values()
+        if unsettled_bets(room)
+    ]
+    count = sum(len(entry["bets"]) for entry in unsettled)
+    if count:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"saved_at": datetime.now().isoformat(), "rounds": unsettled}, ensure_ascii=False) + "\n")
+        logger.error("❌ %s رهان لم يُسوَّ قبل الإيقاف، حُفظت في %s", count, path,
+                     extra=log_context("payout"))
+    return count
+
+async def drain(timeout: float = DRAIN_TIMEOUT):
+    """تصريف اللعبة بعد توقف الطلبات: لا جولات جديدة، إرجاع رهانات الجولات التي في
+    وقت الرهان، انتظار انفجار الجولات الجارية وتسويتها (ورسائلها)، ثم الكتابات المؤجلة"""
+    rooms_state["draining"] = True
+    started = time.monotonic()
+    deadline = started + timeout
+
+    for room in rooms.values():
+        if room.status == "betting":
+            await refund_round(room)
+
+    # الجولات الجارية تكمل حتى الانفجار؛ end_round يسوي ويرسل الرسائل ولا يبدأ جولة جديدة
+    while rooms_state["settling"] or any(
+        room.status == "counting" or unsettled_bets(room) for room in rooms.values()
+    ):
+        if time.monotonic() >= deadline:
+            break
+        await asyncio.sleep(0.1)
+    for room in rooms.values():
+        if room.timer:
+            room.timer.cancel()
+
+    unsettled = save_unsettled()
+    pending = await flush_deferred_writes(max(1.0, deadline - time.monotonic()))
+    try:
+        session = await bot.get_session()
+        await session.close()
+    except Exception as e:
+        logger.warning("⚠️ تعذر إغلاق جلسة البوت: %s", e, extra=log_context("shutdown"))
+    logger.info("🛬 انتهى التصريف في %.1f ث (رهانات غير مسواة: %s، كتابات مؤجلة متبقية: %s)",
+                time.monotonic() - started, unsettled, pending, extra=log_context("shutdown"))
 
 # ==================== FastAPI Application ====================
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """إدارة دورة حياة التطبيق"""
-    print("=" * 60)
-    print("🚀 بدء تشغيل لعبة Aviator...")
-    print("=" * 60)
+    logger.info("🚀 بدء تشغيل لعبة Aviator...", extra=log_context("startup"))
     
     try:
-        await init_db()
-        
-        # تعيين رصيد غير محدود للأدمن
-        await set_admin_unlimited_balance(ADMIN_ID)
-        
-        await setup_webhook()
-        
-        # بدء نظام الجولات
-        asyncio.create_task(process_round())
-        
-        print(f"\n📊 معلومات التشغيل:")
-        print(f"🔗 الرابط: {BASE_URL}")
-        print(f"🤖 البوت: {BOT_TOKEN[:15]}...")
-        print(f"👑 الأدمن: {ADMIN_ID} (رصيد غير محدود)")
-        print(f"⏳ مدة الجولة: {ROUND_DURATION} ثانية")
-        print(f"⏰ وقت الرهان: {BETTING_DURATION} ثانية")
-        print(f"💰 خيارات الرهان: {BET_OPTIONS}")
-        print("=" * 60)
-        print("✅ التطبيق يعمل بنجاح وجاهز للاستخدام!")
-        print("=" * 60)
+        timings = {}
+        started = time.perf_counter()
+        
+        # يتخطى DDL إذا كان إصدار المخطط محدثاً
+        migrated = await init_db()
+        timings["init_db"] = time.perf_counter() - started
+        
+        # تحميل الغرف ولوحات المتصدرين وسجل آخر الجولات لكل غرفة
+        step = time.perf_counter()
+        load_rooms()
+        await asyncio.gather(load_leaderboards(), load_round_history(list(rooms)), result_engine.load())
+        timings["warmup"] = time.perf_counter() - step
+        
+        # Webhook ورسالة الأدمن ورصيد الأدمن في الخلفية مع إعادة المحاولة
+        asyncio.create_task(background_startup())
+        
+        # بدء جولات جميع الغرف على مجدول واحد
+        start_rooms()
+        
+        # صيانة قاعدة البيانات في الخلفية (متوقفة أثناء العد أو التسوية في أي غرفة)
+        asyncio.create_task(maintenance_loop(rounds_busy))
+        
+        # تثبيت أرصدة الدفتر دورياً حتى يبقى حساب الرصيد محدوداً
+        asyncio.create_task(ledger_checkpoint_loop(lambda: rooms_state["settling"] > 0))
+        
+        # عينات RSS/GC الدورية وعدادات الكائنات الحية
+        register_memory_counters()
+        asyncio.create_task(memory_loop())
+        
+        logger.info("📊 الرابط: %s | البوت: %s... | الأدمن: %s (رصيد غير محدود)",
+                    BASE_URL, BOT_TOKEN[:15], ADMIN_ID, extra=log_context("startup"))
+        for room in rooms.values():
+            logger.info("🏠 %s: جولة %s ث | رهان %s ث | %s", room.room_id, room.round_duration,
+                        room.betting_duration, room.bet_options, extra=log_context("startup", room_id=room.room_id))
+        logger.info("✅ التطبيق يعمل بنجاح وجاهز للاستخدام!", extra=log_context("startup"))
+        
+        timings["total"] = time.perf_counter() - started
+        logger.info(
+            "⏱️ زمن التشغيل: %s %s",
+            " | ".join(f"{name}={value * 1000:.0f}ms" for name, value in timings.items()),
+            "(تم تطبيق المخطط)" if migrated else "(المخطط محدث)",
+            extra=log_context("startup")
+        )
         
         yield
         
     except Exception as e:
-        logger.error(f"❌ خطأ فادح في التشغيل: {e}")
+        logger.error("❌ خطأ فادح في التشغيل: %s", e, extra=log_context("startup"))
         raise
     
     finally:
-        print("\n🛑 إيقاف التطبيق...")
+        logger.info("🛑 إيقاف التطبيق...", extra=log_context("shutdown"))
+        try:
+            await drain()
+        except Exception as e:
+            logger.error("❌ خطأ في تصريف الجولات عند الإيقاف: %s", e, extra=log_context("payout"))
+        if traffic_log:
+            await traffic_log.close()
+        stop_logging()
 
 app = FastAPI(
     title="Aviator Game",
@@ -639,6 +1256,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# تسجيل الحركة لإعادة تشغيلها في اختبارات الأداء (TRAFFIC_RECORD_FILE)
+if traffic_log:
+    app.add_middleware(TrafficRecorder)
+
 # ==================== Webhook Endpoint ====================
 @app.post("/webhook")
 async def telegram_webhook(request: Request):
@@ -646,10 +1267,21 @@ async def telegram_webhook(request: Request):
     try:
         Bot.set_current(bot)
         update_data = await request.json()
-        await dp.process_update(types.Update(**update_data))
+        # إعادة تسليم تحديث عولج للتو: لا يُعالج مرة ثانية (الأوامر المالية محمية أيضاً في القاعدة)
+        update_id = update_data.get("update_id")
+        cache_key = ("update", 0, update_id)
+        if update_id is not None:
+            if idempotency_cache.get(cache_key):
+                return {"ok": True}
+            idempotency_cache.put(cache_key, True)
+        try:
+            await dp.process_update(types.Update(**update_data))
+        except Exception:
+            idempotency_cache.discard(cache_key)
+            raise
         return {"ok": True}
     except Exception as e:
-        logger.error(f"❌ خطأ في Webhook: {e}")
+        logger.error("❌ خطأ في Webhook: %s", e, extra=log_context("webhook"))
         return {"ok": False, "error": str(e)}, 500
 
 # ==================== API Endpoints ====================
@@ -659,9 +1291,10 @@ async def home():
     return {
         "app": "Aviator Game v3.0",
         "status": "running",
-        "round": game_round.round_id,
-        "round_status": game_round.status,
-        "result": game_round.result,
+        "rooms": {
+            room.room_id: {"round": room.round_id, "round_status": room.status}
+            for room in public_rooms()
+        },
         "admin_id": ADMIN_ID
     }
 
@@ -669,6 +1302,9 @@ async def home():
 async def game_page(request: Request):
     """صفحة اللعبة"""
     user_id = request.query_params.get("user_id", "0")
+    room = get_room(request.query_params.get("room"))
+    if not room:
+        return HTMLResponse("<h1>🎮 Aviator Game</h1><p>الغرفة غير موجودة</p>", status_code=404)
     
     try:
         with open("index.html", "r", encoding="utf-8") as f:
@@ -678,28 +1314,247 @@ async def game_page(request: Request):
     
     html_content = html_content.replace("{BASE_URL}", BASE_URL)
     html_content = html_content.replace("{USER_ID}", str(user_id))
-    html_content = html_content.replace("{BET_OPTIONS}", str(BET_OPTIONS))
-    html_content = html_content.replace("{ROUND_DURATION}", str(ROUND_DURATION))
-    html_content = html_content.replace("{BETTING_DURATION}", str(BETTING_DURATION))
+    html_content = html_content.replace("{ROOM_ID}", room.room_id)
+    html_content = html_content.replace("{ROOM_TITLE}", room.title)
+    html_content = html_content.replace("{BET_OPTIONS}", str(room.bet_options))
+    html_content = html_content.replace("{ROUND_DURATION}", str(room.round_duration))
+    html_content = html_content.replace("{BETTING_DURATION}", str(room.betting_duration))
     
     return HTMLResponse(content=html_content)
 
+@app.get("/api/rooms")
+async def api_rooms():
+    """قائمة الغرف العامة وحالتها"""
+    return {"rooms": [room.info() for room in public_rooms()]}
+
 @app.get("/api/round")
-async def api_round():
-    """معلومات الجولة الحالية"""
-    now = datetime.now()
+async def api_round(room: str = DEFAULT_ROOM):
+    """معلومات الجولة الحالية في الغرفة"""
+    game_room = get_room(room)
+    if not game_room:
+        return {"error": "الغرفة غير موجودة"}, 404
+    now = clock.now()
     
+    # النتيجة لا تظهر قبل الانفجار؛ أثناء العد تُرسل معاملات المنحنى فقط
     response = {
-        "round_id": game_round.round_id,
-        "status": game_round.status,
-        "result": game_round.result,
-        "remaining_time": game_round.remaining_time,
-        "betting_time_left": max(0, int((game_round.betting_end - now).total_seconds())) if game_round.betting_end else 0,
-        "can_bet": game_round.status == "betting" and game_round.betting_end and now < game_round.betting_end
+        **game_room.state(),
+        "server_time": clock.time_ms(),
+        "remaining_time": game_room.remaining_time,
+        "betting_time_left": game_room.betting_time_left(now),
+        "can_bet": game_room.can_bet(now)
     }
     
     return response
 
+SSE_KEEPALIVE = 15   # ثواني بين رسائل إبقاء الاتصال
+
+def sse_message(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.get("/api/events")
+async def api_events(room: str = DEFAULT_ROOM, user_id: int = 0):
+    """بث أحداث الغرفة (Server-Sent Events): state عند الاتصال ثم round / counting /
+    crash، وتأكيدات cashout الخاصة بالمستخدم فقط"""
+    game_room = get_room(room)
+    if not game_room:
+        return JSONResponse({"error": "الغرفة غير موجودة"}, status_code=404)
+    
+    async def stream():
+        queue = game_room.subscribe()
+        try:
+            yield sse_message("state", {**game_room.state(), "server_time": clock.time_ms()})
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    return   # فُصل العميل لبطئه؛ EventSource يعيد الاتصال
+                event, data = message
+                if data.get("user_id", user_id) != user_id:
+                    continue
+                yield sse_message(event, data)
+        finally:
+            game_room.unsubscribe(queue)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/db/stats")
+async def api_db_stats():
+    """إحصائيات دمج استعلامات القراءة وتوجيهها والصيانة"""
+    return {
+        "single_flight": get_single_flight_stats(),
+        "replica": get_replica_stats(),
+        "breaker": get_breaker_stats(),
+        "maintenance": maintenance_stats,
+        "ledger": ledger_stats,
+        "export": export_stats,
+        "traffic_recorder": recorder_stats,
+        "memory": memory_stats(),
+        "logging": logging_stats(),
+        "results": result_engine.stats(),
+        "inline": inline_stats,
+        "shards": get_shard_stats(),
+        "idempotency": get_idempotency_stats(),
+        "activity": get_activity_stats(),
+        "scheduler": {**scheduler.snapshot(), "rooms": len(rooms), **rooms_state},
+        "round_phases": round_phase_stats
+    }
+
+def is_admin_request(request: Request) -> bool:
+    """واجهات الأدمن تتطلب ترويسة X-Admin-Key مطابقة لـ ADMIN_API_KEY"""
+    return bool(ADMIN_API_KEY) and hmac.compare_digest(request.headers.get("X-Admin-Key", ""), ADMIN_API_KEY)
+
+@app.get("/api/admin/exposure")
+async def api_admin_exposure(request: Request, multiplier: float = None):
+    """تعرض البيت لكل غرفة (ترويسة X-Admin-Key). multiplier لحساب الالتزام عند مضاعف معين"""
+    if not is_admin_request(request):
+        return JSONResponse({"error": "غير مصرح"}, status_code=403)
+    return {
+        "rooms": {
+            room.room_id: {
+                "status": room.status,
+                **room.exposure.snapshot(multiplier if multiplier is not None else current_multiplier(room))
+            }
+            for room in rooms.values()
+        }
+    }
+
+@app.get("/api/admin/memory")
+async def api_admin_memory(request: Request):
+    """RSS وGC وعدادات الكائنات الحية وحالة tracemalloc (ترويسة X-Admin-Key)"""
+    if not is_admin_request(request):
+        return JSONResponse({"error": "غير مصرح"}, status_code=403)
+    return memory_report()
+
+@app.post("/api/admin/memory/tracemalloc/{action}")
+async def api_admin_tracemalloc(request: Request, action: str, frames: int = 1,
+                                group_by: str = "lineno", limit: int = 25):
+    """start [frames] | snapshot [group_by, limit] (مع الفرق عن السابقة) | stop"""
+    if not is_admin_request(request):
+        return JSONResponse({"error": "غير مصرح"}, status_code=403)
+    try:
+        if action == "start":
+            return start_tracemalloc(frames)
+        if action == "stop":
+            return stop_tracemalloc()
+        if action == "snapshot":
+            # أخذ اللقطة ومقارنتها قد يستغرق ثوانٍ: خارج حلقة الأحداث
+            return await asyncio.to_thread(take_snapshot, group_by, max(1, min(limit, 200)))
+    except (RuntimeError, ValueError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return JSONResponse({"error": "إجراء غير معروف"}, status_code=404)
+
+@app.get("/api/admin/export/{table}")
+async def api_admin_export(request: Request, table: str, after_id: int = 0, shard: int = None):
+    """بث الجدول CSV مضغوطاً على دفعات بعد after_id (ترويسة X-Admin-Key)، من قاعدة shard إذا كان مقسماً"""
+    if not is_admin_request(request):
+        return JSONResponse({"error": "غير مصرح"}, status_code=403)
+    if table not in EXPORT_TABLES:
+        return JSONResponse({"error": "جدول غير معروف", "tables": list(EXPORT_TABLES)}, status_code=404)
+    shards = table_shards(table)
+    if shard is None and len(shards) == 1:
+        shard = shards[0]
+    if shard not in shards:
+        return JSONResponse({"error": "حدد القاعدة", "shards": shards}, status_code=400)
+    suffix = f"-s{shard}" if shard is not None else ""
+    return StreamingResponse(
+        stream_csv(table, after_id, shard),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{table}{suffix}-after-{after_id}.csv.gz"'}
+    )
+
+@app.post("/api/admin/export")
+async def api_admin_export_run(request: Request, full: bool = False):
+    """تصدير تدريجي لكل الجداول إلى ملفات EXPORT_DIR (ترويسة X-Admin-Key)"""
+    if not is_admin_request(request):
+        return JSONResponse({"error": "غير مصرح"}, status_code=403)
+    try:
+        return {"exported": await run_export(full=full), "stats": export_stats}
+    except Exception as e:
+        logger.error("❌ خطأ في التصدير: %s", e, extra=log_context("admin"))
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@app.get("/api/admin/shards")
+async def api_admin_shards(request: Request):
+    """توزيع المستخدمين على القواعد وإحصائيات النقل (ترويسة X-Admin-Key)"""
+    if not is_admin_request(request):
+        return JSONResponse({"error": "غير مصرح"}, status_code=403)
+    return await shard_status()
+
+@app.post("/api/admin/shards/rebalance")
+async def api_admin_shards_rebalance(request: Request, limit: int = 100):
+    """نقل حتى limit مستخدم إلى قاعدة hash الخاصة بهم، متخطياً من لديه رهان في الجولة الحالية"""
+    if not is_admin_request(request):
+        return JSONResponse({"error": "غير مصرح"}, status_code=403)
+
+    def is_active(user_id):
+        return any(user_id in room.bets or user_id in room.active_bets for room in rooms.values())
+
+    try:
+        return await rebalance(max(1, min(limit, 10000)), is_active=is_active)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+@app.post("/api/admin/results/chain")
+async def api_admin_results_chain(request: Request, room: str = DEFAULT_ROOM):
+    """توليد سلسلة نتائج جديدة للغرفة والانتقال إليها من الجولة التالية (ترويسة X-Admin-Key)"""
+    if not is_admin_request(request):
+        return JSONResponse({"error": "غير مصرح"}, status_code=403)
+    if not get_room(room):
+        return JSONResponse({"error": "الغرفة غير موجودة"}, status_code=404)
+    chain = await result_engine.rotate(room)
+    return {"chain_id": chain.chain_id, "room_id": room, "commitment": chain.commitment, "length": chain.length}
+
+@app.get("/api/fairness")
+async def api_fairness():
+    """التزامات سلاسل النتائج وطريقة التحقق من أي جولة ببذرتها"""
+    return await fairness_info()
+
+@app.get("/api/history")
+async def api_history(limit: int = 20, before: int = None, room: str = DEFAULT_ROOM):
+    """آخر الجولات المنتهية في الغرفة (before للصفحات الأقدم)"""
+    limit = max(1, min(limit, 100))
+    if not get_room(room):
+        return {"rounds": [], "error": "الغرفة غير موجودة"}
+    try:
+        content = await get_history_json(limit, before, room)
+        return Response(content=content, media_type="application/json")
+    except Exception as e:
+        return {"rounds": [], "error": str(e)}
+
+@app.get("/api/leaderboard/{period}")
+async def api_leaderboard(period: str, metric: str = "biggest_win"):
+    """قائمة المتصدرين من الذاكرة"""
+    if period not in PERIODS or metric not in METRICS:
+        return {"error": "فترة أو مقياس غير صالح", "periods": PERIODS, "metrics": METRICS}
+    return {"period": period, "metric": metric, "entries": leaderboards.top(period, metric)}
+
+@app.get("/api/stats/{user_id}")
+async def api_user_stats(user_id: int):
+    """إحصائيات اللاعب"""
+    try:
+        stats = await get_user_stats(user_id)
+        return stats or {"user_id": user_id, "rounds_played": 0, "total_wagered": 0,
+                         "total_won": 0, "best_cashout": 0, "biggest_win": 0}
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.get("/api/history/{user_id}")
+async def api_user_history(user_id: int, limit: int = ACTIVITY_SIZE):
+    """آخر حركات اللاعب، الأحدث أولاً"""
+    try:
+        return {"user_id": user_id, "activity": await get_activity(user_id, min(limit, ACTIVITY_SIZE))}
+    except DatabaseUnavailable:
+        return {"error": DB_UNAVAILABLE_MESSAGE}, 503
+    except Exception as e:
+        return {"error": str(e)}
+
 @app.get("/api/balance/{user_id}")
 async def api_balance(user_id: int):
     """جلب الرصيد"""
@@ -709,76 +1564,126 @@ async def api_balance(user_id: int):
     except Exception as e:
         return {"balance": 0, "error": str(e)}
 
+def request_idempotency_key(request: Request, data: dict):
+    """مفتاح العميل من ترويسة Idempotency-Key أو الحقل idempotency_key (None بلا مفتاح، False إن كان غير صالح)"""
+    key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+    if key is None:
+        return None
+    return key if valid_key(key) else False
+
 @app.post("/api/bet")
 async def api_bet(request: Request):
-    """وضع رهان"""
+    """وضع رهان (مع Idempotency-Key تعيد الإعادة نتيجة الرهان الأصلي)"""
     try:
         data = await request.json()
+        key = request_idempotency_key(request, data)
+        if key is False:
+            return {"error": "مفتاح Idempotency-Key غير صالح"}, 400
+        return await run_once("bet", int(data.get("user_id", 0)), key, lambda: place_bet(data))
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+async def place_bet(data: dict):
+    """تنفيذ الرهان"""
+    try:
         user_id = int(data.get("user_id", 0))
         amount = int(data.get("amount", 0))
+        auto_cashout = data.get("auto_cashout")
+        room = get_room(data.get("room_id"))
         
         if not user_id or not amount:
             return {"error": "بيانات ناقصة"}, 400
         
-        if amount not in BET_OPTIONS:
+        if not room:
+            return {"error": "الغرفة غير موجودة"}, 404
+        
+        if amount not in room.bet_options:
             return {"error": "مبلغ رهان غير صالح"}, 400
         
+        if auto_cashout is not None:
+            auto_cashout = round(float(auto_cashout), 2)
+            if auto_cashout < MIN_AUTO_CASHOUT:
+                return {"error": f"الصرف التلقائي يجب أن يكون {MIN_AUTO_CASHOUT}x أو أكثر"}, 400
+        
         # التحقق من وقت الرهان
-        now = datetime.now()
-        if game_round.status != "betting" or not game_round.betting_end or now >= game_round.betting_end:
+        if not room.can_bet():
+            logger.info("⏳ رهان خارج وقته من المستخدم %s", user_id,
+                        extra=log_context("bet", room_id=room.room_id, round_id=room.round_id, user_id=user_id))
             return {"error": "ليس وقت الرهان الآن"}, 400
         
+        # رفض سريع بينما قاعدة البيانات متعطلة (قاطع الدائرة مفتوح)
+        if db_breaker.state != "closed":
+            return {"error": DB_UNAVAILABLE_MESSAGE}, 503
+        
         # الأدمن يمكنه الرهان دائماً
         if user_id != ADMIN_ID:
             balance = await get_balance(user_id)
             if balance < amount:
+                logger.info("💸 رصيد غير كافٍ للمستخدم %s لرهان %s", user_id, amount,
+                            extra=log_context("bet", room_id=room.room_id, user_id=user_id, amount=amount))
                 return {"error": "رصيد غير كافي", "balance": balance}, 400
         
-        # خصم المبلغ (الأدمن لا يخصم منه)
-        if user_id != ADMIN_ID:
-            await update_balance(user_id, -amount)
-        
-        # إضافة الرهان
-        await add_bet(user_id, game_round.round_id, amount)
+        # قيد الرهان من المستخدم إلى البيت (مع سجل المعاملات)
+        round_id = room.round_id
+        try:
+            await post_ledger_activity([(user_id, HOUSE_ACCOUNT, amount, "bet", f"رهان على الجولة #{round_id} ({room.room_id})")])
+        except InsufficientFunds as e:
+            # رهان متزامن سبقه إلى الرصيد نفسه: لم يُكتب شيء
+            return {"error": "رصيد غير كافي", "balance": e.balance}, 400
+        mark_committed()
         
-        # تخزين الرهان كرهان نشط
-        active_bets[user_id] = ActiveBet(user_id, amount, game_round.round_id)
+        # إضافة الرهان (فشلها بعد الخصم يعيد المبلغ، ومفتاح التكرار يبقى محجوزاً)
+        try:
+            await add_bet(user_id, round_id, amount)
+        except Exception as e:
+            logger.error("❌ فشل تسجيل رهان %s للمستخدم %s بعد خصمه، يُعاد المبلغ: %s", amount, user_id, e,
+                         extra=log_context("stake", room_id=room.room_id, round_id=round_id,
+                                           user_id=user_id, amount=amount))
+            await post_payouts_activity([(HOUSE_ACCOUNT, user_id, amount, "refund", f"استرداد رهان لم يُسجل على الجولة #{round_id}")])
+            raise
+        
+        # تخزين الرهان كرهان نشط في الغرفة
+        room.active_bets[user_id] = ActiveBet(user_id, amount, round_id, auto_cashout)
+        if auto_cashout is not None:
+            room.auto_cashouts.add(user_id, auto_cashout)
+        else:
+            room.auto_cashouts.cancel(user_id)
+        room.bets[user_id] = amount
+        room.exposure.add_bet(amount)
+        logger.info("🎲 رهان %s من المستخدم %s على الجولة #%s", amount, user_id, round_id,
+                    extra=log_context("stake", room_id=room.room_id, round_id=round_id,
+                                      user_id=user_id, amount=amount, multiplier=auto_cashout))
         
-        # إضافة معاملة
-        await add_transaction(user_id, -amount, "bet", f"رهان على الجولة #{game_round.round_id}")
+        # تحديث الإحصائيات ولوحات المتصدرين
+        await record_bet(user_id, amount)
         
         return {
             "success": True,
             "message": f"تم وضع رهان {amount}",
-            "round_id": game_round.round_id,
-            "remaining_time": game_round.remaining_time
+            "room_id": room.room_id,
+            "round_id": round_id,
+            "remaining_time": room.remaining_time,
+            "auto_cashout": auto_cashout
         }
         
+    except DatabaseUnavailable:
+        return {"error": DB_UNAVAILABLE_MESSAGE}, 503
     except Exception as e:
         return {"error": str(e)}, 500
 
 
 @app.get("/api/multiplier")
-async def api_multiplier():
-    """جلب المضاعف الحالي للجولة"""
+async def api_multiplier(room: str = DEFAULT_ROOM):
+    """جلب المضاعف الحالي لجولة الغرفة"""
     try:
-        now = datetime.now()
-        current_multiplier = 1.0
-        
-        if game_round.status == "counting" and game_round.result and game_round.betting_end:
-            elapsed = (now - game_round.betting_end).total_seconds()
-            total_counting = ROUND_DURATION - BETTING_DURATION
-            
-            if elapsed <= total_counting:
-                progress = min(1.0, elapsed / total_counting)
-                current_multiplier = 1.0 + (game_round.result - 1.0) * progress
-                current_multiplier = round(current_multiplier, 2)
-        
+        game_room = get_room(room)
+        if not game_room:
+            return {"multiplier": 1.0, "error": "الغرفة غير موجودة"}
         return {
-            "multiplier": current_multiplier,
-            "status": game_round.status,
-            "result": game_round.result,
-            "round_id": game_round.round_id
+            "multiplier": current_multiplier(game_room),
+            "status": game_room.status,
+            "result": game_room.result if game_room.status == "crashed" else None,
+            "round_id": game_room.round_id
         }
         
     except Exception as e:
@@ -787,34 +1692,56 @@ async def api_multiplier():
 
 @app.post("/api/cashout")
 async def api_cashout(request: Request):
-    """صرف الرهان"""
+    """صرف الرهان (مع Idempotency-Key تعيد الإعادة نتيجة الصرف الأصلي)"""
     try:
         data = await request.json()
+        key = request_idempotency_key(request, data)
+        if key is False:
+            return {"error": "مفتاح Idempotency-Key غير صالح"}, 400
+        return await run_once("cashout", int(data.get("user_id", 0)), key, lambda: cash_out(data))
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+async def cash_out(data: dict):
+    """تنفيذ الصرف"""
+    try:
         user_id = int(data.get("user_id", 0))
+        room = get_room(data.get("room_id"))
         
         if not user_id:
             return {"error": "بيانات ناقصة"}, 400
         
+        if not room:
+            return {"error": "الغرفة غير موجودة"}, 404
+        
         # التحقق من وجود رهان نشط
-        if user_id not in active_bets:
+        if user_id not in room.active_bets:
             return {"error": "ليس لديك رهان نشط"}, 400
         
-        bet = active_bets[user_id]
+        bet = room.active_bets[user_id]
         
         # إذا تم الصرف مسبقاً
         if bet.cashed_out:
             return {"error": "تم صرف هذا الرهان مسبقاً"}, 400
         
+        if room.status != "counting":
+            return {"error": "الجولة ليست جارية"}, 400
+        
         # صرف الرهان
-        win_amount = await process_bet_cashout(user_id)
+        win_amount = await process_bet_cashout(room, user_id)
         
         if win_amount:
+            logger.info("💰 صرف %s للمستخدم %s عند %sx", win_amount, user_id, bet.cashout_multiplier,
+                        extra=log_context("cashout", room_id=room.room_id, round_id=bet.round_id,
+                                          user_id=user_id, amount=win_amount,
+                                          multiplier=bet.cashout_multiplier))
             # إزالة من الرهانات النشطة
-            if user_id in active_bets:
-                del active_bets[user_id]
+            if user_id in room.active_bets:
+                del room.active_bets[user_id]
             
             return {
                 "success": True,
+                "round_id": bet.round_id,
                 "win_amount": win_amount,
                 "multiplier": bet.cashout_multiplier,
                 "message": f"تم الصرف بمضاعف {bet.cashout_multiplier}x"
@@ -832,4 +1759,6 @@ async def api_cashout(request: Request):
 
 # ==================== نقطة الدخول ====================
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=PORT)
\ No newline at end of file
+    # uvloop/httptools وتصريف الجولات عند SIGTERM (SERVER_MODE=dev لإعدادات uvicorn الافتراضية)
+    from server import run_server
+    run_server(app)
\ No newline at end of file
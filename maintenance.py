@@ -0,0 +1,185 @@
+"""
+صيانة قاعدة البيانات في الخلفية
+
+- أرشفة صفوف transactions/bets/rounds الأقدم من الأفق إلى ملفات JSONL مضغوطة
+  (archive/<table>/<day>/<first_id>-<last_id>.jsonl.gz) مع ملخصات يومية في daily_rollups
+- ANALYZE / VACUUM / نقاط WAL بشكل دوري
+- حذف مفاتيح منع التكرار الأقدم من IDEMPOTENCY_KEEP_HOURS (idempotency.py)
+- مع التقسيم (DATABASE_SHARDS) تُؤرشف transactions/bets في كل قاعدة على حدة
+  (ملفات s<shard>-...) وتقدمها وملخصاتها في القاعدة نفسها
+
+العمل يتم على دفعات صغيرة مع توقف بينها، ولا يعمل أثناء مرحلة العد في الجولة.
+التقدم محفوظ في maintenance_state فيستأنف بعد إعادة التشغيل، وكتابة الملف
+بنفس الاسم تجعل إعادة الدفعة بعد الانقطاع آمنة.
+"""
+
+import os
+import json
+import gzip
+import asyncio
+import logging
+import clock
+from log_pipeline import log_context
+from collections import defaultdict
+from datetime import datetime, timedelta
+from database import (
+    ARCHIVE_TABLES, get_maintenance_state, get_archive_batch,
+    commit_archive_batch, run_db_maintenance, table_shards, SHARD_IDS, prune_idempotency_keys
+)
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '30'))
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+MAINTENANCE_BATCH_SIZE = int(os.getenv('MAINTENANCE_BATCH_SIZE', '500'))
+MAINTENANCE_PAUSE = float(os.getenv('MAINTENANCE_PAUSE', '0.5'))
+MAINTENANCE_INTERVAL_HOURS = float(os.getenv('MAINTENANCE_INTERVAL_HOURS', '6'))
+VACUUM_INTERVAL_HOURS = float(os.getenv('VACUUM_INTERVAL_HOURS', '24'))
+# إعادة الطلب بعد هذه المدة تُنفذ كطلب جديد
+IDEMPOTENCY_KEEP_HOURS = float(os.getenv('IDEMPOTENCY_KEEP_HOURS', '24'))
+
+maintenance_stats = {
+    "runs": 0,
+    "archived": defaultdict(int),
+    "idempotency_pruned": 0,
+    "last_run": None,
+    "last_vacuum": None,
+    "last_error": None,
+}
+
+
+def _row_day(row: dict, time_column: str) -> str:
+    value = row[time_column]
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+    return str(value)[:10]
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def build_rollups(table: str, rows: list) -> list:
+    """ملخصات يومية لدفعة: [(day, type, row_count, total_amount, total_extra)]"""
+    _, time_column = ARCHIVE_TABLES[table]
+    totals = defaultdict(lambda: [0, 0, 0])
+    for row in rows:
+        if table == 'transactions':
+            kind, amount, extra = row.get('type') or 'unknown', row.get('amount') or 0, 0
+        elif table == 'bets':
+            kind, amount, extra = row.get('status') or 'unknown', row.get('amount') or 0, row.get('win_amount') or 0
+        else:
+            kind, amount, extra = row.get('status') or 'unknown', row.get('total_wagered') or 0, row.get('total_paid') or 0
+        entry = totals[(_row_day(row, time_column), kind)]
+        entry[0] += 1
+        entry[1] += amount
+        entry[2] += extra
+    return [(day, kind, *values) for (day, kind), values in totals.items()]
+
+def write_archive_files(table: str, rows: list, shard: int = None) -> list:
+    """كتابة الدفعة في ملفات مضغوطة حسب اليوم (بنفس الاسم عند الإعادة)"""
+    id_column, time_column = ARCHIVE_TABLES[table]
+    first_id, last_id = rows[0][id_column], rows[-1][id_column]
+    by_day = defaultdict(list)
+    for row in rows:
+        by_day[_row_day(row, time_column)].append(row)
+
+    paths = []
+    for day, day_rows in by_day.items():
+        directory = os.path.join(ARCHIVE_DIR, table, day)
+        os.makedirs(directory, exist_ok=True)
+        # المعرفات محلية لكل قاعدة عند التقسيم
+        prefix = f"s{shard}-" if shard is not None else ""
+        path = os.path.join(directory, f"{prefix}{first_id:010d}-{last_id:010d}.jsonl.gz")
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            for row in day_rows:
+                f.write(json.dumps(row, ensure_ascii=False, default=_json_default) + "\n")
+        os.replace(tmp_path, path)
+        paths.append(path)
+    return paths
+
+
+async def archive_table(table: str, is_busy=None, now: datetime = None, shard: int = None) -> int:
+    """أرشفة صفوف جدول أقدم من الأفق على دفعات (في قاعدة واحدة). يعيد عدد الصفوف المؤرشفة
+
+    now بتوقيت UTC مثل أعمدة CURRENT_TIMESTAMP التي يُقارن بها الأفق
+    """
+    id_column, _ = ARCHIVE_TABLES[table]
+    cutoff = (now or clock.utcnow()) - timedelta(days=ARCHIVE_AFTER_DAYS)
+    last_id = await get_maintenance_state(f'archive_{table}', shard)
+    archived = 0
+
+    while True:
+        # لا نزاحم حلقة الجولات أثناء العد والتسوية
+        while is_busy and is_busy():
+            await asyncio.sleep(1)
+
+        rows = await get_archive_batch(table, last_id, cutoff, MAINTENANCE_BATCH_SIZE, shard)
+        if not rows:
+            break
+
+        # الكتابة على القرص خارج حلقة الأحداث
+        await asyncio.to_thread(write_archive_files, table, rows, shard)
+
+        last_id = rows[-1][id_column]
+        await commit_archive_batch(
+            table,
+            [row[id_column] for row in rows],
+            build_rollups(table, rows),
+            last_id,
+            shard
+        )
+        archived += len(rows)
+        maintenance_stats["archived"][table] += len(rows)
+
+        if len(rows) < MAINTENANCE_BATCH_SIZE:
+            break
+        await asyncio.sleep(MAINTENANCE_PAUSE)
+
+    if archived:
+        where = f" في القاعدة {shard}" if shard is not None else ""
+        logger.info("🗄️ تمت أرشفة %s صف من %s%s", archived, table, where, extra=log_context("maintenance"))
+    return archived
+
+async def run_maintenance(is_busy=None, vacuum: bool = False):
+    """دورة صيانة كاملة: أرشفة ثم ANALYZE/VACUUM"""
+    for table in ARCHIVE_TABLES:
+        for shard in table_shards(table):
+            await archive_table(table, is_busy, shard=shard)
+
+    maintenance_stats["idempotency_pruned"] += await prune_idempotency_keys(
+        clock.utcnow() - timedelta(hours=IDEMPOTENCY_KEEP_HOURS)
+    )
+
+    for shard in [None, *SHARD_IDS]:
+        while is_busy and is_busy():
+            await asyncio.sleep(1)
+        await run_db_maintenance(vacuum=vacuum, shard=shard)
+
+    maintenance_stats["runs"] += 1
+    maintenance_stats["last_run"] = datetime.now().isoformat()
+    if vacuum:
+        maintenance_stats["last_vacuum"] = maintenance_stats["last_run"]
+
+async def maintenance_loop(is_busy=None):
+    """تشغيل الصيانة دورياً في الخلفية"""
+    last_vacuum = None
+    while True:
+        await asyncio.sleep(MAINTENANCE_INTERVAL_HOURS * 3600)
+        try:
+            now = datetime.now()
+            vacuum = last_vacuum is None or now - last_vacuum >= timedelta(hours=VACUUM_INTERVAL_HOURS)
+            await run_maintenance(is_busy, vacuum=vacuum)
+            if vacuum:
+                last_vacuum = now
+        except Exception as e:
+            maintenance_stats["last_error"] = str(e)
+            logger.error("❌ خطأ في صيانة قاعدة البيانات: %s", e, extra=log_context("maintenance"))
+
+
+if __name__ == "__main__":
+    # تشغيل دورة صيانة يدوياً: python maintenance.py [--vacuum]
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_maintenance(vacuum="--vacuum" in sys.argv))
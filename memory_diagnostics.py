@@ -0,0 +1,196 @@
+"""
+تشخيص الذاكرة في العملية طويلة التشغيل
+
+- عينات دورية لـ RSS وعدادات GC (memory_loop) مع معدل النمو في الساعة؛ العينة
+  رخيصة (gc.get_count / gc.get_stats)، وعدّ كل الكائنات (gc.get_objects) يمر عليها
+  جميعاً ممسكاً بـ GIL فلا يُحسب إلا في تقرير الأدمن
+- عدّادات الكائنات الحية: كل وحدة تسجل دالة تعيد حجم بنيتها (register_counter)
+- tracemalloc عند الطلب فقط (له كلفة): start ثم snapshot يعيد أكبر المواقع
+  والفرق عن اللقطة السابقة مجمعاً حسب الملف أو السطر، ثم stop
+
+كل ذلك متاح دون إعادة تشغيل عبر /api/admin/memory (ترويسة X-Admin-Key).
+"""
+
+import os
+import gc
+import sys
+import time
+import asyncio
+import logging
+import resource
+import tracemalloc
+from collections import deque
+from log_pipeline import log_context
+
+logger = logging.getLogger(__name__)
+
+MEMORY_SAMPLE_INTERVAL = float(os.getenv('MEMORY_SAMPLE_INTERVAL', '60'))
+MEMORY_SAMPLES = int(os.getenv('MEMORY_SAMPLES', '1440'))   # يوم كامل بعينة كل دقيقة
+MEMORY_TOP_LIMIT = int(os.getenv('MEMORY_TOP_LIMIT', '25'))
+
+_counters = {}                              # {الاسم: دالة تعيد العدد}
+_samples = deque(maxlen=MEMORY_SAMPLES)     # [(الوقت, RSS بالبايت, مرات جمع GC)]
+_tracemalloc_state = {"snapshot": None, "taken_at": None}
+
+# ملفات المكتبة القياسية وtracemalloc نفسه لا تفيد في تتبع التسرب
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def register_counter(name: str, count):
+    """تسجيل عداد كائنات حية: count() تعيد عدداً صحيحاً"""
+    _counters[name] = count
+
+def live_objects() -> dict:
+    result = {}
+    for name, count in _counters.items():
+        try:
+            result[name] = count()
+        except Exception as e:
+            result[name] = f"خطأ: {e}"
+    return result
+
+
+# ==================== RSS و GC ====================
+def rss_bytes() -> int:
+    """الذاكرة المقيمة الحالية (من /proc في لينكس، وإلا أعلى قيمة بلغتها العملية)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def gc_stats(count_objects: bool = False) -> dict:
+    """عدادات GC؛ count_objects يضيف عدد الكائنات المتتبعة (مرور كامل، للأدمن فقط)"""
+    generations = gc.get_stats()
+    stats = {
+        "counts": gc.get_count(),
+        "collections": [generation["collections"] for generation in generations],
+        "uncollectable": sum(generation["uncollectable"] for generation in generations),
+        "garbage": len(gc.garbage),
+    }
+    if count_objects:
+        stats["tracked_objects"] = len(gc.get_objects())
+    return stats
+
+def sample() -> dict:
+    rss = rss_bytes()
+    gc_info = gc_stats()
+    _samples.append((time.time(), rss, sum(gc_info["collections"])))
+    return {"rss_mb": round(rss / 2 ** 20, 1), "gc": gc_info}
+
+def growth_per_hour() -> dict:
+    """معدل نمو RSS ومرات جمع GC بين أقدم وأحدث عينة"""
+    if len(_samples) < 2:
+        return {"rss_mb": 0.0, "gc_collections": 0}
+    (t0, rss0, collections0), (t1, rss1, collections1) = _samples[0], _samples[-1]
+    hours = (t1 - t0) / 3600 or 1
+    return {
+        "rss_mb": round((rss1 - rss0) / 2 ** 20 / hours, 2),
+        "gc_collections": int((collections1 - collections0) / hours),
+    }
+
+def memory_stats() -> dict:
+    """ملخص للمقاييس: آخر عينة ومعدل النمو"""
+    if not _samples:
+        return {"samples": 0}
+    taken_at, rss, collections = _samples[-1]
+    return {
+        "samples": len(_samples),
+        "rss_mb": round(rss / 2 ** 20, 1),
+        "gc_collections": collections,
+        "growth_per_hour": growth_per_hour(),
+        "tracemalloc": tracemalloc.is_tracing(),
+    }
+
+def memory_report() -> dict:
+    """التقرير الكامل لواجهة الأدمن (يشمل عدّ الكائنات المتتبعة)"""
+    report = sample()
+    report["gc"] = gc_stats(count_objects=True)
+    return {
+        **report,
+        "growth_per_hour": growth_per_hour(),
+        "history": [
+            {"at": round(at), "rss_mb": round(rss / 2 ** 20, 1), "gc_collections": collections}
+            for at, rss, collections in list(_samples)[-60:]
+        ],
+        "live_objects": live_objects(),
+        "tracemalloc": tracemalloc_status(),
+    }
+
+async def memory_loop():
+    """أخذ عينة كل MEMORY_SAMPLE_INTERVAL ثانية"""
+    while True:
+        try:
+            # عدادات فقط (بلا gc.get_objects) فتكفي على حلقة الأحداث مباشرة
+            sample()
+        except Exception as e:
+            logger.error("❌ خطأ في عينة الذاكرة: %s", e, extra=log_context("memory"))
+        await asyncio.sleep(MEMORY_SAMPLE_INTERVAL)
+
+
+# ==================== tracemalloc ====================
+def tracemalloc_status() -> dict:
+    if not tracemalloc.is_tracing():
+        return {"tracing": False}
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "tracing": True,
+        "frames": tracemalloc.get_traceback_limit(),
+        "traced_mb": round(current / 2 ** 20, 2),
+        "peak_mb": round(peak / 2 ** 20, 2),
+        "overhead_mb": round(tracemalloc.get_tracemalloc_memory() / 2 ** 20, 2),
+        "last_snapshot_at": _tracemalloc_state["taken_at"],
+    }
+
+def start_tracemalloc(frames: int = 1) -> dict:
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(max(1, min(frames, 25)))
+        logger.info("🔬 بدأ تتبع الذاكرة (tracemalloc، %s إطار)", frames, extra=log_context("memory"))
+    return tracemalloc_status()
+
+def stop_tracemalloc() -> dict:
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+        logger.info("🔬 توقف تتبع الذاكرة", extra=log_context("memory"))
+    _tracemalloc_state.update(snapshot=None, taken_at=None)
+    return tracemalloc_status()
+
+def _stat_entry(stat, with_diff: bool) -> dict:
+    frame = stat.traceback[0]
+    entry = {
+        "where": f"{frame.filename}:{frame.lineno}",
+        "size_kb": round(stat.size / 1024, 1),
+        "count": stat.count,
+    }
+    if with_diff:
+        entry["size_diff_kb"] = round(stat.size_diff / 1024, 1)
+        entry["count_diff"] = stat.count_diff
+    return entry
+
+def take_snapshot(group_by: str = "lineno", limit: int = MEMORY_TOP_LIMIT) -> dict:
+    """أكبر مواقع التخصيص والفرق عن اللقطة السابقة (group_by: filename أو lineno أو traceback)"""
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc غير مفعل: ابدأ التتبع أولاً")
+    if group_by not in ("filename", "lineno", "traceback"):
+        raise ValueError("group_by يجب أن يكون filename أو lineno أو traceback")
+
+    snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+    previous = _tracemalloc_state["snapshot"]
+    result = {
+        **tracemalloc_status(),
+        "group_by": group_by,
+        "top": [_stat_entry(stat, False) for stat in snapshot.statistics(group_by)[:limit]],
+    }
+    if previous is not None:
+        result["since"] = _tracemalloc_state["taken_at"]
+        result["diff"] = [
+            _stat_entry(stat, True) for stat in snapshot.compare_to(previous, group_by)[:limit]
+        ]
+    _tracemalloc_state.update(snapshot=snapshot, taken_at=round(time.time()))
+    return result
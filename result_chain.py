@@ -0,0 +1,399 @@
+"""
+سلسلة نتائج محسوبة مسبقاً وقابلة للتحقق (hash chain)
+
+لكل غرفة سلسلة تُولد دفعة واحدة: بذرة أخيرة عشوائية سرية ثم SHA-256 متكرر،
+وتُستهلك بالعكس فيكون:
+
+    sha256(بذرة الجولة n) = بذرة الجولة n-1        sha256(البذرة 0) = الالتزام
+
+الالتزام (commitment) يُنشر قبل أول جولة، فلا يمكن تغيير أي نتيجة بعده. كشف
+بذرة يكشف كل ما قبلها في السلسلة فقط، لذلك لكل غرفة سلسلتها: جولات الغرف
+المختلفة متداخلة زمنياً.
+
+- التخزين: RESULT_CHAIN_DIR/chain-{id}.bin، 32 بايت لكل بذرة بترتيب الاستهلاك،
+  تُقرأ عبر mmap: البذرة n هي البايتات [32n, 32n+32) دون تحميل الملف
+- النتيجة: game_rules.result_from_seed(البذرة, ملح السلسلة)
+- النشر: hash البذرة في حالة الجولة منذ بدايتها، والبذرة بعد الانفجار في الحالة
+  و/api/history، والالتزامات في /api/fairness
+- عند بقاء RESULT_CHAIN_REFILL موضع تُولد السلسلة التالية في الخلفية
+- المواضع المستهلكة تُحفظ في result_chains.used مع كل سحب، فلا تُعاد بذرة
+  مكشوفة بعد إعادة التشغيل حتى لو أُرشفت جولاتها (maintenance.py)
+- التحقق يقرأ الجولات المؤرشفة من ملفات الأرشيف ثم الباقي من قاعدة البيانات
+
+    python result_chain.py status
+    python result_chain.py generate <room_id> [--length N]   (والتطبيق متوقف)
+    python result_chain.py verify [--workers N]
+"""
+
+import os
+import sys
+import glob
+import gzip
+import json
+import mmap
+import time
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from game_rules import result_from_seed
+from log_pipeline import log_context
+from database import add_result_chain, advance_result_chain, get_result_chains, get_round_seeds
+from maintenance import ARCHIVE_DIR
+
+logger = logging.getLogger(__name__)
+
+RESULT_CHAIN_DIR = os.getenv('RESULT_CHAIN_DIR', 'result_chains')
+RESULT_CHAIN_LENGTH = int(os.getenv('RESULT_CHAIN_LENGTH', '100000'))
+RESULT_CHAIN_REFILL = int(os.getenv('RESULT_CHAIN_REFILL', '1000'))
+# ملح عام يُعلن مع السلسلة (مثلاً hash كتلة مستقبلية) فلا يختار المشغل النتائج بعد توليد البذور
+RESULT_CHAIN_SALT = os.getenv('RESULT_CHAIN_SALT', '')
+
+SEED_SIZE = 32
+VERIFY_PAGE = 200000    # صفوف لكل استعلام
+VERIFY_CHUNK = 20000    # صفوف لكل مهمة في عملية التحقق
+
+ALGORITHM = (
+    "result = round(1.5 + 8.5 * (HMAC_SHA256(key=seed, msg=salt)[:8] >> 12) / 2**52, 2); "
+    "sha256(seed[n]) = seed[n-1]; sha256(seed[0]) = commitment"
+)
+
+chain_stats = {
+    "drawn": 0,
+    "generated": 0,
+    "generate_seconds": 0.0,
+}
+
+
+def sha256(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()
+
+def build_chain(length: int, terminal: bytes = None) -> tuple:
+    """(البذور بترتيب الاستهلاك, الالتزام hex): length تجزئة متتالية من البذرة الأخيرة"""
+    chain = bytearray(length * SEED_SIZE)
+    seed = terminal or os.urandom(SEED_SIZE)
+    for offset in range((length - 1) * SEED_SIZE, -1, -SEED_SIZE):
+        chain[offset:offset + SEED_SIZE] = seed
+        seed = sha256(seed)
+    return chain, seed.hex()
+
+def chain_path(chain_id: int) -> str:
+    return os.path.join(RESULT_CHAIN_DIR, f"chain-{chain_id}.bin")
+
+def write_chain(path: str, chain: bytes):
+    """البذور سرية: الملف للمالك فقط"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(chain)
+
+
+class RoundSeed:
+    """بذرة جولة واحدة ونتيجتها"""
+    __slots__ = ("chain_id", "index", "seed", "hash", "result")
+
+    def __init__(self, chain_id: int, index: int, seed: bytes, salt: bytes):
+        self.chain_id = chain_id
+        self.index = index
+        self.seed = seed.hex()
+        self.hash = sha256(seed).hex()
+        self.result = result_from_seed(seed, salt)
+
+
+class ResultChain:
+    """سلسلة مسجلة مفتوحة عبر mmap"""
+
+    def __init__(self, chain_id: int, commitment: str, length: int, salt: str = "", used: int = 0):
+        self.chain_id = chain_id
+        self.commitment = commitment
+        self.length = length
+        self.salt = salt.encode()
+        self.next_index = used
+        with open(chain_path(chain_id), "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) != length * SEED_SIZE or sha256(self._map[:SEED_SIZE]).hex() != commitment:
+            self._map.close()
+            raise ValueError(f"ملف السلسلة #{chain_id} لا يطابق التزامها")
+
+    @property
+    def remaining(self) -> int:
+        return self.length - self.next_index
+
+    def draw(self) -> RoundSeed:
+        index = self.next_index
+        self.next_index += 1
+        offset = index * SEED_SIZE
+        return RoundSeed(self.chain_id, index, self._map[offset:offset + SEED_SIZE], self.salt)
+
+    def close(self):
+        self._map.close()
+
+
+class ResultEngine:
+    """السلسلة الحالية لكل غرفة والتالية حين تقترب نهايتها"""
+
+    def __init__(self, length: int = RESULT_CHAIN_LENGTH, refill: int = RESULT_CHAIN_REFILL):
+        self.length = length
+        self.refill = refill
+        self.chains = {}      # {room_id: ResultChain}
+        self._next = {}       # {room_id: مهمة توليد السلسلة التالية}
+
+    async def load(self):
+        """فتح أقدم سلسلة غير مستهلكة لكل غرفة، والتي تليها (إن وُلدت مسبقاً) كسلسلة تالية
+
+        السلاسل التي فُقد ملفها تُتخطى؛ جولاتها المكشوفة تبقى قابلة للتحقق من قاعدة البيانات.
+        """
+        loop = asyncio.get_running_loop()
+        for row in await get_result_chains():
+            room_id = row["room_id"]
+            if row["used"] >= row["length"] or room_id in self._next:
+                continue
+            try:
+                chain = ResultChain(row["chain_id"], row["commitment"], row["length"], row["salt"], row["used"])
+            except (OSError, ValueError) as e:
+                logger.warning("⚠️ تعذر فتح سلسلة النتائج #%s: %s", row['chain_id'], e,
+                               extra=log_context("round", room_id=room_id))
+                continue
+            if room_id not in self.chains:
+                self.chains[room_id] = chain
+            else:
+                self._next[room_id] = loop.create_future()
+                self._next[room_id].set_result(chain)
+        logger.info("🔗 تم تحميل سلاسل النتائج لـ %s غرفة", len(self.chains), extra=log_context("startup"))
+
+    async def generate(self, room_id: str, length: int = None) -> ResultChain:
+        """توليد سلسلة جديدة للغرفة وتسجيل التزامها (التجزئة خارج حلقة الأحداث)"""
+        length = length or self.length
+        started = time.perf_counter()
+        chain, commitment = await asyncio.to_thread(build_chain, length)
+        # الملف أولاً باسم مؤقت: لا التزام مسجل دون بذوره
+        pending = os.path.join(RESULT_CHAIN_DIR, f"pending-{commitment[:16]}.bin")
+        await asyncio.to_thread(write_chain, pending, chain)
+        chain_id = await add_result_chain(room_id, commitment, length, RESULT_CHAIN_SALT)
+        os.replace(pending, chain_path(chain_id))
+        chain_stats["generated"] += 1
+        chain_stats["generate_seconds"] = round(time.perf_counter() - started, 3)
+        logger.info("🔗 سلسلة نتائج جديدة #%s للغرفة %s: %s جولة، الالتزام %s", chain_id, room_id, length, commitment,
+                    extra=log_context("round", room_id=room_id))
+        return ResultChain(chain_id, commitment, length, RESULT_CHAIN_SALT)
+
+    def _generate_next(self, room_id: str) -> asyncio.Task:
+        task = self._next.get(room_id)
+        if task is None:
+            task = self._next[room_id] = asyncio.ensure_future(self.generate(room_id))
+            task.add_done_callback(lambda done: self._forget_failed(room_id, done))
+        return task
+
+    def _forget_failed(self, room_id: str, task: asyncio.Task):
+        # توليد فاشل لا يبقى: الجولة التالية تعيد المحاولة
+        if task.cancelled() or task.exception() is not None:
+            logger.error("❌ فشل توليد سلسلة النتائج للغرفة %s: %s", room_id, None if task.cancelled() else task.exception(),
+                         extra=log_context("round", room_id=room_id))
+            if self._next.get(room_id) is task:
+                del self._next[room_id]
+
+    async def rotate(self, room_id: str) -> ResultChain:
+        """الانتقال إلى سلسلة جديدة فوراً (الجولة التالية تبدأ منها)"""
+        chain = await self._generate_next(room_id)
+        self._switch(room_id, chain)
+        return chain
+
+    def _switch(self, room_id: str, chain: ResultChain):
+        self._next.pop(room_id, None)
+        previous = self.chains.get(room_id)
+        if previous:
+            previous.close()
+        self.chains[room_id] = chain
+
+    async def draw(self, room_id: str) -> RoundSeed:
+        """بذرة الجولة التالية في الغرفة: O(1) من mmap، والموضع محفوظ قبل استخدامها"""
+        chain = self.chains.get(room_id)
+        if chain is None or chain.remaining == 0:
+            chain = await self._generate_next(room_id)
+            self._switch(room_id, chain)
+        elif chain.remaining <= self.refill:
+            # التالية في الخلفية حتى لا تنتظر جولة توليد السلسلة
+            self._generate_next(room_id)
+        seed = chain.draw()
+        # فشل الحفظ يفقد الموضع فقط (فجوة مقبولة في التحقق) ولا يعيده أبداً
+        await advance_result_chain(chain.chain_id, chain.next_index)
+        chain_stats["drawn"] += 1
+        return seed
+
+    def stats(self) -> dict:
+        return {
+            **chain_stats,
+            "rooms": {
+                room_id: {"chain_id": chain.chain_id, "remaining": chain.remaining}
+                for room_id, chain in self.chains.items()
+            },
+        }
+
+
+result_engine = ResultEngine()
+
+
+async def fairness_info() -> dict:
+    """الالتزامات المنشورة وطريقة التحقق"""
+    return {
+        "algorithm": ALGORITHM,
+        "chains": [
+            {
+                "chain_id": row["chain_id"],
+                "room_id": row["room_id"],
+                "commitment": row["commitment"],
+                "salt": row["salt"],
+                "length": row["length"],
+                "used": row["used"],
+                "created_at": str(row["created_at"]),
+            }
+            for row in await get_result_chains()
+        ],
+    }
+
+
+# ==================== التحقق الجماعي ====================
+def _seed_bytes(value) -> bytes:
+    try:
+        return bytes.fromhex(value)
+    except (TypeError, ValueError):
+        return b""
+
+def verify_chunk(previous: tuple, salt: bytes, rows: list) -> tuple:
+    """التحقق من دفعة متتالية في سلسلة واحدة (يعمل في عملية منفصلة)
+
+    previous: (موضع, بذرة) آخر جولة قبل الدفعة، أو (-1, الالتزام) لأول دفعة.
+    يعيد (عدد الجولات, [(round_id, السبب)]).
+    """
+    failures = []
+    seeds = [_seed_bytes(row[2]) for row in rows]
+    expected = [previous[1]] + seeds[:-1]
+
+    # المسار السريع: مواضع متتالية بلا فجوات ⇒ مقارنة واحدة للدفعة كلها
+    contiguous = rows[-1][1] - previous[0] == len(rows)
+    if not contiguous or b"".join(map(sha256, seeds)) != b"".join(expected):
+        previous_index = previous[0]
+        for row, seed, prior in zip(rows, seeds, expected):
+            digest = seed
+            # فجوة (جولة لم تكتمل): تجزئات بعدد المواضع المتخطاة
+            for _ in range(max(1, row[1] - previous_index)):
+                digest = sha256(digest)
+            if len(seed) != SEED_SIZE or digest != prior:
+                failures.append((row[0], "chain"))
+            previous_index = row[1]
+
+    results = [result_from_seed(seed, salt) for seed in seeds]
+    failures.extend(
+        (row[0], "result") for row, result in zip(rows, results)
+        if row[3] is None or abs(result - row[3]) > 1e-9
+    )
+    return len(rows), failures
+
+def archived_round_files() -> list:
+    """ملفات أرشيف rounds (maintenance.py) بترتيب round_id: الاسم يبدأ بأول معرف في الدفعة"""
+    paths = glob.glob(os.path.join(ARCHIVE_DIR, 'rounds', '*', '*.jsonl.gz'))
+    return sorted(paths, key=lambda path: (os.path.basename(path), path))
+
+def read_archived_seeds(path: str) -> list:
+    """الجولات المكشوفة في ملف أرشيف: [(chain_id, (round_id, chain_index, seed, result))]"""
+    rows = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            if row.get("chain_id") is None or row.get("seed") is None or row.get("status") != "finished":
+                continue
+            rows.append((row["chain_id"], (row["round_id"], row["chain_index"], row["seed"], row["result"])))
+    return rows
+
+async def verify_all(workers: int = None, chunk: int = VERIFY_CHUNK, max_failures: int = 100) -> dict:
+    """التحقق من كل الجولات المكشوفة مقابل التزامات سلاسلها، بالتوازي على الأنوية
+
+    الجولات المؤرشفة أقدم من كل ما في القاعدة: تُقرأ من الملفات أولاً ثم يكمل
+    الاستعلام بعد آخر موضع مؤرشف لكل سلسلة.
+    """
+    workers = workers or os.cpu_count() or 1
+    loop = asyncio.get_running_loop()
+    report = {"chains": 0, "rounds": 0, "archived": 0, "failed": 0, "failures": [], "workers": workers}
+    started = time.perf_counter()
+    pending = set()
+
+    def collect(done):
+        for future in done:
+            checked, failures = future.result()
+            report["rounds"] += checked
+            report["failed"] += len(failures)
+            report["failures"].extend(failures[:max_failures - len(report["failures"])])
+
+    chains = {chain["chain_id"]: chain for chain in await get_result_chains()}
+    report["chains"] = len(chains)
+    # آخر جولة مرسلة للتحقق في كل سلسلة: (موضع, بذرة)
+    previous = {chain_id: (-1, bytes.fromhex(chain["commitment"])) for chain_id, chain in chains.items()}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        async def submit(chain_id: int, part: list):
+            nonlocal pending
+            salt = (chains[chain_id]["salt"] or "").encode()
+            pending.add(loop.run_in_executor(pool, verify_chunk, previous[chain_id], salt, part))
+            previous[chain_id] = (part[-1][1], _seed_bytes(part[-1][2]))
+            # عدد محدود من الدفعات في الطريق حتى تبقى الذاكرة ثابتة
+            if len(pending) >= workers * 2:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                collect(done)
+
+        buffers = {}
+        for path in archived_round_files():
+            for chain_id, row in await asyncio.to_thread(read_archived_seeds, path):
+                if chain_id not in chains:
+                    continue
+                buffer = buffers.setdefault(chain_id, [])
+                # صف مكرر من دفعة أُعيدت أرشفتها بعد انقطاع
+                if row[1] <= (buffer[-1][1] if buffer else previous[chain_id][0]):
+                    continue
+                buffer.append(row)
+                report["archived"] += 1
+                if len(buffer) >= chunk:
+                    await submit(chain_id, buffers.pop(chain_id))
+        for chain_id, buffer in buffers.items():
+            if buffer:
+                await submit(chain_id, buffer)
+
+        for chain_id in chains:
+            after_index = previous[chain_id][0]
+            while True:
+                rows = await get_round_seeds(chain_id, after_index, VERIFY_PAGE)
+                if not rows:
+                    break
+                for start in range(0, len(rows), chunk):
+                    await submit(chain_id, rows[start:start + chunk])
+                after_index = rows[-1][1]
+        if pending:
+            done, _ = await asyncio.wait(pending)
+            collect(done)
+
+    report["seconds"] = round(time.perf_counter() - started, 2)
+    report["rounds_per_second"] = int(report["rounds"] / report["seconds"]) if report["seconds"] else report["rounds"]
+    return report
+
+
+async def _main(argv: list) -> int:
+    command = argv[0] if argv else "status"
+    if command == "verify":
+        workers = int(argv[argv.index("--workers") + 1]) if "--workers" in argv else None
+        report = await verify_all(workers)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 1 if report["failed"] else 0
+    if command == "generate" and len(argv) >= 2:
+        length = int(argv[argv.index("--length") + 1]) if "--length" in argv else RESULT_CHAIN_LENGTH
+        chain = await ResultEngine().generate(argv[1], length)
+        print(f"🔗 السلسلة #{chain.chain_id}: الالتزام {chain.commitment}")
+        return 0
+    if command == "status":
+        print(json.dumps(await fairness_info(), ensure_ascii=False, indent=2))
+        return 0
+    print(__doc__)
+    return 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
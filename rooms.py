@@ -0,0 +1,174 @@
+"""
+غرف اللعب
+
+كل غرفة لها إعداداتها (مدة الجولة، وقت الرهان، خيارات الرهان) وحالة جولتها
+ورهاناتها النشطة وفهرس الصرف التلقائي وسجل نتائجها. جميع الغرف يقودها مجدول
+واحد (timer_wheel) بدلاً من حلقة لكل غرفة.
+
+أحداث الغرفة (round / counting / crash / cashout) تُبث للمشتركين عبر
+/api/events، والعميل يرسم المضاعف محلياً من معاملات المنحنى.
+"""
+
+import asyncio
+import clock
+import logging
+from datetime import datetime
+from config import ROOMS, DEFAULT_ROOM
+from log_pipeline import log_context
+from auto_cashout import AutoCashoutBook
+from exposure import RoundExposure
+from round_history import history_for
+from game_rules import curve_params
+
+logger = logging.getLogger(__name__)
+
+ROOM_EVENT_QUEUE = 64   # أقصى أحداث معلقة لكل مشترك قبل قطع العميل البطيء
+
+
+def _ms(moment: datetime):
+    return int(moment.timestamp() * 1000) if moment else None
+
+
+class Room:
+    """غرفة لعب وحالة جولتها الحالية"""
+
+    def __init__(self, room_id: str, title: str, round_duration: int, betting_duration: int,
+                 bet_options: list, private: bool = False):
+        self.room_id = room_id
+        self.title = title
+        self.round_duration = round_duration
+        self.betting_duration = betting_duration
+        self.counting_duration = round_duration - betting_duration
+        self.bet_options = list(bet_options)
+        self.private = private
+
+        # حالة الجولة
+        self.round_id = None
+        self.start_time = None
+        self.betting_end = None
+        self.round_end = None
+        self.result = None
+        self.crash_after = None     # ثواني الانفجار بعد نهاية الرهان (لا تُرسل قبل الانفجار)
+        self.seed = None            # بذرة الجولة في سلسلة النتائج (RoundSeed): hash منذ البداية والبذرة بعد الانفجار
+        self.status = "waiting"
+        self.bets = {}
+        self.exposure = RoundExposure()   # مجاميع الرهانات والمدفوعات
+
+        self.active_bets = {}   # {user_id: ActiveBet}
+        self.auto_cashouts = AutoCashoutBook()
+        self.history = history_for(room_id)
+        self.timer = None       # مؤقت الحدث التالي في المجدول
+        self.subscribers = set()   # طوابير مشتركي /api/events
+
+    @property
+    def remaining_time(self) -> int:
+        if not self.round_end:
+            return self.round_duration
+        return max(0, int((self.round_end - clock.now()).total_seconds()))
+
+    def betting_time_left(self, now: datetime = None) -> int:
+        if not self.betting_end:
+            return 0
+        return max(0, int((self.betting_end - (now or clock.now())).total_seconds()))
+
+    def can_bet(self, now: datetime = None) -> bool:
+        now = now or clock.now()
+        return self.status == "betting" and bool(self.betting_end) and now < self.betting_end
+
+    def state(self) -> dict:
+        """حالة الجولة للعميل: الأوقات بالمللي ثانية ومعاملات المنحنى أثناء العد،
+        وhash البذرة، والنتيجة والبذرة بعد الانفجار فقط"""
+        state = {
+            "room_id": self.room_id,
+            "round_id": self.round_id,
+            "status": self.status,
+            "betting_end": _ms(self.betting_end),
+            "round_end": _ms(self.round_end),
+        }
+        if self.status == "counting":
+            state["curve"] = {**curve_params(self.counting_duration), "start": _ms(self.betting_end)}
+        if self.seed:
+            state["hash"] = self.seed.hash
+        if self.status == "crashed":
+            state["result"] = self.result
+            if self.seed:
+                state["seed"] = self.seed.seed
+        return state
+
+    # ---- البث ----
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=ROOM_EVENT_QUEUE)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, event: str, data: dict = None):
+        """بث حدث لكل المشتركين (data الافتراضية: حالة الجولة)"""
+        message = (event, {**(data if data is not None else self.state()), "server_time": clock.time_ms()})
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # عميل لا يقرأ: نفصله بدل تراكم الأحداث في الذاكرة
+                self.subscribers.discard(queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+    def info(self) -> dict:
+        """ملخص الغرفة لقائمة الغرف"""
+        return {
+            "room_id": self.room_id,
+            "title": self.title,
+            "round_duration": self.round_duration,
+            "betting_duration": self.betting_duration,
+            "bet_options": self.bet_options,
+            "private": self.private,
+            "round_id": self.round_id,
+            "status": self.status,
+            "remaining_time": self.remaining_time,
+            "players": len(self.bets),
+        }
+
+
+rooms = {}   # {room_id: Room}
+rooms_state = {"settling": 0, "draining": False}   # عدد الغرف التي تسوي رهاناتها الآن، والإيقاف
+
+def add_room(room_id: str, title: str = None, round_duration: int = 60, betting_duration: int = 30,
+             bet_options: list = None, private: bool = False) -> Room:
+    """تسجيل غرفة جديدة"""
+    if room_id in rooms:
+        raise ValueError(f"الغرفة {room_id} موجودة مسبقاً")
+    if not 0 < betting_duration < round_duration:
+        raise ValueError("وقت الرهان يجب أن يكون أقل من مدة الجولة")
+    room = Room(room_id, title or room_id, round_duration, betting_duration,
+                bet_options or ROOMS[0]["bet_options"], private)
+    rooms[room_id] = room
+    return room
+
+def load_rooms(configs: list = ROOMS):
+    """تحميل الغرف من الإعدادات"""
+    for config in configs:
+        add_room(
+            config["id"],
+            config.get("title"),
+            int(config["round_duration"]),
+            int(config["betting_duration"]),
+            config.get("bet_options"),
+            bool(config.get("private", False)),
+        )
+    if DEFAULT_ROOM not in rooms:
+        raise ValueError(f"الغرفة الافتراضية {DEFAULT_ROOM} غير موجودة في الإعدادات")
+    logger.info("🏠 تم تحميل %s غرفة", len(rooms), extra=log_context("startup"))
+
+def get_room(room_id: str = None) -> Room:
+    """الغرفة بالمعرف (None للغرفة الافتراضية)"""
+    return rooms.get(room_id or DEFAULT_ROOM)
+
+def public_rooms() -> list:
+    return [room for room in rooms.values() if not room.private]
+
+def rounds_busy() -> bool:
+    """غرفة في مرحلة العد أو تسوي رهاناتها (الأعمال الخلفية الثقيلة تنتظر)"""
+    return rooms_state["settling"] > 0 or any(room.status == "counting" for room in rooms.values())
@@ -0,0 +1,121 @@
+"""
+سجل الجولات الأخيرة في الذاكرة
+
+حلقة ثابتة الحجم من الجولات المنتهية لكل غرفة تُهيأ باستعلام واحد عند التشغيل
+وتُحدَّث عند إنهاء كل جولة، مع ردود JSON جاهزة مسبقاً للعرض.
+الصفحات الأقدم من الحلقة تُجلب من قاعدة البيانات عبر فهرس round_id.
+"""
+
+import os
+import json
+import logging
+from collections import deque
+import asyncio
+from config import DEFAULT_ROOM
+from log_pipeline import log_context
+from database import get_finished_rounds
+
+logger = logging.getLogger(__name__)
+
+ROUND_HISTORY_SIZE = int(os.getenv('ROUND_HISTORY_SIZE', '100'))
+
+
+class RoundHistory:
+    """حلقة الجولات المنتهية (الأحدث أولاً)"""
+
+    def __init__(self, size: int = ROUND_HISTORY_SIZE):
+        self.size = size
+        self.rounds = deque(maxlen=size)
+        self._json_cache = {}   # {limit: bytes}
+        self._text_cache = None
+
+    def seed(self, rows: list):
+        """تهيئة الحلقة من صفوف قاعدة البيانات (الأحدث أولاً)"""
+        self.rounds.clear()
+        self.rounds.extend(rows[:self.size])
+        self._invalidate()
+
+    def append(self, round_id: int, result: float, bettor_count: int,
+               total_wagered: int, total_paid: int, seed: str = None):
+        """إضافة جولة منتهية (مع بذرتها للتحقق من النتيجة)"""
+        self.rounds.appendleft({
+            "round_id": round_id,
+            "result": result,
+            "bettor_count": bettor_count,
+            "total_wagered": total_wagered,
+            "total_paid": total_paid,
+            "seed": seed,
+        })
+        self._invalidate()
+
+    def _invalidate(self):
+        self._json_cache.clear()
+        self._text_cache = None
+
+    def covers(self, limit: int, before_round_id: int = None) -> bool:
+        """هل يمكن خدمة الصفحة من الذاكرة؟"""
+        if before_round_id is None:
+            return limit <= self.size
+        # يجب أن تحتوي الحلقة على limit جولة أقدم من before_round_id
+        # أو أن تكون الحلقة غير ممتلئة (أي لا توجد جولات أقدم في قاعدة البيانات)
+        older = sum(1 for r in self.rounds if r["round_id"] < before_round_id)
+        return older >= limit or len(self.rounds) < self.size
+
+    def page(self, limit: int, before_round_id: int = None) -> list:
+        if before_round_id is None:
+            return list(self.rounds)[:limit]
+        return [r for r in self.rounds if r["round_id"] < before_round_id][:limit]
+
+    def latest_json(self, limit: int) -> bytes:
+        """الصفحة الأولى كـ JSON جاهز"""
+        cached = self._json_cache.get(limit)
+        if cached is None:
+            cached = json.dumps({"rounds": self.page(limit)}, ensure_ascii=False).encode()
+            self._json_cache[limit] = cached
+        return cached
+
+    def latest_text(self, limit: int = 10) -> str:
+        """نص آخر النتائج لأمر البوت"""
+        if self._text_cache is None:
+            lines = ["📜 <b>آخر النتائج:</b>\n"]
+            for r in list(self.rounds)[:limit]:
+                lines.append(
+                    f"#{r['round_id']} ➜ <b>{r['result']}x</b> "
+                    f"| 👥 {r['bettor_count']} | 💰 {r['total_wagered']} | 🏆 {r['total_paid']}"
+                )
+            if len(lines) == 1:
+                lines.append("لا توجد جولات منتهية بعد")
+            self._text_cache = "\n".join(lines)
+        return self._text_cache
+
+histories = {}   # {room_id: RoundHistory}
+
+def history_for(room_id: str = DEFAULT_ROOM) -> RoundHistory:
+    """سجل الغرفة (يُنشأ عند أول استخدام)"""
+    history = histories.get(room_id)
+    if history is None:
+        history = histories[room_id] = RoundHistory()
+    return history
+
+
+async def load_round_history(room_ids=(DEFAULT_ROOM,)):
+    """تهيئة سجل كل غرفة باستعلام واحد لها"""
+    async def load(room_id):
+        history = history_for(room_id)
+        rows = await get_finished_rounds(history.size, room_id=room_id)
+        history.seed(rows)
+        return len(rows)
+
+    counts = await asyncio.gather(*(load(room_id) for room_id in room_ids))
+    logger.info("📜 تم تحميل %s جولة في سجل النتائج لـ %s غرفة", sum(counts), len(counts), extra=log_context("startup"))
+
+async def get_history_json(limit: int, before_round_id: int = None, room_id: str = DEFAULT_ROOM) -> bytes:
+    """صفحة من سجل الغرفة: من الذاكرة إن أمكن وإلا من قاعدة البيانات"""
+    history = history_for(room_id)
+    if history.covers(limit, before_round_id):
+        if before_round_id is None:
+            return history.latest_json(limit)
+        rows = history.page(limit, before_round_id)
+    else:
+        rows = await get_finished_rounds(limit, before_round_id, room_id)
+    return json.dumps({"rounds": rows}, ensure_ascii=False).encode()
@@ -0,0 +1,85 @@
+"""
+تشغيل خادم HTTP للإنتاج (python main.py يمر من هنا)
+
+SERVER_MODE=production (الافتراضي):
+- uvloop و httptools إذا كانا مثبتين (uvicorn[standard])، ويُسجل ما اختير فعلاً
+- keep-alive أطول من مهلة الموازن أمامنا (SERVER_KEEP_ALIVE) فيغلق هو الاتصال الخامل
+  أولاً بدل أن يرسل طلباً على اتصال أغلقناه، و backlog أكبر لدفعات بداية الجولة
+- SO_REUSEPORT حيث يدعمه النظام: النسخة الجديدة تربط المنفذ نفسه بينما القديمة
+  تصرف جولاتها، فلا تُرفض الاتصالات أثناء إعادة النشر على الخادم نفسه
+- الإيقاف (SIGTERM): uvicorn يتوقف عن قبول الاتصالات وينتظر الطلبات الجارية حتى
+  SERVER_GRACEFUL_TIMEOUT (بث /api/events لا ينتهي وحده)، ثم يصرف lifespan الجولات
+  (drain في main.py)
+
+SERVER_MODE=dev: إعدادات uvicorn الافتراضية مع حلقة asyncio ومحلل h11 (للمقارنة:
+python -m bench.server_modes).
+
+عدد العمال: حالة الجولات والرهانات النشطة في ذاكرة العملية، فعامل واحد فقط يمكنه
+قيادة اللعبة؛ SERVER_WORKERS أكبر من 1 يُسجل تحذيراً ويُشغل عاملاً واحداً.
+"""
+
+import os
+import socket
+import logging
+import importlib.util
+import uvicorn
+from log_pipeline import log_context
+from config import PORT
+
+logger = logging.getLogger(__name__)
+
+SERVER_MODE = os.getenv('SERVER_MODE', 'production').strip().lower()
+SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', os.getenv('WEB_CONCURRENCY', '1')))
+SERVER_BACKLOG = int(os.getenv('SERVER_BACKLOG', '2048'))
+SERVER_KEEP_ALIVE = int(os.getenv('SERVER_KEEP_ALIVE', '75'))
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv('SERVER_GRACEFUL_TIMEOUT', '10'))
+SERVER_REUSEPORT = os.getenv('SERVER_REUSEPORT', '1') == '1'
+
+
+def available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+def server_config(app, mode: str = SERVER_MODE, host: str = SERVER_HOST, port: int = PORT) -> uvicorn.Config:
+    # log_config=None: سجلات uvicorn تمر بطابور log_pipeline (والوصول يُؤخذ منه عينات)
+    if mode == "dev":
+        return uvicorn.Config(app, host=host, port=port, loop="asyncio", http="h11", log_config=None)
+    return uvicorn.Config(
+        app,
+        host=host,
+        port=port,
+        loop="uvloop" if available("uvloop") else "asyncio",
+        http="httptools" if available("httptools") else "h11",
+        backlog=SERVER_BACKLOG,
+        timeout_keep_alive=SERVER_KEEP_ALIVE,
+        timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT,
+        server_header=False,
+        log_config=None,
+    )
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """مقبس المنفذ مع SO_REUSEPORT إن وُجد (uvicorn يستدعي listen بالـ backlog)"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if SERVER_REUSEPORT and hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+def run_server(app, mode: str = SERVER_MODE):
+    if SERVER_WORKERS > 1:
+        logger.warning("⚠️ SERVER_WORKERS=%s غير مدعوم: حالة الجولات في ذاكرة العملية، سيعمل عامل واحد",
+                       SERVER_WORKERS, extra=log_context("startup"))
+
+    config = server_config(app, mode)
+    server = uvicorn.Server(config)
+    sockets = [bind_socket(config.host, config.port)] if mode != "dev" else None
+    logger.info(
+        "🌐 الخادم (%s): %s:%s | loop=%s | http=%s | keep-alive=%ss | backlog=%s | reuseport=%s",
+        mode, config.host, config.port, config.loop, config.http, config.timeout_keep_alive, config.backlog,
+        bool(sockets) and SERVER_REUSEPORT and hasattr(socket, 'SO_REUSEPORT'),
+        extra=log_context("startup")
+    )
+    server.run(sockets=sockets)
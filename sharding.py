@@ -0,0 +1,148 @@
+"""
+إعادة موازنة المستخدمين بين القواعد المقسمة (DATABASE_SHARDS)
+
+المستخدم يبقى في القاعدة المسجلة له في الدليل (user_shards) حتى يُنقل، فإضافة
+قاعدة لا تغير مكان أحد. إعادة الموازنة تنقل من تختلف قاعدته عن hash(user_id)
+على القواعد الحالية، على دفعات، وتتخطى من لديه رهان نشط.
+
+الانتقال من قاعدة واحدة إلى التقسيم (والتطبيق متوقف):
+    DATABASE_SHARDS=game.db,shard1.db,shard2.db python sharding.py backfill
+    DATABASE_SHARDS=game.db,shard1.db,shard2.db python sharding.py rebalance --limit 1000
+
+أثناء التشغيل تتم الموازنة داخل العملية نفسها حتى تبقى نسخة الدليل في الذاكرة
+صحيحة: POST /api/admin/shards/rebalance (ترويسة X-Admin-Key).
+
+    python sharding.py status
+    python sharding.py move <user_id> <shard>
+"""
+
+import os
+import sys
+import json
+import asyncio
+import logging
+from log_pipeline import log_context
+from database import (
+    DATABASE_SHARDS, SHARD_IDS, SHARD_MOVE_GRACE, hash_shard, move_user, set_user_shards,
+    get_user_shard_page, get_shard_user_ids, get_shard_counts, get_shard_stats
+)
+
+logger = logging.getLogger(__name__)
+
+REBALANCE_LIMIT = int(os.getenv('REBALANCE_LIMIT', '100'))
+REBALANCE_CONCURRENCY = int(os.getenv('REBALANCE_CONCURRENCY', '8'))
+DIRECTORY_PAGE = 1000
+
+rebalance_stats = {
+    "runs": 0,
+    "moved": 0,
+    "skipped_active": 0,
+    "failed": 0,
+    "last_run": None,
+    "last_error": None,
+}
+_rebalance_lock = asyncio.Lock()   # موازنة واحدة في كل مرة
+
+
+async def backfill_directory() -> int:
+    """تسجيل المستخدمين الموجودين فعلاً في كل قاعدة (دون تغيير المسجلين). يعيد العدد"""
+    registered = 0
+    for shard in SHARD_IDS:
+        after_user_id = 0
+        while True:
+            user_ids = await get_shard_user_ids(shard, after_user_id, DIRECTORY_PAGE)
+            if not user_ids:
+                break
+            await set_user_shards([(user_id, shard) for user_id in user_ids], replace=False)
+            registered += len(user_ids)
+            after_user_id = user_ids[-1]
+    logger.info("📇 سُجل %s مستخدم في دليل القواعد", registered, extra=log_context("shard"))
+    return registered
+
+async def plan_rebalance(limit: int = REBALANCE_LIMIT) -> list:
+    """المستخدمون الذين ليسوا في قاعدة hash الخاصة بهم: [(user_id, من, إلى)]"""
+    moves = []
+    after_user_id = 0
+    while len(moves) < limit:
+        page = await get_user_shard_page(after_user_id, DIRECTORY_PAGE)
+        if not page:
+            break
+        for user_id, shard in page:
+            target = hash_shard(user_id)
+            if shard != target:
+                moves.append((user_id, shard, target))
+                if len(moves) >= limit:
+                    break
+        after_user_id = page[-1][0]
+    return moves
+
+async def rebalance(limit: int = REBALANCE_LIMIT, is_active=None, grace: float = SHARD_MOVE_GRACE) -> dict:
+    """نقل حتى limit مستخدم إلى قاعدة hash الخاصة بهم (is_active(user_id) يتخطى من يلعب الآن)"""
+    if not DATABASE_SHARDS:
+        raise ValueError("التقسيم غير مفعل: DATABASE_SHARDS فارغ")
+
+    async with _rebalance_lock:
+        moves = await plan_rebalance(limit)
+        result = {"planned": len(moves), "moved": 0, "skipped_active": 0, "failed": 0}
+        semaphore = asyncio.Semaphore(REBALANCE_CONCURRENCY)
+
+        async def move(user_id, source, target):
+            if is_active and is_active(user_id):
+                result["skipped_active"] += 1
+                return
+            async with semaphore:
+                try:
+                    await move_user(user_id, target, grace)
+                    result["moved"] += 1
+                except Exception as e:
+                    result["failed"] += 1
+                    rebalance_stats["last_error"] = str(e)
+                    logger.error("❌ فشل نقل المستخدم %s من %s إلى %s: %s", user_id, source, target, e,
+                                 extra=log_context("ledger", user_id=user_id))
+
+        await asyncio.gather(*(move(*entry) for entry in moves))
+
+    rebalance_stats["runs"] += 1
+    for key in ("moved", "skipped_active", "failed"):
+        rebalance_stats[key] += result[key]
+    rebalance_stats["last_run"] = result
+    return result
+
+async def shard_status() -> dict:
+    counts = await get_shard_counts() if DATABASE_SHARDS else {}
+    return {
+        **get_shard_stats(),
+        "users_per_shard": {shard: counts.get(shard, 0) for shard in SHARD_IDS},
+        "rebalance": rebalance_stats,
+    }
+
+
+async def _main(argv: list) -> int:
+    command = argv[0] if argv else "status"
+    if not DATABASE_SHARDS:
+        print("التقسيم غير مفعل: DATABASE_SHARDS فارغ")
+        return 1
+    if command == "backfill":
+        await backfill_directory()
+    elif command == "rebalance":
+        limit = int(argv[argv.index("--limit") + 1]) if "--limit" in argv else REBALANCE_LIMIT
+        if "--dry-run" in argv:
+            for user_id, source, target in await plan_rebalance(limit):
+                print(f"{user_id}: {source} → {target}")
+            return 0
+        # التطبيق متوقف: لا عمليات جارية تنتظر
+        print(json.dumps(await rebalance(limit, grace=0), ensure_ascii=False))
+    elif command == "move" and len(argv) == 3:
+        balance = await move_user(int(argv[1]), int(argv[2]), grace=0)
+        print(f"🔀 نُقل المستخدم {argv[1]} إلى القاعدة {argv[2]} (الرصيد {balance})")
+    elif command == "status":
+        print(json.dumps(await shard_status(), ensure_ascii=False, indent=2, default=str))
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
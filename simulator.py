@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+محاكي Monte Carlo لاقتصاد اللعبة وحمل التسوية
+
+يعيد تشغيل ملايين الجولات دفعة واحدة باستخدام NumPy وبنفس قواعد game_rules:
+نتيجة منتظمة بين RESULT_MIN و RESULT_MAX، صرف تلقائي بالمضاعف المستهدف بالضبط
+إذا وصل إليه المنحنى، صرف يدوي يصل بعد زمن رد الفعل (--manual-latency) فيأخذ
+مضاعف المنحنى في تلك اللحظة إن لم تنفجر الجولة قبلها، وتسوية الرهانات غير
+المصروفة بالنتيجة النهائية.
+
+الاستراتيجيات: hold (بلا صرف)، fixed:هدف، uniform:أدنى:أعلى (صرف تلقائي)،
+manual:أدنى:أعلى (يضغط الصرف عند رؤية مضاعف عشوائي في المدى).
+
+الاستخدام:
+    python simulator.py --rounds 1000000 --bettors 40 \\
+        --strategy "hold=0.2,fixed:2=0.4,uniform:1.2:6=0.2,manual:1.5:4=0.2"
+
+يتطلب numpy (pip install numpy).
+"""
+
+import sys
+import time
+import argparse
+import numpy as np
+from config import BET_OPTIONS
+from game_rules import RESULT_MIN, RESULT_MAX, GROWTH_BASE, COUNTING_DURATION
+from auto_cashout import MIN_AUTO_CASHOUT
+
+# الصفوف المكتوبة في قاعدة البيانات لكل مسار في main.py (بلا تقسيم).
+# tests/test_simulator.py يعدها من أوامر SQLite الفعلية لنفس الاستدعاءات، فأي تغيير
+# في مسارات الكتابة يظهر هناك. سجل النشاط (/history) في الذاكرة فلا يكتب شيئاً.
+# تحويلات المستخدمين (وقيود المقاصة بين القواعد) ليست جزءاً من الجولة فلا تُحاكى.
+WRITES_PER_ROUND = 4            # result_chains.used + create_round + update_round_result
+                                # + finish_round (ملخص التعرض في نفس الأمر)
+WRITES_PER_BET = 9              # مفتاح التكرار (حجز + استجابة) + قيد + معاملة + add_bet
+                                # + user_stats + 3×leaderboard
+WRITES_PER_MANUAL_CASHOUT = 8   # مفتاح التكرار (حجز + استجابة) + قيد + معاملة
+                                # + user_stats + 3×leaderboard
+WRITES_PER_AUTO_CASHOUT = 6     # قيد + معاملة + user_stats + 3×leaderboard (دفعة واحدة لكل نبضة)
+WRITES_PER_SETTLEMENT = 6       # مثل الصرف التلقائي (دفعة واحدة لكل جولة، والرسالة بعدها)
+CHUNK_ROUNDS = 100_000
+
+
+def parse_strategies(spec: str):
+    """تحليل مزيج الاستراتيجيات: 'hold=0.3,fixed:2=0.5,uniform:1.2:6=0.2'"""
+    strategies = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, weight = part.partition("=")
+        kind, *params = name.split(":")
+        if kind not in ("hold", "fixed", "uniform", "manual"):
+            raise ValueError(f"استراتيجية غير معروفة: {kind}")
+        strategies.append((kind, [float(p) for p in params], float(weight or 1)))
+    total = sum(w for _, _, w in strategies)
+    return [(kind, params, w / total) for kind, params, w in strategies]
+
+def sample_targets(rng, shape, strategies):
+    """(المضاعف المستهدف لكل رهان (inf = عدم الصرف), قناع الصرف اليدوي)"""
+    choice = rng.choice(len(strategies), size=shape, p=[w for _, _, w in strategies])
+    targets = np.full(shape, np.inf)
+    manual = np.zeros(shape, dtype=bool)
+    for i, (kind, params, _) in enumerate(strategies):
+        mask = choice == i
+        if kind == "fixed":
+            targets[mask] = params[0]
+        elif kind in ("uniform", "manual"):
+            targets[mask] = rng.uniform(params[0], params[1], size=mask.sum())
+        if kind == "manual":
+            manual |= mask
+    return targets, manual
+
+def simulate_chunk(rng, rounds, bettors_mean, max_bettors, bet_weights, strategies, manual_latency=0.3):
+    """محاكاة دفعة من الجولات. تعيد مصفوفات لكل جولة"""
+    results = np.round(rng.uniform(RESULT_MIN, RESULT_MAX, size=rounds), 2)
+    counts = np.minimum(rng.poisson(bettors_mean, size=rounds), max_bettors)
+    # عرض المصفوفة = أكبر عدد لاعبين فعلي في الدفعة وليس الحد الأقصى
+    width = max(int(counts.max()), 1)
+    active = np.arange(width)[None, :] < counts[:, None]
+
+    amounts = rng.choice(np.asarray(BET_OPTIONS), size=(rounds, width), p=bet_weights)
+    amounts = np.where(active, amounts, 0)
+    targets, manual = sample_targets(rng, (rounds, width), strategies)
+
+    # الصرف التلقائي يدفع الهدف نفسه إذا وصل إليه المنحنى قبل النهاية
+    r = results[:, None]
+    auto_targets = np.round(np.maximum(targets, MIN_AUTO_CASHOUT), 2)
+    # اليدوي يصل بعد manual_latency ثانية من رؤية الهدف: المنحنى الأسي تقدم بنسبة ثابتة،
+    # والطلب الذي يصل عند الانفجار أو بعده مرفوض فيُسوى الرهان بالنتيجة
+    manual_targets = np.round(targets * GROWTH_BASE ** (manual_latency / COUNTING_DURATION), 2)
+    targets = np.where(manual, manual_targets, auto_targets)
+    cashed = active & np.where(manual, targets < r, targets <= r)
+
+    multiplier = np.where(cashed, targets, r)
+    payouts = np.where(active, np.floor(amounts * multiplier), 0).astype(np.int64)
+
+    n_manual = (cashed & manual).sum(axis=1)
+    n_auto = cashed.sum(axis=1) - n_manual
+    n_settled = counts - n_auto - n_manual
+    return {
+        "results": results,
+        "bettors": counts,
+        "wagered": amounts.sum(axis=1),
+        "paid": payouts.sum(axis=1),
+        "cashouts": n_auto,
+        "manual_cashouts": n_manual,
+        "settlements": n_settled,
+        "writes": WRITES_PER_ROUND + counts * WRITES_PER_BET + n_auto * WRITES_PER_AUTO_CASHOUT
+                  + n_manual * WRITES_PER_MANUAL_CASHOUT + n_settled * WRITES_PER_SETTLEMENT,
+    }
+
+def simulate(rounds, bettors_mean, max_bettors, bet_weights, strategies, seed=None, manual_latency=0.3):
+    """محاكاة rounds جولة على دفعات لتحديد استهلاك الذاكرة"""
+    rng = np.random.default_rng(seed)
+    chunks = []
+    for start in range(0, rounds, CHUNK_ROUNDS):
+        size = min(CHUNK_ROUNDS, rounds - start)
+        chunks.append(simulate_chunk(rng, size, bettors_mean, max_bettors, bet_weights, strategies,
+                                     manual_latency))
+    return {key: np.concatenate([c[key] for c in chunks]) for key in chunks[0]}
+
+def _percentiles(values):
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return f"متوسط {values.mean():,.1f} | p50 {p50:,.0f} | p95 {p95:,.0f} | p99 {p99:,.0f} | أقصى {values.max():,.0f}"
+
+def report(stats, elapsed):
+    wagered = stats["wagered"].sum()
+    paid = stats["paid"].sum()
+    house = stats["wagered"] - stats["paid"]
+    rounds = len(stats["results"])
+
+    print("=" * 60)
+    print(f"🎲 الجولات: {rounds:,} في {elapsed:.2f} ثانية ({rounds / elapsed:,.0f} جولة/ثانية)")
+    print(f"👥 اللاعبون/جولة: {_percentiles(stats['bettors'])}")
+    print(f"💰 الرهانات/جولة: {_percentiles(stats['wagered'])}")
+    print(f"🏆 المدفوع/جولة: {_percentiles(stats['paid'])}")
+    print(f"🏦 ربح البيت/جولة: {_percentiles(house)}")
+    print(f"📈 نسبة العائد للاعبين (RTP): {paid / wagered:.4f}" if wagered else "📈 لا توجد رهانات")
+    print(f"💸 تضخم الأرصدة الكلي: {paid - wagered:,}")
+    print(f"🔁 صرف تلقائي/جولة: {_percentiles(stats['cashouts'])}")
+    print(f"✋ صرف يدوي/جولة: {_percentiles(stats['manual_cashouts'])}")
+    print(f"🧾 تسويات/جولة: {_percentiles(stats['settlements'])}")
+    print(f"✍️ أوامر كتابة/جولة: {_percentiles(stats['writes'])}")
+    print("=" * 60)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="محاكي اقتصاد لعبة Aviator")
+    parser.add_argument("--rounds", type=int, default=1_000_000)
+    parser.add_argument("--bettors", type=float, default=20, help="متوسط عدد اللاعبين لكل جولة (Poisson)")
+    parser.add_argument("--max-bettors", type=int, default=200)
+    parser.add_argument("--bet-weights", default="", help="أوزان BET_OPTIONS مفصولة بفواصل")
+    parser.add_argument("--strategy", default="hold=0.2,fixed:2=0.4,uniform:1.2:6=0.2,manual:1.5:4=0.2")
+    parser.add_argument("--manual-latency", type=float, default=0.3,
+                        help="ثواني رد الفعل والشبكة بين رؤية المضاعف ووصول طلب الصرف اليدوي")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.bet_weights:
+        weights = np.array([float(w) for w in args.bet_weights.split(",")])
+        if len(weights) != len(BET_OPTIONS):
+            parser.error(f"عدد الأوزان يجب أن يساوي {len(BET_OPTIONS)}")
+    else:
+        weights = np.ones(len(BET_OPTIONS))
+    weights = weights / weights.sum()
+
+    started = time.perf_counter()
+    stats = simulate(args.rounds, args.bettors, args.max_bettors, weights,
+                     parse_strategies(args.strategy), args.seed, args.manual_latency)
+    report(stats, time.perf_counter() - started)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
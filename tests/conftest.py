@@ -0,0 +1,24 @@
+"""
+إعداد الاختبارات: قاعدة SQLite جديدة في مجلد مؤقت لكل اختبار
+
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+import asyncio
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('ADMIN_ID', '1')
+os.environ.pop('DATABASE_URL', None)
+os.environ.pop('DATABASE_SHARDS', None)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """game.db فارغة (المسار نسبي فيكفي تغيير المجلد)"""
+    import database
+    monkeypatch.chdir(tmp_path)
+    asyncio.run(database.init_db())
+    return database
@@ -0,0 +1,37 @@
+"""سجل النشاط: أوقات الحركات من ساعة المحرك بتوقيت القاعدة (UTC)"""
+
+import asyncio
+from datetime import datetime, timezone
+import clock
+from activity import ActivityLog
+
+
+def test_record_uses_engine_clock():
+    start = datetime(2026, 3, 1, 12, 30, 5, tzinfo=timezone.utc)
+    previous = clock.use_clock(clock.VirtualClock(start.astimezone().replace(tzinfo=None)))
+    try:
+        log = ActivityLog(size=5, users=10)
+        log.load(10, [])
+        log.record(10, -50, "bet", "رهان")
+        log.record(99, 50, "win", "غير محمل")
+    finally:
+        clock.use_clock(previous)
+    assert [entry["created_at"] for entry in log.recent(10)] == ["2026-03-01 12:30:05"]
+    assert log.recent(99) is None
+
+
+def test_hydrated_rows_line_up_with_recorded_entries(db):
+    import activity
+
+    async def scenario():
+        await db.create_user(10)
+        await db.post_ledger_many([(db.MINT_ACCOUNT, 10, 100, 'admin_add', 'رصيد')])
+        activity.activity_log.rings.pop(10, None)
+        await activity.get_activity(10)   # تحميل من القاعدة
+        activity.record_postings([(10, db.HOUSE_ACCOUNT, 40, 'bet', 'رهان')])
+        return await activity.get_activity(10)
+
+    recorded, hydrated = asyncio.run(scenario())
+    parse = lambda entry: datetime.strptime(entry["created_at"], '%Y-%m-%d %H:%M:%S')
+    assert [entry["type"] for entry in (recorded, hydrated)] == ["bet", "admin_add"]
+    assert 0 <= (parse(recorded) - parse(hydrated)).total_seconds() < 5
@@ -0,0 +1,27 @@
+"""التصدير التدريجي: أفق EXPORT_LAG_SECONDS بتوقيت القاعدة (UTC) أياً كانت المنطقة المحلية"""
+
+import time
+import asyncio
+from datetime import timedelta
+import clock
+import export
+
+
+def test_lag_holds_back_fresh_rows_east_of_utc(db, tmp_path, monkeypatch):
+    monkeypatch.setenv('TZ', 'Asia/Riyadh')
+    time.tzset()
+    monkeypatch.setattr(export, 'EXPORT_DIR', str(tmp_path / 'exports'))
+
+    async def scenario():
+        await db.create_user(10)
+        await db.post_ledger_many([(db.MINT_ACCOUNT, 10, 100, 'admin_add', 'رصيد')])
+        fresh = await export.export_table('transactions', export_format='csv')
+        later = await export.export_table('transactions', export_format='csv',
+                                          now=clock.utcnow() + timedelta(seconds=export.EXPORT_LAG_SECONDS + 1))
+        return fresh, later
+
+    try:
+        assert asyncio.run(scenario()) == (0, 1)
+    finally:
+        monkeypatch.delenv('TZ')
+        time.tzset()
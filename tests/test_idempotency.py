@@ -0,0 +1,47 @@
+"""منع التكرار: الفشل قبل أي قيد يلغي حجز المفتاح، وبعده يبقيه فلا يتكرر الخصم"""
+
+import asyncio
+import pytest
+
+
+def test_failure_before_posting_releases_key(db):
+    from idempotency import run_once, idempotency_cache
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        return ({"error": "تعذر"}, 503) if len(calls) == 1 else {"success": True}
+
+    async def scenario():
+        first = await run_once("bet", 10, "k-release", handler)
+        second = await run_once("bet", 10, "k-release", handler)
+        return first, second
+
+    idempotency_cache.entries.clear()
+    assert asyncio.run(scenario()) == (({"error": "تعذر"}, 503), {"success": True})
+    assert len(calls) == 2
+
+
+def test_failure_after_posting_keeps_key(db):
+    from idempotency import run_once, mark_committed, idempotency_cache, COMMITTED_ERROR_RESPONSE
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        await db.post_ledger_many([(10, db.HOUSE_ACCOUNT, 50, 'bet', 'رهان')])
+        mark_committed()
+        raise RuntimeError("add_bet")
+
+    async def scenario():
+        await db.create_user(10)
+        await db.post_ledger_many([(db.MINT_ACCOUNT, 10, 100, 'admin_add', 'رصيد')])
+        with pytest.raises(RuntimeError):
+            await run_once("bet", 10, "k-keep", handler)
+        idempotency_cache.entries.clear()   # الإعادة بعد إعادة التشغيل تقرأ المفتاح من القاعدة
+        retry = await run_once("bet", 10, "k-keep", handler)
+        return retry, await db.get_balance(10)
+
+    retry, balance = asyncio.run(scenario())
+    assert tuple(retry) == COMMITTED_ERROR_RESPONSE
+    assert balance == 50
+    assert len(calls) == 1
@@ -0,0 +1,42 @@
+"""TopK: نفس نتيجة الترتيب الكامل مع تحديثات عشوائية صاعدة ونازلة"""
+
+import random
+from leaderboard import TopK
+
+
+def expected(scores: dict, k: int) -> list:
+    return [{"rank": rank, "user_id": user_id, "value": score}
+            for rank, (score, user_id) in enumerate(
+                sorted(((s, u) for u, s in scores.items()), key=lambda e: (-e[0], e[1]))[:k], start=1)]
+
+
+def test_matches_full_sort_under_random_updates():
+    rng = random.Random(7)
+    board = TopK(5)
+    for _ in range(5000):
+        user_id = rng.randrange(200)
+        if rng.random() < 0.7:
+            board.add(user_id, -rng.randrange(1, 50))     # رهان
+        else:
+            board.add(user_id, rng.randrange(1, 400))     # ربح
+        assert board.items() == expected(board.scores, 5)
+
+
+def test_falling_leader_does_not_rescan_every_time():
+    board = TopK(3)
+    for user_id in range(1000):
+        board.set(user_id, user_id)
+    rescans = 0
+    original = board._rescan
+
+    def counting_rescan():
+        nonlocal rescans
+        rescans += 1
+        original()
+
+    board._rescan = counting_rescan
+    for step in range(300):
+        leader = board.items()[0]["user_id"]
+        board.add(leader, -2000)
+    assert rescans <= 300 // 3 + 1
+    assert board.items() == expected(board.scores, 3)
@@ -0,0 +1,98 @@
+"""دفتر القيد المزدوج: التحويل والرهان والربح، رفض السحب فوق الرصيد، تأخير التثبيت، واستئناف التحقق"""
+
+import asyncio
+import pytest
+import ledger
+from ledger import LedgerVerifier
+
+
+async def fund(db, user_id: int, amount: int):
+    await db.create_user(user_id)
+    await db.post_ledger_many([(db.MINT_ACCOUNT, user_id, amount, 'admin_add', 'رصيد')])
+
+
+def test_transfer_bet_and_payout_postings(db):
+    async def scenario():
+        await fund(db, 10, 1000)
+        await db.create_user(20)
+        await db.post_ledger_many([(10, 20, 300, 'transfer', 'تحويل')])
+        await db.post_ledger_many([(20, db.HOUSE_ACCOUNT, 100, 'bet', 'رهان')])
+        await db.post_payouts([(db.HOUSE_ACCOUNT, 20, 250, 'win', 'فوز')])
+        balances = [await db.get_balance(10), await db.get_balance(20)]
+        history = await db.get_user_transactions(20, 10)
+        return balances, history
+
+    balances, history = asyncio.run(scenario())
+    assert balances == [700, 450]
+    assert [(row["type"], row["amount"]) for row in history] == [("win", 250), ("bet", -100), ("transfer", 300)]
+
+
+def test_checkpoint_skips_postings_newer_than_lag(db):
+    async def scenario():
+        await fund(db, 10, 500)
+        held = await db.checkpoint_ledger(3600)
+        taken = await db.checkpoint_ledger(0)
+        return held, taken, await db.get_account_balances(), await db.get_balance(10)
+
+    held, taken, snapshot, balance = asyncio.run(scenario())
+    assert held == 0
+    assert taken == 1
+    assert snapshot[10] == 500
+    assert balance == 500
+
+
+def test_verifier_resumes_from_state_file(db, tmp_path, monkeypatch):
+    ranges = []
+    deltas = ledger.get_ledger_range_deltas
+
+    async def recording(after_id, upto_id, shard=None):
+        ranges.append((after_id, upto_id))
+        return await deltas(after_id, upto_id, shard)
+
+    monkeypatch.setattr(ledger, 'get_ledger_range_deltas', recording)
+    state_path = str(tmp_path / 'verify.json')
+
+    async def scenario():
+        await fund(db, 10, 500)
+        await db.checkpoint_ledger(0)
+        first = LedgerVerifier(state_path)
+        assert await first.run() == []
+
+        await db.post_ledger_many([(10, db.HOUSE_ACCOUNT, 200, 'bet', 'رهان')])
+        await db.checkpoint_ledger(0)
+        resumed = LedgerVerifier(state_path)
+        problems = await resumed.run()
+        return first.verified_id, resumed, problems
+
+    verified_before, resumed, problems = asyncio.run(scenario())
+    assert problems == []
+    assert ranges[-1] == (verified_before, resumed.verified_id)
+    assert len(ranges) == 2
+    assert resumed.balances[10] == 300
+    assert sum(resumed.balances.values()) == 0
+
+
+def test_rejects_overdraft_posting(db):
+    async def scenario():
+        await fund(db, 10, 50)
+        await db.create_user(20)
+        with pytest.raises(db.InsufficientFunds) as rejected:
+            await db.post_ledger_many([(10, 20, 80, 'transfer', 'تحويل')])
+        return rejected.value.balance, await db.get_balance(10), await db.get_user_transactions(20, 10)
+
+    balance, after, history = asyncio.run(scenario())
+    assert (balance, after, history) == (50, 50, [])
+
+
+def test_concurrent_bets_cannot_overdraw(db):
+    async def scenario():
+        await fund(db, 10, 100)
+        results = await asyncio.gather(
+            *(db.post_ledger_many([(10, db.HOUSE_ACCOUNT, 60, 'bet', 'رهان')]) for _ in range(2)),
+            return_exceptions=True
+        )
+        return results, await db.get_balance(10)
+
+    results, balance = asyncio.run(scenario())
+    assert sorted(type(result).__name__ for result in results) == ['InsufficientFunds', 'NoneType']
+    assert balance == 40
@@ -0,0 +1,49 @@
+"""سلسلة النتائج بعد أرشفة الجولات: لا تُعاد بذرة مكشوفة، والتحقق يشمل الأرشيف"""
+
+import asyncio
+from datetime import timedelta
+import clock
+import maintenance
+from result_chain import ResultEngine, verify_all
+
+
+async def play_rounds(db, engine: ResultEngine, count: int) -> list:
+    seeds = []
+    for _ in range(count):
+        seed = await engine.draw('main')
+        round_id = await db.create_round('main', seed.chain_id, seed.index)
+        await db.update_round_result(round_id, seed.result, seed.seed)
+        await db.finish_round(round_id)
+        seeds.append(seed)
+    return seeds
+
+
+def test_used_survives_archival_and_restart(db):
+    async def scenario():
+        engine = ResultEngine(length=50, refill=5)
+        played = await play_rounds(db, engine, 10)
+        archived = await maintenance.archive_table('rounds', now=clock.utcnow() + timedelta(days=365))
+
+        restarted = ResultEngine(length=50, refill=5)
+        await restarted.load()
+        after = await play_rounds(db, restarted, 3)
+        return played, archived, after, await verify_all(workers=1)
+
+    played, archived, after, report = asyncio.run(scenario())
+    assert archived == 10
+    assert [seed.index for seed in after] == [10, 11, 12]
+    assert not {seed.seed for seed in after} & {seed.seed for seed in played}
+    assert report["rounds"] == 13
+    assert report["archived"] == 10
+    assert report["failed"] == 0
+
+
+def test_chains_report_durable_used(db):
+    async def scenario():
+        engine = ResultEngine(length=20, refill=2)
+        await engine.draw('main')
+        await engine.draw('main')
+        return await db.get_result_chains()
+
+    chains = asyncio.run(scenario())
+    assert [chain["used"] for chain in chains] == [2]
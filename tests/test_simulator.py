@@ -0,0 +1,90 @@
+"""ثوابت الكتابة في simulator.py معدودة من أوامر SQLite الفعلية لمسارات main.py"""
+
+import re
+import asyncio
+import pytest
+
+np = pytest.importorskip("numpy")
+import simulator
+from leaderboard import current_period_keys
+from result_chain import ResultEngine
+
+WRITE = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.I)
+
+
+@pytest.fixture
+def writes(db, monkeypatch):
+    """عدّاد أوامر الكتابة على كل اتصال SQLite"""
+    statements = []
+    connect = db.sqlite_connect
+
+    def traced(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        conn.set_trace_callback(lambda sql: statements.append(sql) if WRITE.match(sql) else None)
+        return conn
+
+    monkeypatch.setattr(db, 'sqlite_connect', traced)
+    return statements
+
+
+def test_write_constants_match_code_paths(db, writes):
+    async def counted(path) -> int:
+        writes.clear()
+        await path()
+        return len(writes)
+
+    async def scenario():
+        await db.create_user(10)
+        await db.post_ledger_many([(db.MINT_ACCOUNT, 10, 10000, 'credit', 'رصيد')])
+        engine = ResultEngine(length=20, refill=2)
+        await engine.draw('main')   # أول سحب يولد السلسلة: مرة لكل سلسلة لا لكل جولة
+        periods = current_period_keys()
+
+        # start_new_round → start_counting → end_round
+        async def round_path():
+            seed = await engine.draw('main')
+            round_id = await db.create_round('main', seed.chain_id, seed.index)
+            await db.update_round_result(round_id, seed.result, seed.seed)
+            await db.finish_round(round_id, 1, 10, 20, 10, 30)
+
+        round_id = await db.create_round('main')
+
+        # /api/bet مع Idempotency-Key
+        async def bet_path():
+            await db.claim_idempotency_key('bet', 10, 'b1')
+            await db.post_ledger_many([(10, db.HOUSE_ACCOUNT, 10, 'bet', 'رهان')])
+            await db.add_bet(10, round_id, 10)
+            await db.record_bet_stats(10, 10, periods)
+            await db.record_idempotent_response('bet', 10, 'b1', '{}')
+
+        # /api/cashout مع Idempotency-Key (process_bet_cashout)
+        async def manual_path():
+            await db.claim_idempotency_key('cashout', 10, 'c1')
+            await db.post_payouts([(db.HOUSE_ACCOUNT, 10, 20, 'win', 'فوز')])
+            await db.record_win_stats(10, 20, 2.0, periods)
+            await db.record_idempotent_response('cashout', 10, 'c1', '{}')
+
+        # process_auto_cashouts و process_final_bets: دفعة لكل الرابحين
+        async def batch_path():
+            await db.post_payouts([(db.HOUSE_ACCOUNT, 10, 20, 'win', 'فوز'), (db.HOUSE_ACCOUNT, 10, 30, 'win', 'فوز')])
+            await db.record_win_stats_many([(10, 20, 2.0), (10, 30, 3.0)], periods)
+
+        return (await counted(round_path), await counted(bet_path),
+                await counted(manual_path), await counted(batch_path) / 2)
+
+    round_writes, bet_writes, manual_writes, batch_writes = asyncio.run(scenario())
+    assert round_writes == simulator.WRITES_PER_ROUND
+    assert bet_writes == simulator.WRITES_PER_BET
+    assert manual_writes == simulator.WRITES_PER_MANUAL_CASHOUT
+    assert batch_writes == simulator.WRITES_PER_AUTO_CASHOUT == simulator.WRITES_PER_SETTLEMENT
+
+
+def test_manual_cashout_arrives_after_latency():
+    weights = np.ones(len(simulator.BET_OPTIONS)) / len(simulator.BET_OPTIONS)
+    strategies = simulator.parse_strategies("manual:1.5:2")
+    quick = simulator.simulate(20000, 10, 50, weights, strategies, seed=3, manual_latency=0)
+    slow = simulator.simulate(20000, 10, 50, weights, strategies, seed=3, manual_latency=5)
+    assert quick["cashouts"].sum() == slow["cashouts"].sum() == 0
+    assert slow["manual_cashouts"].sum() < quick["manual_cashouts"].sum()
+    total = quick["bettors"].sum()
+    assert (quick["manual_cashouts"] + quick["settlements"]).sum() == total
@@ -0,0 +1,77 @@
+"""single_flight و forgets: الكتابة لا تترك قراءة قديمة جارية للمستدعين بعدها"""
+
+import asyncio
+from database import single_flight, forgets, single_flight_forget, _in_flight
+
+store = {}
+gates = {}
+
+
+@single_flight
+async def read_value(key: str, scale: int = 1):
+    value = store.get(key)
+    await gates['read'].wait()
+    return value * scale
+
+@forgets(lambda a: [('read_value', a['key'])])
+async def write_value(key: str, value: int):
+    await gates['write'].wait()
+    store[key] = value
+
+
+def test_read_overlapping_write_is_not_shared_after_commit():
+    async def scenario():
+        store.clear()
+        store['a'] = 1
+        gates['read'], gates['write'] = asyncio.Event(), asyncio.Event()
+
+        write = asyncio.create_task(write_value('a', 2))
+        await asyncio.sleep(0)                      # الكتابة بدأت ولم تُحفظ
+        stale = asyncio.create_task(read_value('a'))
+        await asyncio.sleep(0)                      # قراءة جارية بالقيمة القديمة
+
+        gates['write'].set()
+        await write                                 # حُفظت الكتابة
+        fresh = asyncio.create_task(read_value('a'))
+        await asyncio.sleep(0)
+
+        gates['read'].set()
+        return await stale, await fresh
+
+    stale, fresh = asyncio.run(scenario())
+    assert stale == 1
+    assert fresh == 2
+
+
+def test_keyword_and_positional_calls_share_and_forget():
+    async def scenario():
+        store.clear()
+        store['b'] = 3
+        gates['read'] = asyncio.Event()
+
+        first = asyncio.create_task(read_value(key='b'))
+        second = asyncio.create_task(read_value('b', 1))
+        await asyncio.sleep(0)
+        assert len([k for k in _in_flight if k[0] == 'read_value']) == 1
+
+        single_flight_forget('read_value', 'b')
+        assert not [k for k in _in_flight if k[0] == 'read_value']
+
+        gates['read'].set()
+        return await first, await second
+
+    assert asyncio.run(scenario()) == (3, 3)
+
+
+def test_balance_after_posting(db):
+    async def scenario():
+        await db.create_user(10)
+        before, _ = await asyncio.gather(
+            db.get_balance(10),
+            db.post_ledger_many([(db.MINT_ACCOUNT, 10, 500, 'admin_add', 'test')]),
+        )
+        return before, await db.get_balance(user_id=10)
+
+    before, after = asyncio.run(scenario())
+    assert before in (0, 500)
+    assert after == 500
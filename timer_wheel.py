@@ -0,0 +1,150 @@
+"""
+مجدول عجلة التوقيت الهرمية (hierarchical timer wheel)
+
+مؤقتات كل الغرف في مجدول واحد: الإضافة O(1) بحساب المستوى والخانة مباشرة،
+والانتهاء O(1) لكل مؤقت بتفريغ خانة المستوى الأول في كل نبضة. المؤقتات البعيدة
+تُحفظ في مستويات أعلى بدقة أقل وتنزل (cascade) إلى المستوى الأدنى عند اقترابها.
+
+مع 64 خانة و 4 مستويات ونبضة 0.05 ثانية يغطي المجدول قرابة 9 أيام.
+"""
+
+import time
+import math
+import asyncio
+import logging
+from log_pipeline import log_context
+
+logger = logging.getLogger(__name__)
+
+
+class TimerHandle:
+    """مؤقت مجدول (الإلغاء كسول: يُتجاهل عند انتهائه)"""
+
+    __slots__ = ("expires", "callback", "args", "cancelled")
+
+    def __init__(self, expires: int, callback, args: tuple):
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """عجلة توقيت هرمية بنبضة ثابتة"""
+
+    def __init__(self, tick: float = 0.05, slot_bits: int = 6, levels: int = 4):
+        self.tick = tick
+        self.slot_bits = slot_bits
+        self.mask = (1 << slot_bits) - 1
+        self.levels = levels
+        self.wheels = [[[] for _ in range(1 << slot_bits)] for _ in range(levels)]
+        self.overflow = []        # مؤقتات أبعد من مدى العجلة
+        self.current = 0          # عدد النبضات المنقضية
+        self.started = None
+        self._tasks = set()
+        self.stats = {
+            "scheduled": 0,
+            "fired": 0,
+            "cancelled": 0,
+            "errors": 0,
+            "max_lag_ms": 0.0,
+        }
+
+    def schedule(self, delay: float, callback, *args) -> TimerHandle:
+        """تشغيل callback(*args) بعد delay ثانية (تقريباً لأعلى إلى النبضة التالية)"""
+        ticks = max(1, math.ceil(delay / self.tick))
+        handle = TimerHandle(self.current + ticks, callback, args)
+        self._insert(handle)
+        self.stats["scheduled"] += 1
+        return handle
+
+    def _insert(self, handle: TimerHandle):
+        delta = handle.expires - self.current
+        for level in range(self.levels):
+            if delta < 1 << (self.slot_bits * (level + 1)):
+                slot = (handle.expires >> (self.slot_bits * level)) & self.mask
+                self.wheels[level][slot].append(handle)
+                return
+        self.overflow.append(handle)
+
+    def _cascade(self, level: int):
+        """إنزال مؤقتات خانة المستوى level إلى المستويات الأدنى"""
+        slot = (self.current >> (self.slot_bits * level)) & self.mask
+        handles = self.wheels[level][slot]
+        self.wheels[level][slot] = []
+        for handle in handles:
+            self._insert(handle)
+
+    def advance(self):
+        """التقدم نبضة واحدة وتشغيل المؤقتات المنتهية"""
+        self.current += 1
+        # عند التفاف مستوى ننزل الخانة التالية من المستوى الأعلى
+        level = 1
+        while level < self.levels and (self.current >> (self.slot_bits * (level - 1))) & self.mask == 0:
+            self._cascade(level)
+            level += 1
+        if level == self.levels and self.overflow:
+            pending, self.overflow = self.overflow, []
+            for handle in pending:
+                self._insert(handle)
+
+        slot = self.current & self.mask
+        expired = self.wheels[0][slot]
+        self.wheels[0][slot] = []
+        for handle in expired:
+            if handle.cancelled:
+                self.stats["cancelled"] += 1
+                continue
+            self._fire(handle)
+
+    def _fire(self, handle: TimerHandle):
+        self.stats["fired"] += 1
+        try:
+            result = handle.callback(*handle.args)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error("❌ خطأ في مؤقت %s: %s", handle.callback.__name__, e, extra=log_context("round"))
+            return
+        # الدوال غير المتزامنة تعمل كمهام مستقلة حتى لا تؤخر بقية المؤقتات
+        if asyncio.iscoroutine(result):
+            task = asyncio.ensure_future(result)
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def pending(self) -> int:
+        return sum(len(slot) for wheel in self.wheels for slot in wheel) + len(self.overflow)
+
+    async def run(self):
+        """حلقة المجدول: نبضة كل tick مع تعويض النبضات الفائتة"""
+        self.started = time.monotonic() - self.current * self.tick
+        while True:
+            target = self.started + (self.current + 1) * self.tick
+            await asyncio.sleep(max(0.0, target - time.monotonic()))
+            due = int((time.monotonic() - self.started) / self.tick)
+            lag = (time.monotonic() - target) * 1000
+            if lag > self.stats["max_lag_ms"]:
+                self.stats["max_lag_ms"] = round(lag, 2)
+            while self.current < due:
+                self.advance()
+
+    async def run_virtual(self, clock, seconds: float, until=None):
+        """تشغيل بساعة افتراضية (clock.VirtualClock) دون نوم: كل نبضة تقدم الساعة وتنتظر
+        مهام مؤقتاتها قبل التالية. يتوقف بعد seconds أو عندما يعيد until() True"""
+        for _ in range(math.ceil(seconds / self.tick)):
+            clock.advance(self.tick)
+            self.advance()
+            while self._tasks:
+                await asyncio.gather(*list(self._tasks), return_exceptions=True)
+            if until and until():
+                return
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "tick_ms": self.tick * 1000,
+            "pending": self.pending(),
+            "running_tasks": len(self._tasks),
+        }
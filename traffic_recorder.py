@@ -0,0 +1,242 @@
+"""
+تسجيل الحركة الحقيقية لإعادة تشغيلها في اختبارات الأداء (اختياري)
+
+عند تعيين TRAFFIC_RECORD_FILE تُسجَّل تحديثات /webhook واستدعاءات /api/*
+(عدا /api/admin) في ملف JSONL مضغوط، سطر لكل طلب:
+
+    {"t": الثواني منذ بدء التسجيل, "m": الطريقة, "p": المسار, "q": الاستعلام,
+     "b": الجسم, "s": الحالة, "ms": زمن الاستجابة}
+
+إخفاء الهوية: معرفات المستخدمين تُستبدل بمعرفات مستعارة ثابتة داخل الملف
+(HMAC بملح عشوائي لا يُحفظ فلا يمكن عكسها)، وتُحذف الأسماء ونصوص الرسائل
+الحرة ويبقى الأمر ومعاملاته القصيرة فقط. الترويسات لا تُسجَّل.
+
+إعادة التشغيل: python -m bench.replay run --log traffic.jsonl.gz
+"""
+
+import os
+import re
+import hmac
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from urllib.parse import parse_qsl, urlencode
+from log_pipeline import log_context
+
+logger = logging.getLogger(__name__)
+
+TRAFFIC_RECORD_FILE = os.getenv('TRAFFIC_RECORD_FILE', '').strip()
+TRAFFIC_RECORD_FLUSH = int(os.getenv('TRAFFIC_RECORD_FLUSH', '500'))
+
+# المعرفات المستعارة في نطاق لا يتداخل مع معرفات تيليجرام الحقيقية الصغيرة
+PSEUDONYM_BASE = 9_000_000_000
+PSEUDONYM_RANGE = 1_000_000_000
+
+USER_ID_KEYS = {"user_id", "to_user_id", "from_user_id"}
+SAFE_ARG = re.compile(r'^[A-Za-z0-9_.,\-]{1,32}$')
+NUMERIC_ID = re.compile(r'^\d{6,}$')
+
+recorder_stats = {
+    "enabled": bool(TRAFFIC_RECORD_FILE),
+    "recorded": 0,
+    "dropped": 0,
+    "flushes": 0,
+}
+
+
+class Anonymizer:
+    """استبدال معرفات المستخدمين بمعرفات مستعارة ثابتة"""
+
+    def __init__(self, salt: bytes = None):
+        self.salt = salt or os.urandom(16)
+
+    def user_id(self, value):
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            return value
+        if value <= 0:
+            return value   # حسابات النظام في الدفتر
+        digest = hmac.new(self.salt, str(value).encode(), hashlib.sha256).digest()
+        return PSEUDONYM_BASE + int.from_bytes(digest[:8], "big") % PSEUDONYM_RANGE
+
+    def text(self, text: str) -> str:
+        """الأوامر فقط: المعاملات القصيرة تبقى والمعرفات تُستبدل والنص الحر يُحذف"""
+        if not text or not text.startswith("/"):
+            return ""
+        parts = text.split()
+        kept = [parts[0].split("@")[0]]
+        for arg in parts[1:]:
+            if NUMERIC_ID.match(arg):
+                kept.append(str(self.user_id(arg)))
+            elif SAFE_ARG.match(arg):
+                kept.append(arg)
+        return " ".join(kept)
+
+    def _user(self, user: dict) -> dict:
+        return {
+            "id": self.user_id(user.get("id")),
+            "is_bot": user.get("is_bot", False),
+            "first_name": "User",
+            "language_code": user.get("language_code"),
+        }
+
+    def _message(self, message: dict) -> dict:
+        result = {
+            "message_id": message.get("message_id"),
+            "date": message.get("date"),
+            "chat": {"id": self.user_id(message["chat"]["id"]), "type": message["chat"].get("type", "private")},
+        }
+        if "from" in message:
+            result["from"] = self._user(message["from"])
+        if "text" in message:
+            result["text"] = self.text(message["text"])
+            command_length = len(result["text"].split()[0]) if result["text"] else 0
+            if command_length:
+                result["entities"] = [{"type": "bot_command", "offset": 0, "length": command_length}]
+        return result
+
+    def update(self, update: dict) -> dict:
+        result = {"update_id": update.get("update_id")}
+        if "message" in update:
+            result["message"] = self._message(update["message"])
+        if "callback_query" in update:
+            query = update["callback_query"]
+            result["callback_query"] = {
+                "id": query.get("id"),
+                "from": self._user(query["from"]),
+                "chat_instance": "0",
+                "data": query.get("data"),
+            }
+            if "message" in query:
+                result["callback_query"]["message"] = self._message(query["message"])
+        if "inline_query" in update:
+            query = update["inline_query"]
+            # نص الاستعلام معرف غرفة فقط؛ أي نص آخر يُحذف
+            text = query.get("query", "")
+            result["inline_query"] = {
+                "id": query.get("id"),
+                "from": self._user(query["from"]),
+                "query": text if SAFE_ARG.match(text) else "",
+                "offset": query.get("offset", ""),
+            }
+        return result
+
+    def path(self, path: str) -> str:
+        return "/".join(str(self.user_id(part)) if part.isdigit() else part for part in path.split("/"))
+
+    def query(self, query: str) -> str:
+        pairs = parse_qsl(query, keep_blank_values=True)
+        return urlencode([(k, self.user_id(v) if k in USER_ID_KEYS else v) for k, v in pairs])
+
+    def body(self, body: dict) -> dict:
+        return {k: self.user_id(v) if k in USER_ID_KEYS else v for k, v in body.items()}
+
+
+class TrafficLog:
+    """ملف التسجيل: تخزين مؤقت ثم كتابة مضغوطة في خيط منفصل"""
+
+    def __init__(self, path: str = TRAFFIC_RECORD_FILE, flush_every: int = TRAFFIC_RECORD_FLUSH):
+        self.path = path
+        self.flush_every = flush_every
+        self.anonymizer = Anonymizer()
+        self.started = time.monotonic()
+        self.buffer = []
+        self._flushing = set()
+
+    def record(self, scope, body: bytes, status: int, arrived: float):
+        try:
+            path = scope["path"]
+            data = json.loads(body) if body else None
+            if path == "/webhook":
+                data = self.anonymizer.update(data) if data else None
+            else:
+                path = self.anonymizer.path(path)
+                if isinstance(data, dict):
+                    data = self.anonymizer.body(data)
+            entry = {
+                "t": round(arrived - self.started, 4),
+                "m": scope["method"],
+                "p": path,
+                "q": self.anonymizer.query(scope.get("query_string", b"").decode()),
+                "b": data,
+                "s": status,
+                "ms": round((time.monotonic() - arrived) * 1000, 2),
+            }
+        except Exception:
+            recorder_stats["dropped"] += 1
+            return
+        self.buffer.append(entry)
+        recorder_stats["recorded"] += 1
+        if len(self.buffer) >= self.flush_every:
+            self.flush_soon()
+
+    def _write(self, entries: list):
+        # كل دفعة عضو gzip مستقل؛ الأعضاء المتتالية ملف gzip صالح
+        lines = "".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n" for e in entries)
+        with open(self.path, "ab") as f:
+            f.write(gzip.compress(lines.encode("utf-8")))
+        recorder_stats["flushes"] += 1
+
+    def flush_soon(self):
+        entries, self.buffer = self.buffer, []
+        task = asyncio.ensure_future(asyncio.to_thread(self._write, entries))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def close(self):
+        """كتابة ما تبقى عند الإيقاف"""
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
+        if self.buffer:
+            entries, self.buffer = self.buffer, []
+            self._write(entries)
+        logger.info("🎙️ سُجل %s طلب في %s", recorder_stats['recorded'], self.path, extra=log_context("traffic"))
+
+
+traffic_log = TrafficLog() if TRAFFIC_RECORD_FILE else None
+
+
+class TrafficRecorder:
+    """وسيط ASGI يمرر الطلبات ويسجل نسخة مجهولة الهوية منها في traffic_log"""
+
+    def __init__(self, app, log: TrafficLog = None):
+        self.app = app
+        self.log = log or traffic_log
+
+    @staticmethod
+    def should_record(scope) -> bool:
+        if scope["type"] != "http":
+            return False
+        path = scope["path"]
+        if path.startswith("/api/admin") or path == "/api/events":
+            return False   # واجهات الأدمن وبث الأحداث طويل العمر
+        return path == "/webhook" or path.startswith("/api/")
+
+    async def __call__(self, scope, receive, send):
+        if not self.log or not self.should_record(scope):
+            await self.app(scope, receive, send)
+            return
+
+        arrived = time.monotonic()
+        chunks = []
+        status = {"code": 0}
+
+        async def receive_and_capture():
+            message = await receive()
+            if message["type"] == "http.request":
+                chunks.append(message.get("body", b""))
+            return message
+
+        async def send_and_capture(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_and_capture, send_and_capture)
+        finally:
+            self.log.record(scope, b"".join(chunks), status["code"], arrived)
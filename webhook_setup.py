@@ -6,14 +6,14 @@
 import requests
 import sys
 import os
-from config import BOT_TOKEN, BASE_URL
+from config import BOT_TOKEN, BASE_URL, TELEGRAM_API_URL
 
 def set_webhook():
     """تعيين Webhook للبوت"""
     webhook_url = f"{BASE_URL}/webhook"
     
     response = requests.post(
-        f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook",
+        f"{TELEGRAM_API_URL}/bot{BOT_TOKEN}/setWebhook",
         json={
             "url": webhook_url,
             "max_connections": 40,
@@ -30,7 +30,7 @@ def set_webhook():
             
             # الحصول على معلومات Webhook
             info = requests.get(
-                f"https://api.telegram.org/bot{BOT_TOKEN}/getWebhookInfo"
+                f"{TELEGRAM_API_URL}/bot{BOT_TOKEN}/getWebhookInfo"
             ).json()
             
             print(f"\n📋 معلومات Webhook:")
@@ -49,7 +49,7 @@ def set_webhook():
 def delete_webhook():
     """حذف Webhook"""
     response = requests.post(
-        f"https://api.telegram.org/bot{BOT_TOKEN}/deleteWebhook"
+        f"{TELEGRAM_API_URL}/bot{BOT_TOKEN}/deleteWebhook"
     )
     
     if response.status_code == 200:
@@ -67,7 +67,7 @@ def delete_webhook():
 def get_webhook_info():
     """الحصول على معلومات Webhook"""
     response = requests.get(
-        f"https://api.telegram.org/bot{BOT_TOKEN}/getWebhookInfo"
+        f"{TELEGRAM_API_URL}/bot{BOT_TOKEN}/getWebhookInfo"
     )
     
     if response.status_code == 200: